@@ -2,6 +2,8 @@ import locale
 import os
 from pathlib import Path
 
+from project.settings.caches import check_shared_caches
+from project.settings.database import database_settings
 from project.settings.env import env
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
@@ -35,6 +37,12 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# Подсчёт транзакций на главной странице: exact, approx (оценка планировщика PostgreSQL) или none
+TRANSACTION_COUNT_MODE = env('TRANSACTION_COUNT_MODE', default='approx')
+
+# Cache-Control справочников (статусы, типы, категории): сколько секунд клиент может не перепроверять ETag
+HTTP_CACHE_REFERENCE_MAX_AGE = env.int('HTTP_CACHE_REFERENCE_MAX_AGE', default=60)
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'ДДС Управление',
     'DESCRIPTION': 'Веб-сервис для управления движением денежных средств (ДДС)',
@@ -43,6 +51,8 @@ SPECTACULAR_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    # Первым, чтобы время ответа включало остальные middleware (см. transit_managment/metrics.py)
+    'transit_managment.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -74,55 +84,50 @@ if DEBUG:
     INSTALLED_APPS += ['silk']
     MIDDLEWARE += ['silk.middleware.SilkyMiddleware']
 
-WSGI_APPLICATION = 'project.wsgi.application'
-
-
-DATABASE_ENGINE = env('ENGINE', default='django.db.backends.sqlite3')
-
-POSTGRES_DB = env('POSTGRES_DB', default='postgres')
-POSTGRES_USER = env('POSTGRES_USER', default='postgres')
-POSTGRES_PASSWORD = env('POSTGRES_PASSWORD', default='postgres')
-POSTGRES_HOST = env('POSTGRES_HOST', default='postgres')
-POSTGRES_PORT = env.int('POSTGRES_PORT', default=5432)
-
-
-if DATABASE_ENGINE == 'django.db.backends.postgresql':
-    try:
-        import psycopg2
-
-        connection = psycopg2.connect(
-            dbname=POSTGRES_DB,
-            user=POSTGRES_USER,
-            password=POSTGRES_PASSWORD,
-            host=POSTGRES_HOST,
-            port=POSTGRES_PORT,
-        )
-        connection.close()
-
-        DATABASES = {
-            'default': {
-                'ENGINE': DATABASE_ENGINE,
-                'NAME': POSTGRES_DB,
-                'USER': POSTGRES_USER,
-                'PASSWORD': POSTGRES_PASSWORD,
-                'HOST': POSTGRES_HOST,
-                'PORT': POSTGRES_PORT,
-            }
-        }
-    except (ImportError, psycopg2.OperationalError):
-        DATABASES = {
-            'default': {
-                'ENGINE': 'django.db.backends.sqlite3',
-                'NAME': BASE_DIR / 'db.sqlite3',
-            }
-        }
-else:
-    DATABASES = {
-        'default': {
-            'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': BASE_DIR / 'db.sqlite3',
-        }
-    }
+WSGI_APPLICATION = 'project.django.wsgi.application'
+ASGI_APPLICATION = 'project.django.asgi.application'
+
+
+# ENGINE, POSTGRES_*, пул (DB_POOL) и постоянные соединения - см. project/settings/database.py
+DATABASES = database_settings(env, BASE_DIR / 'db.sqlite3')
+
+# Общий кеш: все воркеры gunicorn должны видеть одни и те же счётчики версий справочников,
+# поэтому в продакшене нужен разделяемый бэкенд (в docker-compose - Redis). Кеш внутри процесса (locmem)
+# подходит только для одного процесса: с WEB_CONCURRENCY > 1 (число воркеров gunicorn) запуск завершается ошибкой
+CACHES = {
+    'default': env.cache_url('CACHE_URL', default='locmemcache://'),
+    # Кеш ответов статистики и списков можно вынести в отдельный бэкенд (например, Redis с вытеснением)
+    'responses': env.cache_url('RESPONSE_CACHE_URL', default=env('CACHE_URL', default='locmemcache://')),
+}
+WEB_CONCURRENCY = env.int('WEB_CONCURRENCY', default=1)
+check_shared_caches(CACHES, WEB_CONCURRENCY)
+RESPONSE_CACHE_ALIAS = 'responses'
+RESPONSE_CACHE_ENABLED = env.bool('RESPONSE_CACHE_ENABLED', default=True)
+RESPONSE_CACHE_TIMEOUT = env.int('RESPONSE_CACHE_TIMEOUT', default=300)
+
+# Помесячное секционирование таблицы транзакций (только PostgreSQL), см. команду partition_transactions
+TRANSACTION_PARTITIONING = env.bool('TRANSACTION_PARTITIONING', default=False)
+TRANSACTION_PARTITION_MONTHS_AHEAD = env.int('TRANSACTION_PARTITION_MONTHS_AHEAD', default=3)
+
+# Суммы в статистике, агрегатах, остатках и экспорте считаются в целых копейках (см. transit_managment/money.py)
+AMOUNT_MINOR_UNITS = env.bool('AMOUNT_MINOR_UNITS', default=False)
+
+# Каталог колоночного снимка транзакций для отчётов (см. transit_managment/analytics.py)
+ANALYTICS_SNAPSHOT_DIR = env('ANALYTICS_SNAPSHOT_DIR', default=os.path.join(BASE_DIR, 'analytics'))
+
+# Метрики запросов в формате Prometheus: GET /backend/metrics/ с заголовком Authorization: Bearer <METRICS_TOKEN>
+# (без токена эндпоинт выключен), снимок метрик воркера публикуется в общий кеш не чаще раза
+# в METRICS_PUBLISH_INTERVAL секунд
+METRICS_ENABLED = env.bool('METRICS_ENABLED', default=True)
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+METRICS_PUBLISH_INTERVAL = env.int('METRICS_PUBLISH_INTERVAL', default=10)
+
+# Конфигурация полнотекстового поиска PostgreSQL; должна совпадать с конфигурацией индекса из миграции 0004,
+# а её смена требует новой миграции с пересозданием индекса
+TRANSACTION_SEARCH_CONFIG = 'russian'
+
+# INCLUDE-колонки покрывающих индексов используются только в PostgreSQL, SQLite их игнорирует
+SILENCED_SYSTEM_CHECKS = ['models.W040']
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -0,0 +1,25 @@
+from django.core.exceptions import ImproperlyConfigured
+
+# Кеши, которые живут внутри процесса: другие воркеры не видят ни записей, ни сброса версий
+PER_PROCESS_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def per_process_caches(caches):
+    """Алиасы кешей, не общих для процессов"""
+    return sorted(alias for alias, config in caches.items() if config['BACKEND'] in PER_PROCESS_BACKENDS)
+
+
+def check_shared_caches(caches, workers):
+    """
+    Версии справочников (ETag, дерево категорий, кеш ответов) сбрасываются записью в кеш, поэтому
+    с несколькими воркерами кеш должен быть общим - иначе остальные воркеры отдают устаревшие данные.
+    """
+    aliases = per_process_caches(caches)
+    if workers > 1 and aliases:
+        raise ImproperlyConfigured(
+            f'Кеши {", ".join(aliases)} живут внутри процесса, а воркеров {workers}: '
+            'задайте CACHE_URL (и RESPONSE_CACHE_URL) с общим бэкендом, например redis://redis:6379/0'
+        )
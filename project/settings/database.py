@@ -0,0 +1,61 @@
+POSTGRES_ENGINE = 'django.db.backends.postgresql'
+SQLITE_ENGINE = 'django.db.backends.sqlite3'
+
+
+def postgres_available(params, timeout):
+    """Пробное подключение к PostgreSQL (psycopg 3) с коротким таймаутом"""
+    try:
+        import psycopg
+    except ImportError:
+        return False
+    try:
+        psycopg.connect(**params, connect_timeout=timeout).close()
+    except psycopg.OperationalError:
+        return False
+    return True
+
+
+def database_settings(env, sqlite_path, probe=postgres_available):
+    """
+    DATABASES из переменных окружения.
+
+    Для PostgreSQL: пул соединений psycopg 3 (DB_POOL, Django >= 5.1) либо постоянные соединения
+    с проверкой перед использованием (CONN_MAX_AGE, CONN_HEALTH_CHECKS). Под ASGI постоянные соединения
+    не переиспользуются между запросами - там нужен пул или CONN_MAX_AGE=0.
+    Импорт настроек к базе не подключается: пробное подключение с откатом недоступного PostgreSQL на SQLite
+    выполняется только при явном POSTGRES_PROBE=True (локальная разработка). В проде откат на SQLite - это
+    расхождение данных между процессами, там доступность базы проверяет wait_for_db в entrypoint.
+    """
+    sqlite = {'default': {'ENGINE': SQLITE_ENGINE, 'NAME': sqlite_path}}
+    if env('ENGINE', default=SQLITE_ENGINE) != POSTGRES_ENGINE:
+        return sqlite
+
+    params = {
+        'dbname': env('POSTGRES_DB', default='postgres'),
+        'user': env('POSTGRES_USER', default='postgres'),
+        'password': env('POSTGRES_PASSWORD', default='postgres'),
+        'host': env('POSTGRES_HOST', default='postgres'),
+        'port': env.int('POSTGRES_PORT', default=5432),
+    }
+    if env.bool('POSTGRES_PROBE', default=False) and not probe(params, env.int('POSTGRES_PROBE_TIMEOUT', default=1)):
+        return sqlite
+
+    postgres = {
+        'ENGINE': POSTGRES_ENGINE,
+        'NAME': params['dbname'],
+        'USER': params['user'],
+        'PASSWORD': params['password'],
+        'HOST': params['host'],
+        'PORT': params['port'],
+        'OPTIONS': {'connect_timeout': env.int('POSTGRES_CONNECT_TIMEOUT', default=5)},
+    }
+    if env.bool('DB_POOL', default=False):
+        postgres['OPTIONS']['pool'] = {
+            'min_size': env.int('DB_POOL_MIN_SIZE', default=2),
+            'max_size': env.int('DB_POOL_MAX_SIZE', default=10),
+            'timeout': env.int('DB_POOL_TIMEOUT', default=10),
+        }
+    else:
+        postgres['CONN_MAX_AGE'] = env.int('CONN_MAX_AGE', default=60)
+        postgres['CONN_HEALTH_CHECKS'] = env.bool('CONN_HEALTH_CHECKS', default=True)
+    return {'default': postgres}
@@ -3,6 +3,7 @@ from django.utils.html import format_html
 from mptt.admin import MPTTModelAdmin
 
 from .models import Category, Status, Transaction, TransactionType
+from .search import search_transactions
 
 
 @admin.register(Status)
@@ -81,4 +82,10 @@ class TransactionAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         """Оптимизация запросов"""
-        return super().get_queryset(request).select_related('status', 'transaction_type', 'category')
+        return super().get_queryset(request).with_references()
+
+    def get_search_results(self, request, queryset, search_term):
+        """Поиск по полнотекстовому индексу комментариев вместо LIKE по трём таблицам"""
+        if not search_term.strip():
+            return queryset, False
+        return search_transactions(queryset, search_term), False
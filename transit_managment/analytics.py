@@ -0,0 +1,438 @@
+"""
+Колоночный снимок транзакций для аналитических отчётов.
+
+Снимок - по файлу .npy на колонку в каталоге ANALYTICS_SNAPSHOT_DIR: id, день (дни от 1970-01-01
+в текущем часовом поясе), статус, тип операции, категория и сумма в копейках. Файлы открываются
+через np.load(mmap_mode='r'), поэтому воркеры gunicorn делят страницы page cache, а не держат каждый
+свою копию. Каждое обновление пишет новое поколение в отдельный подкаталог и атомарно подменяет
+meta.json: читатели видят либо старое поколение целиком, либо новое.
+
+Обновление инкрементальное: перечитываются транзакции с updated_at после водяной отметки прошлого
+обновления (с запасом на долгие транзакции БД), а дни, где число строк снимка разошлось с дневными
+агрегатами (удаления, массовые операции), перечитываются целиком.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+from datetime import date, timedelta
+from functools import reduce
+from itertools import islice
+from operator import or_
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import money
+from .category_tree import get_category_tree
+from .filters import TransactionRollupFilter
+from .models import Transaction, TransactionDailyRollup
+from .references import get_references
+from .rollups import day_start
+from .stats import resolve_type_ids
+
+COLUMNS = {
+    'id': 'int64',
+    'day': 'int32',
+    'status': 'int32',
+    'transaction_type': 'int32',
+    'category': 'int32',
+    'amount': 'int64',
+}
+META_FILE = 'meta.json'
+LOCK_FILE = '.lock'
+EPOCH = date(1970, 1, 1)
+READ_CHUNK_SIZE = 20000
+# Запас для транзакций БД, закоммиченных позже своего updated_at
+WATERMARK_OVERLAP = timedelta(minutes=5)
+# Если разошлось больше дней, снимок дешевле построить заново
+MAX_RELOAD_DAYS = 90
+
+DIMENSIONS = ('status', 'transaction_type', 'category', 'year', 'month', 'month_of_year', 'day')
+MEASURES = ('balance', 'income', 'expense', 'count')
+# Параметры отчёта, не относящиеся к фильтрации
+REPORT_PARAMS = ('rows', 'columns', 'measure', 'top')
+
+
+class SnapshotUnavailable(RuntimeError):
+    """Снимок не построен или numpy не установлен"""
+
+
+class ReportParamsError(ValueError):
+    """Некорректные параметры отчёта"""
+
+
+def _numpy():
+    # numpy - зависимость проекта; проверка остаётся для окружений, собранных без неё
+    try:
+        import numpy
+    except ImportError:
+        raise SnapshotUnavailable('Для аналитических отчётов установите пакет numpy')
+    return numpy
+
+
+def snapshot_dir():
+    return Path(settings.ANALYTICS_SNAPSHOT_DIR)
+
+
+class Snapshot:
+    """Поколение снимка: meta и колонки, отображённые в память"""
+
+    def __init__(self, meta, columns):
+        self.meta = meta
+        self.columns = columns
+
+    @property
+    def generation(self):
+        return self.meta['generation']
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    @classmethod
+    def load(cls, directory, meta):
+        np = _numpy()
+        path = directory / meta['generation']
+        return cls(meta, {name: np.load(path / f'{name}.npy', mmap_mode='r') for name in COLUMNS})
+
+    def describe(self):
+        return {key: self.meta[key] for key in ('generation', 'rows', 'built_at', 'watermark')}
+
+
+def read_meta(directory=None):
+    try:
+        with open((directory or snapshot_dir()) / META_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# Снимок кешируется в памяти процесса до смены поколения в meta.json
+_cached = None
+
+
+def get_snapshot():
+    global _cached
+
+    directory = snapshot_dir()
+    meta = read_meta(directory)
+    if meta is None:
+        raise SnapshotUnavailable('Аналитический снимок не построен: python manage.py refresh_analytics_snapshot')
+    if _cached is None or _cached.generation != meta['generation']:
+        _cached = Snapshot.load(directory, meta)
+    return _cached
+
+
+def _read(queryset):
+    """Колонки снимка для транзакций queryset, отсортированные по id"""
+    np = _numpy()
+    rows = (
+        queryset.order_by('pk')
+        .values_list(
+            'pk', TruncDate('date'), 'status_id', 'transaction_type_id', 'category_id', money.minor_units('amount')
+        )
+        .iterator(chunk_size=READ_CHUNK_SIZE)
+    )
+    parts = {name: [] for name in COLUMNS}
+    while batch := list(islice(rows, READ_CHUNK_SIZE)):
+        for name, values in zip(COLUMNS, zip(*batch, strict=True), strict=True):
+            if name == 'day':
+                values = np.array(values, dtype='datetime64[D]').astype(COLUMNS[name])
+            parts[name].append(np.asarray(values, dtype=COLUMNS[name]))
+    return {
+        name: np.concatenate(arrays) if arrays else np.empty(0, dtype=COLUMNS[name]) for name, arrays in parts.items()
+    }
+
+
+def _merge(columns, changed):
+    """Строки changed заменяют строки с теми же id, остальные добавляются; результат отсортирован по id"""
+    np = _numpy()
+    keep = ~np.isin(columns['id'], changed['id'])
+    merged = {name: np.concatenate([columns[name][keep], changed[name]]) for name in COLUMNS}
+    order = np.argsort(merged['id'], kind='stable')
+    return {name: values[order] for name, values in merged.items()}
+
+
+def _without_days(columns, days):
+    np = _numpy()
+    keep = ~np.isin(columns['day'], days)
+    return {name: values[keep] for name, values in columns.items()}
+
+
+def _day_number(day):
+    return (day - EPOCH).days
+
+
+def _mismatched_days(columns):
+    """Дни, где число строк снимка не совпадает с дневными агрегатами"""
+    np = _numpy()
+    days, counts = np.unique(columns['day'], return_counts=True)
+    snapshot_counts = dict(zip(days.tolist(), counts.tolist(), strict=True))
+    rollups = TransactionDailyRollup.objects.values('day').annotate(rows=Sum('count')).values_list('day', 'rows')
+    rollup_counts = {_day_number(day): rows for day, rows in rollups}
+    return sorted(
+        day
+        for day in snapshot_counts.keys() | rollup_counts.keys()
+        if snapshot_counts.get(day) != rollup_counts.get(day)
+    )
+
+
+def _transactions_of_days(days):
+    conditions = []
+    for day in days:
+        day = EPOCH + timedelta(days=day)
+        conditions.append(Q(date__gte=day_start(day), date__lt=day_start(day + timedelta(days=1))))
+    return Transaction.objects.filter(reduce(or_, conditions))
+
+
+def _publish(directory, columns, watermark):
+    """Новое поколение: колонки в подкаталог, затем атомарная замена meta.json"""
+    np = _numpy()
+    generation = f'{timezone.now():%Y%m%d%H%M%S%f}'
+    path = directory / generation
+    path.mkdir(parents=True)
+    for name, dtype in COLUMNS.items():
+        np.save(path / f'{name}.npy', np.ascontiguousarray(columns[name], dtype=dtype))
+
+    meta = {
+        'generation': generation,
+        'rows': len(columns['id']),
+        'built_at': timezone.now().isoformat(),
+        'watermark': watermark.isoformat(),
+    }
+    previous = read_meta(directory)
+    temporary = directory / f'{META_FILE}.{generation}'
+    temporary.write_text(json.dumps(meta), encoding='utf-8')
+    os.replace(temporary, directory / META_FILE)
+
+    # Предыдущее поколение остаётся для процессов, которые ещё не перечитали meta.json;
+    # удалённые файлы остаются доступны тем, кто их уже отобразил в память
+    keep = {generation, previous['generation'] if previous else None}
+    for child in directory.iterdir():
+        if child.is_dir() and child.name not in keep:
+            shutil.rmtree(child, ignore_errors=True)
+    return meta
+
+
+def refresh(full=False, stdout=None, incremental_only=False):
+    """
+    Обновление снимка; без предыдущего поколения или с full=True - построение заново.
+
+    incremental_only (API): вместо построения заново - SnapshotUnavailable. На журнале в миллионы строк
+    оно не укладывается в таймаут воркера и выполняется только командой refresh_analytics_snapshot.
+    Возвращает meta нового поколения.
+    """
+    directory = snapshot_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / LOCK_FILE, 'w') as lock:
+        # Одновременные обновления (команда и API) выполняются по очереди
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        started = timezone.now()
+        meta = None if full else read_meta(directory)
+
+        if meta is None:
+            if incremental_only:
+                raise SnapshotUnavailable(
+                    'Аналитический снимок не построен: python manage.py refresh_analytics_snapshot'
+                )
+            columns = _read(Transaction.objects.all())
+        else:
+            current = Snapshot.load(directory, meta)
+            since = parse_datetime(meta['watermark']) - WATERMARK_OVERLAP
+            changed = _read(Transaction.objects.filter(updated_at__gte=since))
+            columns = _merge(current.columns, changed)
+            if stdout is not None:
+                stdout.write(f'Изменённых транзакций: {len(changed["id"])}')
+
+        days = _mismatched_days(columns)
+        if len(days) > MAX_RELOAD_DAYS:
+            if incremental_only:
+                raise SnapshotUnavailable(
+                    f'Снимок расходится с дневными агрегатами за {len(days)} дней, его нужно построить заново: '
+                    'python manage.py refresh_analytics_snapshot --full'
+                )
+            columns = _read(Transaction.objects.all())
+        elif days:
+            columns = _merge(_without_days(columns, days), _read(_transactions_of_days(days)))
+        if stdout is not None and days:
+            stdout.write(f'Перечитано дней: {len(days)}')
+        return _publish(directory, columns, started)
+
+
+def _dimension_values(columns, dimension):
+    """Значения измерения для каждой строки и функция подписи значения"""
+    references = get_references()
+    if dimension == 'status':
+        return columns['status'], references.status_name
+    if dimension == 'transaction_type':
+        return columns['transaction_type'], references.transaction_type_name
+    if dimension == 'category':
+        return columns['category'], references.category_name
+
+    if dimension == 'day':
+        return columns['day'], lambda value: (EPOCH + timedelta(days=value)).isoformat()
+    days = columns['day'].astype('datetime64[D]')
+    months = days.astype('datetime64[M]').astype('int64')
+    if dimension == 'month':
+        return months, lambda value: f'{1970 + value // 12}-{value % 12 + 1:02d}'
+    if dimension == 'month_of_year':
+        return months % 12 + 1, None
+    return days.astype('datetime64[Y]').astype('int64') + 1970, None
+
+
+def _factorize(values):
+    """
+    Различные значения и индекс значения для каждой строки (как np.unique с return_inverse).
+
+    У всех измерений (id справочников, дни, месяцы) узкий диапазон, поэтому вместо сортировки
+    достаточно bincount по смещению от минимума - за линейное время.
+    """
+    np = _numpy()
+    if not len(values):
+        return values[:0].astype('int64'), np.zeros(0, dtype='int64')
+    low = int(values.min())
+    offsets = values.astype('int64') - low
+    present = np.bincount(offsets) > 0
+    positions = np.cumsum(present) - 1
+    return np.flatnonzero(present) + low, positions[offsets]
+
+
+def _category_ids(category_id):
+    """Категория и все её потомки по MPTT-полям закешированного дерева"""
+    tree = get_category_tree()
+    root = tree.get(category_id)
+    if root is None:
+        return []
+    return [
+        node.id for node in tree.nodes.values() if node.tree_id == root.tree_id and root.lft <= node.lft <= root.rght
+    ]
+
+
+def _filter_mask(columns, filters):
+    """Маска строк под фильтры; None, если фильтров нет"""
+    np = _numpy()
+    conditions = []
+    if filters.get('date_from'):
+        conditions.append(columns['day'] >= _day_number(filters['date_from']))
+    if filters.get('date_to'):
+        conditions.append(columns['day'] <= _day_number(filters['date_to']))
+    for name in ('status', 'transaction_type', 'category'):
+        if filters.get(name) is not None:
+            conditions.append(columns[name] == int(filters[name]))
+        if filters.get(f'{name}__in'):
+            conditions.append(np.isin(columns[name], [int(value) for value in filters[f'{name}__in']]))
+    if filters.get('category_subtree') is not None:
+        conditions.append(np.isin(columns['category'], _category_ids(int(filters['category_subtree']))))
+    return np.logical_and.reduce(conditions) if conditions else None
+
+
+def parse_report(params):
+    """Разбор параметров отчёта: (rows, columns, measure, top, filters)"""
+    rows = params.get('rows') or 'category'
+    columns = params.get('columns') or None
+    measure = params.get('measure') or 'balance'
+    for name, value in (('rows', rows), ('columns', columns)):
+        if value is not None and value not in DIMENSIONS:
+            raise ReportParamsError(
+                f"Неизвестное измерение {name}='{value}'. Допустимые значения: {', '.join(DIMENSIONS)}"
+            )
+    if measure not in MEASURES:
+        raise ReportParamsError(f"Неизвестная мера '{measure}'. Допустимые значения: {', '.join(MEASURES)}")
+    try:
+        top = int(params['top']) if params.get('top') else None
+    except ValueError:
+        raise ReportParamsError('top должен быть целым числом')
+    if top is not None and top < 1:
+        # Отрицательный top отрезал бы строки с конца
+        raise ReportParamsError('top должен быть не меньше 1')
+
+    if not TransactionRollupFilter.supports(params, ignore=REPORT_PARAMS):
+        # Снимок хранит то же, что и дневные агрегаты: дни и справочники, без сумм отдельных строк и комментариев
+        raise ReportParamsError('Фильтры amount_*, datetime_* и search в отчётах не поддерживаются')
+    form = TransactionRollupFilter(params, queryset=TransactionDailyRollup.objects.none()).form
+    if not form.is_valid():
+        raise ReportParamsError(form.errors.as_text())
+    return rows, columns, measure, top, form.cleaned_data
+
+
+def _weights(columns, measure):
+    np = _numpy()
+    if measure == 'count':
+        return None
+    amounts, types = columns['amount'], columns['transaction_type']
+    income_type_id, expense_type_id = resolve_type_ids()
+    if measure == 'income':
+        return np.where(types == income_type_id, amounts, 0)
+    if measure == 'expense':
+        return np.where(types == expense_type_id, amounts, 0)
+    return np.where(types == income_type_id, amounts, np.where(types == expense_type_id, -amounts, 0))
+
+
+def _cell_value(value, measure):
+    return int(value) if measure == 'count' else money.to_decimal(int(value))
+
+
+def pivot(snapshot, rows, columns=None, measure='balance', top=None, filters=None):
+    """
+    Сводная таблица rows x columns по мере measure.
+
+    Группировка - индексы значений измерений (_factorize) и np.bincount по индексу ячейки. Суммы в копейках
+    складываются в float64, что точно до 2**53 копеек (около 9·10**13 руб.) на ячейку.
+    """
+    np = _numpy()
+    data = snapshot.columns
+    mask = _filter_mask(data, filters or {})
+    if mask is not None:
+        # Без фильтров колонки читаются прямо из отображённых страниц, без копии
+        needed = {'amount', 'transaction_type', 'day', *(name for name in (rows, columns) if name in COLUMNS)}
+        data = {name: data[name][mask] for name in needed}
+    weights = _weights(data, measure)
+
+    row_values, row_label = _dimension_values(data, rows)
+    row_keys, row_index = _factorize(row_values)
+    if columns:
+        column_values, column_label = _dimension_values(data, columns)
+        column_keys, column_index = _factorize(column_values)
+    else:
+        column_keys, column_index, column_label = np.zeros(1, dtype='int64'), np.zeros_like(row_index), None
+
+    cells = row_index * len(column_keys) + column_index
+    size = len(row_keys) * len(column_keys)
+    table = np.bincount(cells, weights=weights, minlength=size)
+    table = np.rint(table).astype('int64').reshape(len(row_keys), len(column_keys))
+    row_totals = table.sum(axis=1)
+
+    order = np.arange(len(row_keys))
+    if top:
+        # top-N строк по модулю итога
+        order = np.argsort(-np.abs(row_totals), kind='stable')[:top]
+
+    def label(value, labeler):
+        value = value.item()
+        return labeler(value) if labeler else value
+
+    results = []
+    for index in order:
+        key = row_keys[index]
+        item = {'key': key.item(), 'name': label(key, row_label), 'total': _cell_value(row_totals[index], measure)}
+        if columns:
+            item['values'] = [_cell_value(value, measure) for value in table[index]]
+        results.append(item)
+
+    report = {
+        'rows': rows,
+        'columns': columns,
+        'measure': measure,
+        'total': _cell_value(table.sum(), measure),
+        'results': results,
+        'snapshot': snapshot.describe(),
+    }
+    if columns:
+        report['column_keys'] = [label(key, column_label) for key in column_keys]
+        report['column_totals'] = [_cell_value(value, measure) for value in table.sum(axis=0)]
+    return report
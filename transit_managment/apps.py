@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class TransitManagmentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'transit_managment'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,137 @@
+"""
+Асинхронные варианты API чтения для запуска под ASGI (uvicorn).
+
+Запросы к БД выполняются асинхронным ORM, поэтому долгий отчёт не занимает воркер целиком,
+пока быстрые запросы ждут очереди. Всё, что обращается к кешу справочников и дерева категорий
+(синхронный кеш-бэкенд, иногда БД), - в том числе построение отфильтрованного queryset: search
+сопоставляет названия справочников - выполняется в sync_to_async одним переключением на запрос.
+Формат ответов совпадает с синхронными эндпоинтами TransactionViewSet и CategoryViewSet.
+"""
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import replace_query_param
+
+from .category_tree import get_category_tree
+from .filters import FilterParamsError, TransactionFilter, validated_qs
+from .models import Transaction
+from .pagination import (
+    COUNT_MODES,
+    KEYSET_ORDERING,
+    InvalidCursor,
+    TransactionCursorPagination,
+    akeyset_page,
+    approximate_count,
+    parse_page_size,
+)
+from .references import get_references
+from .serializers import TransactionSerializer
+from .stats import (
+    CATEGORY_TREE,
+    StatsParamsError,
+    acompute_stats,
+    category_root_id,
+    parse_grouping,
+    resolve_type_ids,
+    rollup_category_tree,
+    stats_source,
+)
+
+
+def json_response(data, status=200):
+    # Кодировщик DRF - те же представления Decimal и дат, что у синхронного API
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False, json_dumps_params={'ensure_ascii': False})
+
+
+def filtered_transactions(params):
+    return validated_qs(TransactionFilter(params, queryset=Transaction.objects.all())).order_by(*KEYSET_ORDERING)
+
+
+@sync_to_async
+def list_source(params):
+    """Справочники и отфильтрованный queryset списка"""
+    return get_references(), filtered_transactions(params)
+
+
+@sync_to_async
+def stats_params(params):
+    """Типы пополнения и списания и источник статистики"""
+    return resolve_type_ids(), stats_source(params, filtered_transactions(params))
+
+
+def page_link(request, cursor):
+    if cursor is None:
+        return None
+    return replace_query_param(request.build_absolute_uri(), TransactionCursorPagination.cursor_query_param, cursor)
+
+
+async def count_transactions(queryset, mode):
+    if mode == 'exact':
+        return await queryset.acount()
+    # Оценка планировщика выполняется через курсор БД, у которого нет асинхронного API
+    return await sync_to_async(approximate_count)(queryset)
+
+
+@require_GET
+async def transaction_list(request):
+    """Список транзакций с курсорной пагинацией (параметры - как у /backend/api/transactions/)"""
+    pagination = TransactionCursorPagination
+    try:
+        references, queryset = await list_source(request.GET)
+    except FilterParamsError as e:
+        return json_response(e.errors, status=400)
+    page_size = parse_page_size(
+        request.GET, pagination.page_size_query_param, pagination.page_size, pagination.max_page_size
+    )
+
+    try:
+        page = await akeyset_page(queryset, page_size, request.GET.get(pagination.cursor_query_param))
+    except InvalidCursor:
+        return json_response({pagination.cursor_query_param: ['Некорректный курсор']}, status=400)
+
+    payload = {
+        'next': page_link(request, page.next_cursor),
+        'previous': page_link(request, page.previous_cursor),
+    }
+    count_mode = request.GET.get(pagination.count_query_param)
+    if count_mode in COUNT_MODES:
+        payload['count'] = await count_transactions(queryset, count_mode)
+    payload['results'] = TransactionSerializer(page.items, many=True, context={'references': references}).data
+    return json_response(payload)
+
+
+@require_GET
+async def transaction_detail(request, pk):
+    references = await sync_to_async(get_references)()
+    try:
+        transaction = await Transaction.objects.aget(pk=pk)
+    except Transaction.DoesNotExist:
+        return json_response({'detail': 'Не найдено.'}, status=404)
+    return json_response(TransactionSerializer(transaction, context={'references': references}).data)
+
+
+@require_GET
+async def transaction_stats(request):
+    """Статистика по транзакциям (параметры - как у /backend/api/transactions/stats/)"""
+    try:
+        period, group_by = parse_grouping(request.GET)
+    except StatsParamsError as e:
+        return json_response({'detail': str(e)}, status=400)
+
+    try:
+        (income_type_id, expense_type_id), (queryset, fields) = await stats_params(request.GET)
+    except FilterParamsError as e:
+        return json_response(e.errors, status=400)
+    stats = await acompute_stats(queryset, income_type_id, expense_type_id, period=period, group_by=group_by, **fields)
+    if group_by == CATEGORY_TREE:
+        tree = await sync_to_async(get_category_tree)()
+        stats = rollup_category_tree(stats, tree, category_root_id(request.GET))
+    return json_response(stats)
+
+
+@require_GET
+async def category_tree(request):
+    tree = await sync_to_async(get_category_tree)()
+    return json_response(tree.as_tree())
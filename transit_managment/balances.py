@@ -0,0 +1,299 @@
+"""
+Нарастающий остаток по транзакциям.
+
+Контрольные точки (BalanceCheckpoint) хранят остаток на конец каждого прошедшего дня по каждому статусу
+и строятся из дневных агрегатов. Остаток после транзакции = остаток на начало её дня + нарастающая сумма
+операций своего дня до неё включительно; вторая часть считается одним запросом с оконной функцией
+только по дням текущей страницы.
+
+Запись задним числом сдвигает точки своего статуса начиная со своего дня одним UPDATE balance = balance + изменение
+в той же транзакции БД, что и дневные агрегаты (rollups.apply_deltas), поэтому точки не расходятся с агрегатами.
+Точки за новые дни достраивает команда fill_balance_checkpoints (периодическая задача); до этого остаток
+на начало дня досчитывается по агрегатам, чтение ничего не пишет.
+"""
+
+from datetime import timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import IntegrityError, connections
+from django.db import transaction as db_transaction
+from django.db.models import BigIntegerField, Case, DecimalField, F, Max, Min, Q, Sum, Value, When, Window
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import money
+from .models import BalanceCheckpoint, Transaction, TransactionDailyRollup
+from .rollups import day_start, rollup_day
+from .stats import resolve_type_ids
+
+CENT = Decimal('0.01')
+BATCH_SIZE = 1000
+
+
+def signed_amount(income_type_id, expense_type_id, field='amount'):
+    """Сумма со знаком: пополнение - плюс, списание - минус (в копейках на быстром пути money)"""
+    if money.enabled():
+        default, output_field = Value(0), BigIntegerField()
+    else:
+        default, output_field = Value(Decimal('0')), DecimalField(max_digits=18, decimal_places=2)
+    amount = money.amount_value(field)
+    return Case(
+        When(transaction_type_id=income_type_id, then=amount),
+        When(transaction_type_id=expense_type_id, then=-amount),
+        default=default,
+        output_field=output_field,
+    )
+
+
+def balance_scope(params):
+    """Статусы, по которым считается остаток: status / status__in из запроса, иначе все"""
+    status_ids = set()
+    for value in [params.get('status'), *(params.get('status__in') or '').split(',')]:
+        try:
+            status_ids.add(int(value))
+        except (TypeError, ValueError):
+            continue
+    return sorted(status_ids) or None
+
+
+def _rebuild_from(start):
+    """Контрольные точки с дня start по вчерашний день включительно"""
+    end = timezone.localdate() - timedelta(days=1)
+    seed_day = BalanceCheckpoint.objects.filter(day__lt=start).aggregate(day=Max('day'))['day']
+    if seed_day is None:
+        balances = {}
+        first_day = TransactionDailyRollup.objects.aggregate(day=Min('day'))['day']
+        if first_day is not None:
+            start = min(start, first_day)
+    else:
+        # Точки идут без пропусков, поэтому продолжаем сразу после последней известной
+        balances = dict(BalanceCheckpoint.objects.filter(day=seed_day).values_list('status_id', 'balance'))
+        start = seed_day + timedelta(days=1)
+
+    income_type_id, expense_type_id = resolve_type_ids()
+    nets = {}
+    rows = (
+        TransactionDailyRollup.objects.filter(day__gte=start, day__lte=end)
+        .values('day', 'status_id')
+        .annotate(net=Sum(signed_amount(income_type_id, expense_type_id, 'total')))
+        .order_by('day')
+    )
+    for row in rows:
+        nets.setdefault(row['day'], {})[row['status_id']] = money.from_db(row['net'])
+
+    checkpoints = []
+    day = start
+    while day <= end and (balances or nets):
+        for status_id, net in nets.get(day, {}).items():
+            balances[status_id] = balances.get(status_id, Decimal('0')) + net
+        checkpoints.extend(
+            BalanceCheckpoint(day=day, status_id=status_id, balance=balance) for status_id, balance in balances.items()
+        )
+        day += timedelta(days=1)
+
+    BalanceCheckpoint.objects.filter(day__gte=start).delete()
+    BalanceCheckpoint.objects.bulk_create(checkpoints, batch_size=BATCH_SIZE)
+    return len(checkpoints)
+
+
+def checkpoint_shifts(deltas):
+    """Изменения остатков {status_id: {день: сумма со знаком}} из изменений дневных агрегатов"""
+    income_type_id, expense_type_id = resolve_type_ids()
+    signs = {income_type_id: 1, expense_type_id: -1}
+    today = timezone.localdate()
+    shifts = {}
+    for (day, status_id, transaction_type_id, _), (amount, _) in deltas.items():
+        # Точки есть только у закрытых (прошедших) дней, поэтому запись за сегодня их не затрагивает
+        sign = signs.get(transaction_type_id)
+        if day < today and sign and amount:
+            status_shifts = shifts.setdefault(status_id, {})
+            status_shifts[day] = status_shifts.get(day, Decimal('0')) + sign * amount
+    return shifts
+
+
+def _shift_status(status_id, day_shifts, last_day):
+    """
+    Один UPDATE на статус: каждая точка начиная с самого раннего дня получает сумму изменений
+    по свой день включительно. Точки, которых у статуса ещё не было (запись раньше его первой точки), создаются.
+    """
+    steps, cumulative = [], Decimal('0')
+    for day in sorted(day_shifts):
+        cumulative += day_shifts[day]
+        steps.append((day, cumulative))
+    first_day = steps[0][0]
+    if first_day > last_day:
+        return
+
+    increment = Case(
+        *(When(day__gte=day, then=Value(total)) for day, total in reversed(steps)),
+        output_field=DecimalField(max_digits=18, decimal_places=2),
+    )
+    checkpoints = BalanceCheckpoint.objects.filter(status_id=status_id, day__gte=first_day)
+    updated = checkpoints.update(balance=F('balance') + increment)
+    if updated > (last_day - first_day).days:
+        return
+
+    existing = set(checkpoints.values_list('day', flat=True))
+    day, position = first_day, 0
+    while day <= last_day:
+        while position + 1 < len(steps) and steps[position + 1][0] <= day:
+            position += 1
+        if day not in existing:
+            try:
+                with db_transaction.atomic():
+                    BalanceCheckpoint.objects.create(day=day, status_id=status_id, balance=steps[position][1])
+            except IntegrityError:
+                # Точку успел создать параллельный сдвиг
+                BalanceCheckpoint.objects.filter(day=day, status_id=status_id).update(
+                    balance=F('balance') + steps[position][1]
+                )
+        day += timedelta(days=1)
+
+
+def shift(deltas):
+    """
+    Сдвиг контрольных точек на изменения дневных агрегатов в транзакции БД записи.
+
+    Изменения складываются (balance = balance + ...), поэтому параллельные записи не мешают друг другу,
+    а блокируются только строки точек затронутых статусов (в порядке id статуса) до фиксации записи.
+    """
+    shifts = checkpoint_shifts(deltas)
+    if not shifts:
+        return
+    last_day = BalanceCheckpoint.objects.aggregate(day=Max('day'))['day']
+    if last_day is None:
+        return
+    with db_transaction.atomic():
+        for status_id, day_shifts in sorted(shifts.items()):
+            _shift_status(status_id, day_shifts, last_day)
+
+
+def fill():
+    """Точки за дни после последней построенной по вчерашний день включительно; возвращает число точек"""
+    last_day = BalanceCheckpoint.objects.aggregate(day=Max('day'))['day']
+    if last_day is None:
+        start = TransactionDailyRollup.objects.aggregate(day=Min('day'))['day']
+        if start is None:
+            return 0
+    else:
+        start = last_day + timedelta(days=1)
+    try:
+        with db_transaction.atomic():
+            return _rebuild_from(start)
+    except IntegrityError:
+        # Те же дни успел достроить параллельный запуск
+        return 0
+
+
+def rebuild():
+    """Полный пересчёт контрольных точек из дневных агрегатов"""
+    first_day = TransactionDailyRollup.objects.aggregate(day=Min('day'))['day']
+    with db_transaction.atomic():
+        BalanceCheckpoint.objects.all().delete()
+        return _rebuild_from(first_day) if first_day is not None else 0
+
+
+def _checkpoint_totals(days, status_ids):
+    """Суммы контрольных точек по дням"""
+    checkpoints = BalanceCheckpoint.objects.filter(day__in=days)
+    if status_ids:
+        checkpoints = checkpoints.filter(status_id__in=status_ids)
+    totals = {}
+    for day, balance in checkpoints.values_list('day', 'balance'):
+        totals[day] = totals.get(day, Decimal('0')) + balance
+    return totals
+
+
+def opening_balances(days, status_ids=None):
+    """
+    Остаток на начало каждого из дней - по контрольной точке предыдущего дня.
+
+    Если точки ещё нет (после смены суток до запуска fill_balance_checkpoints или для операций будущими датами),
+    к последней точке прибавляются агрегаты следующих за ней дней - одним группирующим запросом, без записи в БД.
+    """
+    previous = {day - timedelta(days=1): day for day in days}
+    last_day = BalanceCheckpoint.objects.aggregate(day=Max('day'))['day']
+    # Точки идут без пропусков от первого дня с операциями, поэтому до last_day отсутствующая точка - нулевой остаток
+    closed = {previous_day for previous_day in previous if last_day is not None and previous_day <= last_day}
+    totals = _checkpoint_totals(closed | ({last_day} if last_day else set()), status_ids)
+    result = {previous[previous_day]: totals.get(previous_day, Decimal('0')) for previous_day in closed}
+
+    open_days = sorted(set(previous) - closed)
+    if not open_days:
+        return result
+    rollups = TransactionDailyRollup.objects.filter(day__lte=open_days[-1])
+    if last_day is not None:
+        rollups = rollups.filter(day__gt=last_day)
+    if status_ids:
+        rollups = rollups.filter(status_id__in=status_ids)
+    income_type_id, expense_type_id = resolve_type_ids()
+    nets = (
+        rollups.values('day')
+        .annotate(net=Sum(signed_amount(income_type_id, expense_type_id, 'total')))
+        .order_by('day')
+        .values_list('day', 'net')
+    )
+
+    balance = totals.get(last_day, Decimal('0'))
+    nets = iter(nets)
+    net_day, net = next(nets, (None, None))
+    for previous_day in open_days:
+        while net_day is not None and net_day <= previous_day:
+            balance += money.from_db(net)
+            net_day, net = next(nets, (None, None))
+        result[previous[previous_day]] = balance
+    return result
+
+
+def _to_decimal(value):
+    if money.enabled():
+        return money.to_decimal(value)
+    # Сырой курсор SQLite возвращает суммы как float или Decimal без учёта масштаба поля
+    return Decimal(str(value)).quantize(CENT)
+
+
+def running_balances(transactions, status_ids=None):
+    """
+    Остаток после каждой транзакции страницы: {id: остаток}.
+
+    status_ids ограничивает остаток операциями этих статусов (см. balance_scope).
+    """
+    page_days = {transaction.pk: rollup_day(transaction.date) for transaction in transactions}
+    if not page_days:
+        return {}
+    days = sorted(set(page_days.values()))
+    opening = opening_balances(days, status_ids)
+
+    ledger = Transaction.objects.filter(
+        reduce(or_, (Q(date__gte=day_start(day), date__lt=day_start(day + timedelta(days=1))) for day in days))
+    )
+    if status_ids:
+        ledger = ledger.filter(status_id__in=status_ids)
+    income_type_id, expense_type_id = resolve_type_ids()
+    window = (
+        ledger.order_by()
+        .annotate(
+            row_id=F('pk'),
+            running=Window(
+                Sum(signed_amount(income_type_id, expense_type_id)),
+                partition_by=TruncDate('date'),
+                order_by=(F('date').asc(), F('created_at').asc(), F('id').asc()),
+            ),
+        )
+        .values_list('row_id', 'running')
+    )
+
+    # Окно должно видеть все операции дня, поэтому строки страницы отбираются уже над его результатом
+    connection = connections[window.db]
+    sql, params = window.query.get_compiler(connection=connection).as_sql()
+    ids = list(page_days)
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT row_id, running FROM ({sql}) running_balances WHERE row_id IN ({placeholders})',
+            [*params, *ids],
+        )
+        rows = cursor.fetchall()
+    return {row_id: opening[page_days[row_id]] + _to_decimal(running) for row_id, running in rows}
@@ -0,0 +1,327 @@
+import json
+import platform
+import statistics
+import time
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from .metrics import MetricsMiddleware
+from .models import Category, Status, Transaction
+from .references import get_references
+from .stats import EXPENSE_TYPE_NAME
+
+METRICS_MIDDLEWARE = 'transit_managment.metrics.MetricsMiddleware'
+
+# Сценарий: название -> функция(context), выполняющая один запрос и возвращающая HTTP-ответ
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+
+    return register
+
+
+class BenchmarkContext:
+    """Общие данные сценариев: клиент и идентификаторы справочников"""
+
+    def __init__(self):
+        self.client = Client()
+        references = get_references()
+        self.expense_type_id = references.transaction_type_id(EXPENSE_TYPE_NAME)
+        self.status_id = Status.objects.values_list('id', flat=True).first()
+        self.category_id = (
+            Category.objects.filter(transaction_type_id=self.expense_type_id, transactions__isnull=False)
+            .values_list('id', flat=True)
+            .first()
+        )
+        self.created_ids = []
+        self.month_start = timezone.localdate().replace(day=1).isoformat()
+        self.deep_cursor = self.find_deep_cursor()
+
+    def find_deep_cursor(self, pages=20, page_size=50):
+        """Курсор страницы далеко от начала списка - проверка, что глубокие страницы не дороже первой"""
+        url = f'/backend/api/transactions/?page_size={page_size}'
+        for _ in range(pages):
+            data = self.client.get(url).json()
+            if not data.get('next'):
+                break
+            url = data['next']
+        return url
+
+    def cleanup(self):
+        Transaction.objects.filter(pk__in=self.created_ids).delete()
+
+
+@scenario('list_api_first_page')
+def list_api_first_page(context):
+    return context.client.get('/backend/api/transactions/')
+
+
+@scenario('list_api_deep_page')
+def list_api_deep_page(context):
+    return context.client.get(context.deep_cursor)
+
+
+@scenario('list_api_filtered')
+def list_api_filtered(context):
+    return context.client.get(
+        f'/backend/api/transactions/?status={context.status_id}&transaction_type={context.expense_type_id}'
+        f'&date_from={context.month_start}'
+    )
+
+
+@scenario('list_api_balance')
+def list_api_balance(context):
+    return context.client.get(f'{context.deep_cursor}&balance=true')
+
+
+@scenario('list_api_category_range')
+def list_api_category_range(context):
+    return context.client.get(f'/backend/api/transactions/?category={context.category_id}&date_from=2000-01-01')
+
+
+@scenario('search_comment')
+def search_comment(context):
+    return context.client.get('/backend/api/transactions/search/', {'search': 'хостинг'})
+
+
+@scenario('search_comment_filtered')
+def search_comment_filtered(context):
+    return context.client.get(
+        '/backend/api/transactions/', {'search': 'аренды офиса', 'date_from': context.month_start}
+    )
+
+
+@scenario('home_page')
+def home_page(context):
+    return context.client.get('/')
+
+
+@scenario('home_page_filtered')
+def home_page_filtered(context):
+    return context.client.get(f'/?status={context.status_id}&date_from={context.month_start}')
+
+
+@scenario('stats')
+def stats(context):
+    return context.client.get('/backend/api/transactions/stats/')
+
+
+@scenario('stats_by_month_and_category')
+def stats_by_month_and_category(context):
+    return context.client.get('/backend/api/transactions/stats/?period=month&group_by=category')
+
+
+@scenario('stats_current_month_by_status')
+def stats_current_month_by_status(context):
+    return context.client.get(f'/backend/api/transactions/stats/?date_from={context.month_start}&group_by=status')
+
+
+@scenario('category_tree')
+def category_tree(context):
+    return context.client.get('/backend/api/categories/tree/')
+
+
+@scenario('category_list')
+def category_list(context):
+    return context.client.get('/backend/api/categories/')
+
+
+@scenario('create_transaction')
+def create_transaction(context):
+    response = context.client.post(
+        '/backend/api/transactions/',
+        {
+            'status': context.status_id,
+            'transaction_type': context.expense_type_id,
+            'category': context.category_id,
+            'amount': '100.00',
+            'comment': 'benchmark',
+        },
+        content_type='application/json',
+    )
+    if response.status_code == 201:
+        context.created_ids.append(Transaction.objects.filter(comment='benchmark').latest('id').pk)
+    return response
+
+
+@scenario('update_transaction')
+def update_transaction(context):
+    if not context.created_ids:
+        create_transaction(context)
+    return context.client.patch(
+        f'/backend/api/transactions/{context.created_ids[-1]}/',
+        {'amount': str(Decimal('100.00') + len(context.created_ids))},
+        content_type='application/json',
+    )
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(func, context, iterations, warmup):
+    for _ in range(warmup):
+        func(context)
+
+    latencies = []
+    query_counts = []
+    statuses = set()
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = func(context)
+            if getattr(response, 'streaming', False):
+                for _chunk in response.streaming_content:
+                    pass
+            latencies.append((time.perf_counter() - started) * 1000)
+        query_counts.append(len(queries))
+        statuses.add(response.status_code)
+
+    return {
+        'iterations': iterations,
+        'status_codes': sorted(statuses),
+        'latency_ms': {
+            'min': round(min(latencies), 3),
+            'mean': round(statistics.fmean(latencies), 3),
+            'p50': round(percentile(latencies, 50), 3),
+            'p90': round(percentile(latencies, 90), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(max(latencies), 3),
+        },
+        'queries': {
+            'min': min(query_counts),
+            'max': max(query_counts),
+            'mean': round(statistics.fmean(query_counts), 2),
+        },
+    }
+
+
+def run(names=None, iterations=50, warmup=5):
+    """Прогон сценариев; результат - словарь, пригодный для сохранения в JSON и сравнения запусков"""
+    context = BenchmarkContext()
+    results = {}
+    try:
+        for name in names or SCENARIOS:
+            results[name] = measure(SCENARIOS[name], context, iterations, warmup)
+    finally:
+        context.cleanup()
+
+    return {
+        'meta': {
+            'started_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'transactions': Transaction.objects.count(),
+            'iterations': iterations,
+            'warmup': warmup,
+        },
+        'results': results,
+    }
+
+
+def middleware_cost(iterations=10000):
+    """Собственное время MetricsMiddleware на запрос в микросекундах - вокруг представления без работы"""
+    request = RequestFactory().get('/backend/api/transactions/')
+
+    def view(request):
+        return HttpResponse('[]')
+
+    with override_settings(METRICS_ENABLED=True):
+        middleware = MetricsMiddleware(view)
+
+    def elapsed(handler):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            handler(request)
+        return time.perf_counter() - started
+
+    return max(0.0, (elapsed(middleware) - elapsed(view)) / iterations * 1_000_000)
+
+
+def metrics_overhead(scenario='list_api_first_page', iterations=200, warmup=20):
+    """
+    Добавочное время MetricsMiddleware на сценарии: клиент с middleware против клиента без него.
+
+    Замеры чередуются попарно, чтобы дрейф (кеши, фоновая нагрузка) одинаково влиял на оба варианта;
+    сравниваются медианы. Клиент загружает цепочку middleware при первом запросе, поэтому
+    оба контекста создаются внутри своих override_settings.
+    """
+    plain_middleware = [name for name in settings.MIDDLEWARE if name != METRICS_MIDDLEWARE]
+    with override_settings(MIDDLEWARE=plain_middleware):
+        plain = BenchmarkContext()
+    with override_settings(MIDDLEWARE=[METRICS_MIDDLEWARE, *plain_middleware], METRICS_ENABLED=True):
+        instrumented = BenchmarkContext()
+
+    func = SCENARIOS[scenario]
+    latencies = {'plain': [], 'instrumented': []}
+    try:
+        for _ in range(warmup):
+            func(plain)
+            func(instrumented)
+        for iteration in range(iterations):
+            pairs = [('plain', plain), ('instrumented', instrumented)]
+            for name, context in pairs if iteration % 2 else reversed(pairs):
+                started = time.perf_counter()
+                func(context)
+                latencies[name].append((time.perf_counter() - started) * 1000)
+    finally:
+        plain.cleanup()
+        instrumented.cleanup()
+
+    plain_ms = statistics.median(latencies['plain'])
+    instrumented_ms = statistics.median(latencies['instrumented'])
+    cost_us = middleware_cost()
+    return {
+        'scenario': scenario,
+        'iterations': iterations,
+        'median_ms': {'plain': round(plain_ms, 3), 'instrumented': round(instrumented_ms, 3)},
+        'overhead_percent': round((instrumented_ms - plain_ms) / plain_ms * 100, 2),
+        # Разница медиан шумит сильнее самой добавки, поэтому отдельно - чистая стоимость middleware
+        'middleware_us': round(cost_us, 2),
+        'middleware_percent': round(cost_us / 1000 / plain_ms * 100, 2),
+    }
+
+
+def compare(current, baseline, threshold=10.0, metric='p95'):
+    """Сценарии, у которых latency (metric) выросла больше чем на threshold % или выросло число запросов"""
+    regressions = []
+    for name, result in current['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        before, after = previous['latency_ms'][metric], result['latency_ms'][metric]
+        change = (after - before) / before * 100 if before else 0.0
+        if change > threshold or result['queries']['max'] > previous['queries']['max']:
+            regressions.append(
+                {
+                    'scenario': name,
+                    f'{metric}_before': before,
+                    f'{metric}_after': after,
+                    'change_percent': round(change, 1),
+                    'queries_before': previous['queries']['max'],
+                    'queries_after': result['queries']['max'],
+                }
+            )
+    return regressions
+
+
+def load(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
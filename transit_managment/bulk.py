@@ -0,0 +1,164 @@
+"""
+Массовое изменение и удаление транзакций по списку id или параметрам TransactionFilter.
+
+Изменения выполняются UPDATE/DELETE по пачкам id (каждая пачка - в своей транзакции БД) без загрузки
+моделей и без Transaction.save(): согласованность категории и типа операции проверяется заранее,
+один раз на каждую пару (категория, тип). Строки пачки блокируются (SELECT ... FOR UPDATE) до записи,
+и изменения дневных агрегатов считаются по заблокированным значениям: UPDATE присваивает константы,
+поэтому новые ключи агрегатов получаются заменой полей в старых. transactions_changed отправляется
+один раз для всех затронутых дней.
+"""
+
+from django.db import connections
+from django.db import transaction as db_transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import rollups
+from .category_tree import category_errors
+from .filters import TransactionFilter
+from .models import Transaction
+from .signals import transactions_changed
+
+DEFAULT_CHUNK_SIZE = 5000
+MAX_CHUNK_SIZE = 10000
+# Явный список id - для выделенных в интерфейсе строк, большие выборки задаются фильтром
+MAX_IDS = 10000
+# Поля, которые можно менять массово; сумма и дата меняются только поштучно
+UPDATE_FIELDS = ('status', 'transaction_type', 'category', 'comment')
+
+
+class Selection:
+    """Транзакции массовой операции: явный список id или параметры TransactionFilter"""
+
+    def __init__(self, ids=None, filters=None):
+        self.ids = ids
+        self.filters = filters
+
+    @property
+    def queryset(self):
+        if self.ids is not None:
+            return Transaction.objects.filter(pk__in=self.ids)
+        return TransactionFilter(self.filters, queryset=Transaction.objects.all()).qs
+
+    def chunks(self, chunk_size):
+        """
+        Пачки строк (date, id) по chunk_size в порядке (date, id).
+
+        Keyset вместо смещения: пачка выбирается заново после изменения предыдущей. Порядок по дате
+        держит каждую пачку в узком диапазоне дней, и агрегатов на пачку меняется немного.
+        """
+        queryset = self.queryset.order_by('date', 'pk').values_list('date', 'pk')
+        rows = list(queryset[:chunk_size])
+        while rows:
+            yield rows
+            last_date, last_id = rows[-1]
+            rows = list(queryset.filter(Q(date__gt=last_date) | Q(date=last_date, pk__gt=last_id))[:chunk_size])
+
+    def distinct(self, field):
+        """Различные значения поля среди выбранных транзакций"""
+        return set(self.queryset.order_by().values_list(field, flat=True).distinct())
+
+
+def change_errors(selection, changes):
+    """
+    Ошибки согласованности категории и типа операции после изменения.
+
+    Если меняется только категория, она проверяется с каждым типом операций выборки,
+    если только тип - с ним проверяется каждая категория выборки.
+    """
+    category = changes.get('category')
+    transaction_type = changes.get('transaction_type')
+    if category is not None and transaction_type is not None:
+        pairs = {(category.pk, transaction_type.pk)}
+    elif category is not None:
+        pairs = {(category.pk, type_id) for type_id in selection.distinct('transaction_type_id')}
+    elif transaction_type is not None:
+        pairs = {(category_id, transaction_type.pk) for category_id in selection.distinct('category_id')}
+    else:
+        return []
+
+    errors = []
+    for category_id, transaction_type_id in sorted(pairs):
+        for error in category_errors(category_id, transaction_type_id):
+            if error not in errors:
+                errors.append(error)
+    return errors
+
+
+def _column_values(changes):
+    values = {}
+    for name in UPDATE_FIELDS:
+        if name not in changes:
+            continue
+        value = changes[name]
+        values[f'{name}_id' if hasattr(value, 'pk') else name] = getattr(value, 'pk', value)
+    return values
+
+
+def _apply(selection, chunk_size, write):
+    """
+    Пачки строк -> write(id пачки, изменения агрегатов от удаления её строк) с пересчётом агрегатов;
+    возвращает количество строк.
+    """
+    total, days = 0, set()
+    try:
+        for rows in selection.chunks(chunk_size):
+            with db_transaction.atomic():
+                # Одиночное сохранение между подсчётом изменений и записью сдвинуло бы агрегаты и остатки,
+                # поэтому строки блокируются до конца транзакции пачки, а изменения считаются по ним
+                locked = list(
+                    Transaction.objects.filter(pk__in=[pk for _, pk in rows])
+                    .select_for_update()
+                    .values_list('pk', *rollups.SNAPSHOT_FIELDS)
+                )
+                if not locked:
+                    # Строки пачки успели удалить
+                    continue
+                removed = rollups.deltas_for_rows([row[1:] for row in locked], sign=-1)
+                deltas, count = write([row[0] for row in locked], removed)
+                rollups.apply_deltas(deltas)
+            total += count
+            # Дни берутся из ключей агрегатов; если агрегаты не менялись - из дат пачки
+            days.update({key[0] for key in deltas} or {rollups.rollup_day(date) for date, _ in rows})
+    finally:
+        # Уже закоммиченные пачки должны сбросить кеши, даже если следующая упала
+        if days:
+            transactions_changed.send(sender=Transaction, days=days)
+    return total
+
+
+def update_transactions(selection, changes, chunk_size=DEFAULT_CHUNK_SIZE):
+    """UPDATE выбранных транзакций; changes - проверенные значения полей UPDATE_FIELDS"""
+    values = _column_values(changes)
+    # Позиции изменяемых полей в ключе агрегата и их новые значения
+    replaced = {position: values[field] for position, field in enumerate(rollups.ROLLUP_KEY_FIELDS) if field in values}
+    values['updated_at'] = timezone.now()
+
+    def write(pks, deltas):
+        count = Transaction.objects.filter(pk__in=pks).update(**values)
+        if not replaced:
+            # Меняется только комментарий - агрегаты те же
+            return rollups.new_deltas(), count
+
+        for key, (amount, rows) in list(deltas.items()):
+            new_key = tuple(replaced.get(position, value) for position, value in enumerate(key))
+            rollups.add_delta(deltas, new_key, -amount, -rows)
+        return deltas, count
+
+    return _apply(selection, chunk_size, write)
+
+
+def delete_transactions(selection, chunk_size=DEFAULT_CHUNK_SIZE):
+    """DELETE выбранных транзакций"""
+
+    def write(pks, deltas):
+        # На транзакции никто не ссылается, поэтому QuerySet.delete() с загрузкой объектов
+        # и post_delete на каждую строку не нужен - хватает одного DELETE
+        connection = connections[Transaction.objects.db]
+        table, pk = map(connection.ops.quote_name, (Transaction._meta.db_table, Transaction._meta.pk.column))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE {pk} IN ({", ".join(["%s"] * len(pks))})', pks)
+            return deltas, cursor.rowcount
+
+    return _apply(selection, chunk_size, write)
@@ -0,0 +1,45 @@
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+
+VERSION_KEY = 'transit_managment:version:{}'
+
+
+def _key(name):
+    return VERSION_KEY.format(name)
+
+
+def get_version(name):
+    """Текущая версия набора данных, общая для всех процессов через кеш-бэкенд"""
+    version = cache.get(_key(name))
+    if version is None:
+        cache.add(_key(name), uuid.uuid4().hex, timeout=None)
+        version = cache.get(_key(name))
+    return version
+
+
+def get_versions(*names):
+    """Версии нескольких наборов одним обращением к кешу"""
+    keys = [_key(name) for name in names]
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+        found.update(cache.get_many(missing))
+    return tuple(found[key] for key in keys)
+
+
+def bump_version(*names):
+    """
+    Новая версия после фиксации транзакции БД.
+
+    Версия - случайное значение, а не счётчик: set атомарен на любом бэкенде,
+    а incr у файлового кеша - нет.
+    """
+
+    def bump():
+        cache.set_many({_key(name): uuid.uuid4().hex for name in names}, timeout=None)
+
+    db_transaction.on_commit(bump)
@@ -0,0 +1,163 @@
+"""
+Отчёт о движении денежных средств (ДДС): дерево категорий каждого типа операции по месяцам.
+
+Вся матрица строится одним группирующим запросом (месяц x категория, по дневным агрегатам, если фильтры
+это позволяют) и сворачивается по дереву категорий в памяти: узлы обходятся в обратном порядке
+(tree_id, lft), поэтому суммы потомков (lft..rght) попадают в родителя раньше, чем он сам сворачивается
+в своего. Итоги разделов и чистый денежный поток складываются из тех же строк.
+"""
+
+import csv
+from decimal import Decimal
+
+from django.http import HttpResponse
+from django.utils import timezone
+
+from .exports import Echo
+from .response_cache import months_between
+from .stats import compute_stats, resolve_type_ids, stats_source
+
+FORMATS = ('json', 'csv')
+# Параметры отчёта, не относящиеся к фильтрации
+CASHFLOW_PARAMS = ('file_format',)
+MAX_MONTHS = 120
+# Нулевые ячейки задают масштаб: суммы агрегатов в SQLite приходят без копеек
+ZERO = Decimal('0.00')
+
+
+class CashflowParamsError(ValueError):
+    """Некорректные параметры отчёта ДДС"""
+
+
+def _month_columns(breakdown, filters):
+    """Месяцы отчёта без пропусков: от начала фильтра (или первой операции) до конца фильтра (или последней)"""
+    months = [item['period'] for item in breakdown]
+    start = filters.get('date_from') or (min(months) if months else None)
+    end = filters.get('date_to') or (max(months) if months else None)
+    if start is None or end is None or start > end:
+        return []
+    months = list(months_between(start, end))
+    if len(months) > MAX_MONTHS:
+        raise CashflowParamsError(f'Отчёт строится не более чем за {MAX_MONTHS} месяцев, сузьте date_from / date_to')
+    return months
+
+
+def _own_values(breakdown, months, tree, income_type_id, expense_type_id):
+    """Суммы по категориям: {id категории: ([по месяцам], количество операций)}"""
+    column = {month: index for index, month in enumerate(months)}
+    own = {}
+    for item in breakdown:
+        index = column.get(item['period'].replace(day=1))
+        if index is None:
+            continue
+        node = tree.get(item['category'])
+        type_id = node.transaction_type_id if node else None
+        if type_id == income_type_id:
+            amount = item['total_income']
+        elif type_id == expense_type_id:
+            amount = item['total_expense']
+        else:
+            amount = item['balance']
+        values, count = own.get(item['category'], ([ZERO] * len(months), 0))
+        values[index] += amount
+        own[item['category']] = (values, count + item['transaction_count'])
+    return own
+
+
+def _rollup(tree, own, width):
+    """Строки дерева с подытогами: {id: строка}; дети обрабатываются раньше родителей"""
+    rows = {}
+    for node in reversed(tree.nodes.values()):
+        values, count = own.get(node.id, ([ZERO] * width, 0))
+        values = list(values)
+        children = [rows[child.id] for child in node.children if rows[child.id]['transaction_count']]
+        for child in children:
+            values = [value + child_value for value, child_value in zip(values, child['values'], strict=True)]
+            count += child['transaction_count']
+        rows[node.id] = {
+            'category': node.id,
+            'name': node.name,
+            'level': node.level,
+            'values': values,
+            'total': sum(values, ZERO),
+            'transaction_count': count,
+            'children': children,
+        }
+    return rows
+
+
+def _sum_rows(rows, width):
+    totals = [ZERO] * width
+    for row in rows:
+        totals = [total + value for total, value in zip(totals, row['values'], strict=True)]
+    return totals
+
+
+def compute_cashflow(params, transactions, tree, references, filters):
+    """
+    Матрица ДДС: разделы по типам операций (корни дерева категорий этого типа) и чистый поток по месяцам.
+
+    transactions - отфильтрованные транзакции; если фильтры задают только дни и справочники,
+    запрос идёт к дневным агрегатам.
+    """
+    income_type_id, expense_type_id = resolve_type_ids()
+    queryset, fields = stats_source(params, transactions, ignore=CASHFLOW_PARAMS)
+    breakdown = compute_stats(queryset, income_type_id, expense_type_id, period='month', group_by='category', **fields)[
+        'breakdown'
+    ]
+
+    months = _month_columns(breakdown, filters)
+    rows = _rollup(tree, _own_values(breakdown, months, tree, income_type_id, expense_type_id), len(months))
+
+    sections = []
+    for transaction_type in references.transaction_types:
+        roots = [
+            rows[node.id]
+            for node in tree.roots
+            if node.transaction_type_id == transaction_type.pk and rows[node.id]['transaction_count']
+        ]
+        totals = _sum_rows(roots, len(months))
+        sections.append(
+            {
+                'transaction_type': transaction_type.pk,
+                'name': transaction_type.name,
+                'rows': roots,
+                'values': totals,
+                'total': sum(totals, ZERO),
+            }
+        )
+
+    by_type = {section['transaction_type']: section['values'] for section in sections}
+    zero = [ZERO] * len(months)
+    net = [
+        income - expense
+        for income, expense in zip(by_type.get(income_type_id, zero), by_type.get(expense_type_id, zero), strict=True)
+    ]
+    return {
+        'months': [f'{month:%Y-%m}' for month in months],
+        'sections': sections,
+        'net': {'values': net, 'total': sum(net, ZERO)},
+    }
+
+
+def _flatten(rows):
+    for row in rows:
+        yield row
+        yield from _flatten(row['children'])
+
+
+def csv_response(report):
+    """ДДС в CSV: строки дерева с отступом по уровню, итоги разделов и чистый поток"""
+    writer = csv.writer(Echo())
+    lines = ['\ufeff' + writer.writerow(['Тип операции', 'Категория', *report['months'], 'Итого'])]
+    for section in report['sections']:
+        for row in _flatten(section['rows']):
+            lines.append(
+                writer.writerow([section['name'], '  ' * row['level'] + row['name'], *row['values'], row['total']])
+            )
+        lines.append(writer.writerow([section['name'], 'Итого', *section['values'], section['total']]))
+    lines.append(writer.writerow(['', 'Чистый денежный поток', *report['net']['values'], report['net']['total']]))
+
+    response = HttpResponse(''.join(lines), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="cashflow_{timezone.localtime():%Y%m%d_%H%M%S}.csv"'
+    return response
@@ -0,0 +1,168 @@
+from rest_framework import serializers
+
+from .cache_versions import bump_version, get_versions
+from .models import Category
+from .references import get_references
+
+# Версии, от которых зависит дерево: сами категории и названия типов операций
+TREE_VERSIONS = ('category', 'transaction_type')
+
+NODE_FIELDS = (
+    'id',
+    'name',
+    'description',
+    'transaction_type_id',
+    'transaction_type__name',
+    'parent_id',
+    'tree_id',
+    'lft',
+    'rght',
+    'level',
+    'created_at',
+    'updated_at',
+)
+
+_datetime_field = serializers.DateTimeField()
+
+
+class CategoryNode:
+    """Узел дерева категорий в памяти"""
+
+    __slots__ = (
+        'id',
+        'name',
+        'description',
+        'transaction_type_id',
+        'transaction_type_name',
+        'parent_id',
+        'parent_name',
+        'tree_id',
+        'lft',
+        'rght',
+        'level',
+        'created_at',
+        'updated_at',
+        'children',
+    )
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.name = row['name']
+        self.description = row['description']
+        self.transaction_type_id = row['transaction_type_id']
+        self.transaction_type_name = row['transaction_type__name']
+        self.parent_id = row['parent_id']
+        self.parent_name = None
+        self.tree_id = row['tree_id']
+        self.lft = row['lft']
+        self.rght = row['rght']
+        self.level = row['level']
+        self.created_at = row['created_at']
+        self.updated_at = row['updated_at']
+        self.children = []
+
+    @property
+    def is_leaf(self):
+        return self.rght - self.lft == 1
+
+
+class CategoryTree:
+    """Дерево категорий, построенное одним запросом в порядке (tree_id, lft)"""
+
+    def __init__(self, rows):
+        self.nodes = {}
+        self.roots = []
+        for row in rows:
+            node = CategoryNode(row)
+            self.nodes[node.id] = node
+            parent = self.nodes.get(node.parent_id)
+            if parent is None:
+                self.roots.append(node)
+            else:
+                # В порядке lft родитель всегда встречается раньше потомков
+                node.parent_name = parent.name
+                parent.children.append(node)
+
+    @classmethod
+    def load(cls):
+        return cls(Category.objects.order_by('tree_id', 'lft').values(*NODE_FIELDS).iterator())
+
+    def get(self, category_id):
+        return self.nodes.get(category_id)
+
+    def children_of(self, category_id):
+        node = self.nodes.get(category_id)
+        return node.children if node else []
+
+    def as_tree(self, nodes=None):
+        """Формат CategoryTreeSerializer: id, name, children"""
+        nodes = self.roots if nodes is None else nodes
+        return [{'id': node.id, 'name': node.name, 'children': self.as_tree(node.children)} for node in nodes]
+
+    def serialize(self, nodes):
+        """Формат CategorySerializer с вложенными children"""
+        return [
+            {
+                'id': node.id,
+                'name': node.name,
+                'description': node.description,
+                'transaction_type': node.transaction_type_id,
+                'transaction_type_name': node.transaction_type_name,
+                'parent': node.parent_id,
+                'parent_name': node.parent_name,
+                'children': self.serialize(node.children),
+                'created_at': _datetime_field.to_representation(node.created_at),
+                'updated_at': _datetime_field.to_representation(node.updated_at),
+            }
+            for node in nodes
+        ]
+
+
+# Дерево кешируется в памяти процесса и перестраивается, когда меняется общая версия в кеш-бэкенде
+_cached = (None, None)
+
+
+def get_category_tree():
+    global _cached
+
+    versions = get_versions(*TREE_VERSIONS)
+    cached_versions, tree = _cached
+    if cached_versions != versions or tree is None:
+        tree = CategoryTree.load()
+        _cached = (versions, tree)
+    return tree
+
+
+def load_node(category_id):
+    """Узел одной категории из БД - когда её ещё нет в закешированном дереве"""
+    row = Category.objects.filter(pk=category_id).values(*NODE_FIELDS).first()
+    return CategoryNode(row) if row else None
+
+
+def category_errors(category_id, transaction_type_id=None, tree=None, fetch_missing=True):
+    """
+    Проверка категории транзакции: относится к типу операции и является листом дерева.
+
+    Общая для Transaction.clean, сериализаторов и импорта. Принадлежность типу проверяется
+    по id, лист - по lft/rght, поэтому при тёплом кеше запросов к БД нет; категория,
+    которой нет в дереве (создана после его построения), загружается одним запросом.
+    """
+    tree = tree or get_category_tree()
+    node = tree.get(category_id)
+    if node is None and fetch_missing:
+        node = load_node(category_id)
+    if node is None:
+        return [f"Неизвестная категория '{category_id}'"]
+
+    errors = []
+    if transaction_type_id is not None and node.transaction_type_id != transaction_type_id:
+        type_name = get_references().transaction_type_name(transaction_type_id)
+        errors.append(f"Категория '{node.name}' не относится к типу операции '{type_name}'")
+    if not node.is_leaf:
+        errors.append(f"Нельзя выбрать родительскую категорию '{node.name}'. Выберите подкатегорию.")
+    return errors
+
+
+def invalidate_category_tree():
+    """Сброс дерева во всех процессах (например, после Category.objects.rebuild())"""
+    bump_version('category')
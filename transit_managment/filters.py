@@ -1,15 +1,144 @@
+from datetime import timedelta
+
 import django_filters
+from django.db.models import Subquery
+
+from .models import Category, Transaction, TransactionDailyRollup
+from .rollups import day_start
+from .search import search_transactions
+
+
+def filter_category_subtree(queryset, name, value):
+    """
+    Категория и все её потомки одним условием по MPTT-полям: (tree_id, lft BETWEEN lft AND rght) корня.
+
+    Границы корня берутся подзапросом по первичному ключу, без раскрытия списка id потомков.
+    """
+    root = Category.objects.filter(pk=int(value)).order_by()
+    return queryset.filter(
+        **{
+            f'{name}__tree_id': Subquery(root.values('tree_id')),
+            f'{name}__lft__gte': Subquery(root.values('lft')),
+            f'{name}__lft__lte': Subquery(root.values('rght')),
+        }
+    )
+
+
+class FilterParamsError(ValueError):
+    """Некорректные параметры фильтрации; errors - {поле: [сообщения]}"""
 
-from .models import Transaction
+    def __init__(self, errors):
+        super().__init__('Некорректные параметры фильтрации')
+        self.errors = {field: list(messages) for field, messages in errors.items()}
+
+
+def validated_qs(filterset):
+    """
+    Отфильтрованный queryset; при некорректных параметрах - FilterParamsError.
+
+    FilterSet.qs молча пропускает поля, не прошедшие валидацию, и отвечает по более широкой выборке.
+    """
+    if filterset.is_bound and not filterset.is_valid():
+        raise FilterParamsError(filterset.errors)
+    return filterset.qs
+
+
+class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+    """Список значений через запятую: status__in=1,2"""
 
 
 class TransactionFilter(django_filters.FilterSet):
-    date_from = django_filters.DateFilter(field_name='date', lookup_expr='gte')
-    date_to = django_filters.DateFilter(field_name='date', lookup_expr='lte')
+    """
+    Фильтры транзакций. Все условия сравнивают колонки напрямую, без функций над ними,
+    поэтому применимы индексы: дни - полуинтервалом date >= начало дня AND date < начало следующего,
+    datetime_from / datetime_to - границы с точностью до времени (datetime_to не включается).
+    search - полнотекстовый поиск по комментарию и названиям справочников (см. search.py).
+    """
+
+    date_from = django_filters.DateFilter(field_name='date', method='filter_date_from')
+    date_to = django_filters.DateFilter(field_name='date', method='filter_date_to')
+    datetime_from = django_filters.IsoDateTimeFilter(field_name='date', lookup_expr='gte')
+    datetime_to = django_filters.IsoDateTimeFilter(field_name='date', lookup_expr='lt')
     status = django_filters.NumberFilter(field_name='status_id')
+    status__in = NumberInFilter(field_name='status_id', lookup_expr='in')
     transaction_type = django_filters.NumberFilter(field_name='transaction_type_id')
+    transaction_type__in = NumberInFilter(field_name='transaction_type_id', lookup_expr='in')
     category = django_filters.NumberFilter(field_name='category_id')
+    category__in = NumberInFilter(field_name='category_id', lookup_expr='in')
+    category_subtree = django_filters.NumberFilter(field_name='category', method='filter_category_subtree')
+    amount_min = django_filters.NumberFilter(field_name='amount', lookup_expr='gte')
+    amount_max = django_filters.NumberFilter(field_name='amount', lookup_expr='lte')
+    search = django_filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Transaction
-        fields = ['date_from', 'date_to', 'status', 'transaction_type', 'category']
+        fields = [
+            'date_from',
+            'date_to',
+            'datetime_from',
+            'datetime_to',
+            'status',
+            'status__in',
+            'transaction_type',
+            'transaction_type__in',
+            'category',
+            'category__in',
+            'category_subtree',
+            'amount_min',
+            'amount_max',
+            'search',
+        ]
+
+    def filter_date_from(self, queryset, name, value):
+        return queryset.filter(**{f'{name}__gte': day_start(value)})
+
+    def filter_date_to(self, queryset, name, value):
+        """Дата окончания включается целиком: date < начало следующего дня"""
+        return queryset.filter(**{f'{name}__lt': day_start(value + timedelta(days=1))})
+
+    def filter_category_subtree(self, queryset, name, value):
+        return filter_category_subtree(queryset, name, value)
+
+    def filter_search(self, queryset, name, value):
+        return search_transactions(queryset, value)
+
+
+class TransactionRollupFilter(django_filters.FilterSet):
+    """
+    Параметры TransactionFilter, которые можно применить к дневным агрегатам.
+
+    Суммы, время внутри дня и комментарии в агрегатах не сохраняются, поэтому amount_min/amount_max,
+    datetime_from/datetime_to и search здесь не поддерживаются - статистика с ними считается по транзакциям.
+    """
+
+    date_from = django_filters.DateFilter(field_name='day', lookup_expr='gte')
+    date_to = django_filters.DateFilter(field_name='day', lookup_expr='lte')
+    status = django_filters.NumberFilter(field_name='status_id')
+    status__in = NumberInFilter(field_name='status_id', lookup_expr='in')
+    transaction_type = django_filters.NumberFilter(field_name='transaction_type_id')
+    transaction_type__in = NumberInFilter(field_name='transaction_type_id', lookup_expr='in')
+    category = django_filters.NumberFilter(field_name='category_id')
+    category__in = NumberInFilter(field_name='category_id', lookup_expr='in')
+    category_subtree = django_filters.NumberFilter(field_name='category', method='filter_category_subtree')
+
+    class Meta:
+        model = TransactionDailyRollup
+        fields = [
+            'date_from',
+            'date_to',
+            'status',
+            'status__in',
+            'transaction_type',
+            'transaction_type__in',
+            'category',
+            'category__in',
+            'category_subtree',
+        ]
+
+    def filter_category_subtree(self, queryset, name, value):
+        return filter_category_subtree(queryset, name, value)
+
+    @classmethod
+    def supports(cls, params, ignore=()):
+        """Можно ли ответить на запрос с такими параметрами по агрегатам"""
+        return all(key in cls.base_filters or key in ignore for key, value in params.items() if value not in ('', None))
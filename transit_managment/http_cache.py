@@ -0,0 +1,77 @@
+import hashlib
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from .cache_versions import get_versions
+
+CONDITIONAL_METHODS = ('GET', 'HEAD')
+
+
+class NotModified(Exception):
+    """Ответ 304 вместо выполнения действия"""
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+def make_etag(request, versions, renderer_format=None):
+    """
+    Сильный ETag ответа: версии данных, путь, формат и параметры запроса без учёта их порядка.
+
+    Версии сбрасываются сигналами при записи (cache_versions), поэтому ETag вычисляется без запросов к БД.
+    """
+    params = sorted((key, value) for key, values in request.GET.lists() for value in values)
+    raw = '|'.join([request.path, renderer_format or '', ':'.join(versions), repr(params)])
+    return f'"{hashlib.sha1(raw.encode()).hexdigest()}"'
+
+
+def reference_cache_control():
+    return {'public': True, 'max_age': settings.HTTP_CACHE_REFERENCE_MAX_AGE}
+
+
+def revalidate_cache_control():
+    # Кешировать можно, но перед каждым использованием - проверка ETag
+    return {'public': True, 'no_cache': True}
+
+
+class ConditionalGetMixin:
+    """
+    ETag, 304 Not Modified и Cache-Control для действий чтения ViewSet.
+
+    etag_versions - наборы данных из cache_versions, от которых зависит ответ;
+    conditional_actions - действия, для которых работает условный GET;
+    cache_control - функция, возвращающая параметры patch_cache_control.
+    Совпавший If-None-Match отвечает 304 до обращения к БД.
+    """
+
+    etag_versions = ()
+    conditional_actions = ('list', 'retrieve')
+    cache_control = staticmethod(reference_cache_control)
+
+    def get_etag(self, request):
+        if request.method not in CONDITIONAL_METHODS or self.action not in self.conditional_actions:
+            return None
+        renderer = getattr(request, 'accepted_renderer', None)
+        return make_etag(request, get_versions(*self.etag_versions), renderer and renderer.format)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.etag = self.get_etag(request)
+        if self.etag:
+            response = get_conditional_response(request, etag=self.etag)
+            if response is not None:
+                raise NotModified(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code in (200, 304):
+            response['ETag'] = self.etag
+            patch_cache_control(response, **self.cache_control())
+        return response
@@ -0,0 +1,242 @@
+import codecs
+import csv
+import io
+import json
+import logging
+from decimal import Decimal, InvalidOperation
+
+from django.db import DatabaseError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import rollups
+from .category_tree import category_errors, get_category_tree
+from .models import Transaction
+from .references import get_references
+from .signals import transactions_changed
+
+logger = logging.getLogger('default')
+
+DEFAULT_CHUNK_SIZE = 5000
+MAX_CHUNK_SIZE = 10000
+DEFAULT_MAX_ERRORS = 1000
+FORMATS = ('csv', 'jsonl')
+
+AMOUNT_MIN = Decimal('0.01')
+AMOUNT_MAX = Decimal('9999999999.99')
+AMOUNT_QUANT = Decimal('0.01')
+
+
+class RowValidationError(ValueError):
+    """Ошибки в одной строке импорта"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def detect_format(filename='', content_type=''):
+    """Формат по расширению файла или Content-Type"""
+    name = (filename or '').lower()
+    content_type = (content_type or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'jsonl'
+    if name.endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+    return None
+
+
+def as_text(stream, encoding='utf-8-sig'):
+    """Текстовый поток поверх бинарного без чтения файла в память"""
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    if hasattr(stream, 'readable'):
+        return io.TextIOWrapper(stream, encoding=encoding, newline='')
+    # Тело HttpRequest умеет только read/readline
+    return codecs.getreader(encoding)(stream)
+
+
+def iter_csv(stream):
+    reader = csv.DictReader(as_text(stream))
+    for row in reader:
+        # Номер строки файла с учётом заголовка
+        yield reader.line_num, row
+
+
+def iter_jsonl(stream):
+    for line_num, line in enumerate(as_text(stream), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_num, e
+            continue
+        yield line_num, row
+
+
+READERS = {
+    'csv': iter_csv,
+    'jsonl': iter_jsonl,
+}
+
+
+class ImportResult:
+    def __init__(self, max_errors):
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+        self.max_errors = max_errors
+
+    def add_error(self, line_num, errors):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': line_num, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+class TransactionImporter:
+    """
+    Потоковый импорт транзакций.
+
+    Строки проверяются по справочникам и дереву категорий в памяти (те же правила, что в Transaction.clean),
+    а пишутся bulk_create пачками по chunk_size, каждая пачка - в своей транзакции БД. Ошибка БД при записи
+    пачки (например, IntegrityError) откатывает только её: строки пачки попадают в отчёт, импорт продолжается.
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, max_errors=DEFAULT_MAX_ERRORS, on_chunk=None):
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self.on_chunk = on_chunk
+        self.references = get_references()
+        self.tree = get_category_tree()
+
+    def run(self, stream, fmt):
+        result = ImportResult(self.max_errors)
+        batch, lines, deltas = [], [], rollups.new_deltas()
+        try:
+            for line_num, row in READERS[fmt](stream):
+                try:
+                    batch.append(self.build(row))
+                except RowValidationError as e:
+                    result.add_error(line_num, e.errors)
+                    continue
+                lines.append(line_num)
+                if len(batch) >= self.chunk_size:
+                    rollups.merge_deltas(deltas, self.flush(batch, lines, result))
+                    batch, lines = [], []
+            if batch:
+                rollups.merge_deltas(deltas, self.flush(batch, lines, result))
+        finally:
+            # Один сигнал на весь импорт (в том числе прерванный): кеши сбрасываются один раз, а не после каждой пачки
+            if deltas:
+                transactions_changed.send(sender=Transaction, days=rollups.changed_days(deltas))
+        return result
+
+    def flush(self, batch, lines, result):
+        """Запись пачки вместе с дневными агрегатами; возвращает изменения агрегатов"""
+        try:
+            deltas = rollups.bulk_create(batch)
+        except DatabaseError as e:
+            logger.warning('Импорт: пачка строк %s-%s не записана: %s', lines[0], lines[-1], e)
+            for line_num in lines:
+                result.add_error(line_num, [f'Пачка не записана: {e}'])
+            deltas = rollups.new_deltas()
+        else:
+            result.created += len(batch)
+        if self.on_chunk is not None:
+            self.on_chunk(result)
+        return deltas
+
+    def build(self, row):
+        if isinstance(row, Exception):
+            raise RowValidationError([f'Некорректный JSON: {row}'])
+        if not isinstance(row, dict):
+            raise RowValidationError(['Ожидается объект с полями транзакции'])
+
+        errors = []
+        date = self.parse_date(row.get('date'), errors)
+        status_id = self.resolve(row.get('status'), self.references.statuses_by_id, self.references.status_ids)
+        if status_id is None:
+            errors.append(f"Неизвестный статус '{row.get('status')}'")
+        transaction_type_id = self.resolve(
+            row.get('transaction_type'),
+            self.references.transaction_types_by_id,
+            self.references.transaction_type_ids,
+        )
+        if transaction_type_id is None:
+            errors.append(f"Неизвестный тип операции '{row.get('transaction_type')}'")
+        category_id = self.check_category(row.get('category'), transaction_type_id, errors)
+        amount = self.parse_amount(row.get('amount'), errors)
+
+        if errors:
+            raise RowValidationError(errors)
+        return Transaction(
+            date=date,
+            status_id=status_id,
+            transaction_type_id=transaction_type_id,
+            category_id=category_id,
+            amount=amount,
+            comment=str(row.get('comment') or ''),
+        )
+
+    @staticmethod
+    def resolve(value, by_id, ids_by_name):
+        """Справочник можно указать id или названием"""
+        if value in (None, ''):
+            return None
+        try:
+            pk = int(value)
+        except (TypeError, ValueError):
+            return ids_by_name.get(str(value).strip())
+        return pk if pk in by_id else None
+
+    def check_category(self, value, transaction_type_id, errors):
+        try:
+            category_id = int(value)
+        except (TypeError, ValueError):
+            errors.append(f"Неизвестная категория '{value}'")
+            return None
+        # Дерево - снимок на начало импорта: неизвестные id не догружаются по одному
+        errors.extend(category_errors(category_id, transaction_type_id, tree=self.tree, fetch_missing=False))
+        return category_id
+
+    @staticmethod
+    def parse_date(value, errors):
+        if value in (None, ''):
+            return timezone.now()
+        value = str(value).strip()
+        try:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                day = parse_date(value)
+                parsed = rollups.day_start(day) if day else None
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            errors.append(f"Некорректная дата '{value}'")
+            return None
+        return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+    @staticmethod
+    def parse_amount(value, errors):
+        try:
+            amount = Decimal(str(value).strip().replace(',', '.'))
+        except (InvalidOperation, ValueError):
+            errors.append(f"Некорректная сумма '{value}'")
+            return None
+        if not amount.is_finite() or amount < AMOUNT_MIN or amount > AMOUNT_MAX:
+            errors.append(f'Сумма должна быть от {AMOUNT_MIN} до {AMOUNT_MAX}')
+            return None
+        if amount != amount.quantize(AMOUNT_QUANT):
+            errors.append('Сумма должна содержать не более двух знаков после запятой')
+            return None
+        return amount
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from transit_managment import balances
+
+
+class Command(BaseCommand):
+    help = 'Достраивает контрольные точки остатка за прошедшие дни, за которые их ещё нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            help='Повторять каждые N секунд (периодическая задача под supervisor)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            created = balances.fill()
+            self.stdout.write(self.style.SUCCESS(f'Контрольные точки остатка достроены: {created} строк'))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,148 @@
+import math
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+from django.utils import timezone
+
+from transit_managment import rollups
+from transit_managment.models import Category, Status, Transaction, TransactionType
+from transit_managment.signals import transactions_changed
+from transit_managment.stats import EXPENSE_TYPE_NAME, INCOME_TYPE_NAME
+
+SYNTHETIC_ROOT = 'Синтетика'
+
+# Словарь комментариев: частые и редкие слова, чтобы поиск по комментариям был избирательным
+COMMENT_PURPOSES = [
+    'Оплата',
+    'Возврат',
+    'Перевод',
+    'Аванс',
+    'Пополнение',
+    'Комиссия',
+]
+COMMENT_SUBJECTS = [
+    'аренды офиса',
+    'хостинга',
+    'рекламы',
+    'канцелярии',
+    'такси',
+    'командировки',
+    'обучения',
+    'подписки',
+    'связи',
+    'налога',
+    'зарплаты',
+    'поставщику',
+]
+
+
+class Command(BaseCommand):
+    help = 'Генерирует синтетический журнал транзакций для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int, help='Количество транзакций')
+        parser.add_argument('--days', type=int, default=3 * 365, help='Глубина истории в днях')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Размер пачки bulk_create')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора случайных чисел')
+        parser.add_argument('--tree-width', type=int, default=4, help='Ширина синтетического дерева категорий')
+        parser.add_argument('--tree-depth', type=int, default=3, help='Глубина синтетического дерева категорий')
+        parser.add_argument(
+            '--income-share',
+            type=float,
+            default=0.2,
+            help='Доля поступлений среди операций',
+        )
+        parser.add_argument(
+            '--skip-rollups',
+            action='store_true',
+            help='Не обновлять агрегаты по ходу генерации, а пересчитать их в конце',
+        )
+
+    def handle(self, *args, **options):
+        if options['count'] <= 0:
+            raise CommandError('Количество транзакций должно быть положительным')
+
+        call_command('load_initial_data')
+        self.random = random.Random(options['seed'])
+        statuses = list(Status.objects.values_list('id', flat=True))
+        income_type = TransactionType.objects.get(name=INCOME_TYPE_NAME)
+        expense_type = TransactionType.objects.get(name=EXPENSE_TYPE_NAME)
+
+        for transaction_type in (income_type, expense_type):
+            self.build_tree(transaction_type, options['tree_width'], options['tree_depth'])
+        leaves = {
+            transaction_type.pk: list(
+                Category.objects.filter(transaction_type=transaction_type, rght=F('lft') + 1)
+                .order_by('tree_id', 'lft')
+                .values_list('id', flat=True)
+            )
+            for transaction_type in (income_type, expense_type)
+        }
+
+        now = timezone.now()
+        span_seconds = options['days'] * 24 * 60 * 60
+        created = 0
+        while created < options['count']:
+            size = min(options['batch_size'], options['count'] - created)
+            batch = []
+            for _ in range(size):
+                is_income = self.random.random() < options['income_share']
+                transaction_type = income_type if is_income else expense_type
+                batch.append(
+                    Transaction(
+                        date=now - timedelta(seconds=self.random.randrange(span_seconds)),
+                        status_id=self.random.choice(statuses),
+                        transaction_type_id=transaction_type.pk,
+                        category_id=self.random.choice(leaves[transaction_type.pk]),
+                        amount=self.amount(is_income),
+                        comment=self.comment(created + len(batch) + 1),
+                    )
+                )
+
+            if options['skip_rollups']:
+                Transaction.objects.bulk_create(batch)
+            else:
+                deltas = rollups.bulk_create(batch)
+                transactions_changed.send(sender=Transaction, days=rollups.changed_days(deltas))
+            created += size
+            self.stdout.write(f'Создано: {created} из {options["count"]}')
+
+        if options['skip_rollups']:
+            # Пересчёт агрегатов сам сбрасывает кеши по всем дням
+            call_command('rebuild_rollups', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Сгенерировано транзакций: {created}'))
+
+    def comment(self, number):
+        purpose = self.random.choice(COMMENT_PURPOSES)
+        subject = self.random.choice(COMMENT_SUBJECTS)
+        return f'{purpose} {subject}, синтетическая операция {number}'
+
+    def build_tree(self, transaction_type, width, depth):
+        """Синтетическое поддерево категорий: width потомков на уровень, depth уровней"""
+        root, _ = Category.objects.get_or_create(
+            name=SYNTHETIC_ROOT,
+            transaction_type=transaction_type,
+            parent=None,
+        )
+        level = [root]
+        for _ in range(depth):
+            next_level = []
+            for parent in level:
+                for index in range(1, width + 1):
+                    child, _ = Category.objects.get_or_create(
+                        name=f'{parent.name}.{index}',
+                        transaction_type=transaction_type,
+                        parent=parent,
+                    )
+                    next_level.append(child)
+            level = next_level
+
+    def amount(self, is_income):
+        """Логнормальное распределение сумм: много мелких расходов, редкие крупные поступления"""
+        mu = 10.0 if is_income else 7.0
+        value = math.exp(self.random.gauss(mu, 1.0))
+        return Decimal(f'{min(max(value, 1.0), 9_999_999.0):.2f}')
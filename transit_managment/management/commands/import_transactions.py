@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from transit_managment.importers import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_MAX_ERRORS,
+    FORMATS,
+    TransactionImporter,
+    detect_format,
+)
+
+
+class Command(BaseCommand):
+    help = 'Импортирует транзакции из CSV или JSON Lines пачками через bulk_create'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='Путь к файлу')
+        parser.add_argument('--format', choices=FORMATS, help='Формат файла (по умолчанию - по расширению)')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Размер пачки')
+        parser.add_argument(
+            '--max-errors',
+            type=int,
+            default=DEFAULT_MAX_ERRORS,
+            help='Сколько ошибок сохранять в отчёте',
+        )
+        parser.add_argument('--errors-file', type=str, help='Куда записать отчёт об ошибках (JSON)')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or detect_format(options['path'])
+        if fmt is None:
+            raise CommandError('Не удалось определить формат файла, укажите --format')
+
+        def progress(result):
+            self.stdout.write(f'Загружено: {result.created}, ошибок: {result.failed}')
+
+        importer = TransactionImporter(
+            chunk_size=options['chunk_size'],
+            max_errors=options['max_errors'],
+            on_chunk=progress,
+        )
+        try:
+            with open(options['path'], 'rb') as stream:
+                result = importer.run(stream, fmt)
+        except OSError as e:
+            raise CommandError(str(e))
+
+        if options['errors_file']:
+            with open(options['errors_file'], 'w', encoding='utf-8') as errors_file:
+                json.dump(result.as_dict(), errors_file, ensure_ascii=False, indent=2)
+        else:
+            for error in result.errors:
+                self.stderr.write(f'Строка {error["row"]}: {"; ".join(error["errors"])}')
+
+        self.stdout.write(self.style.SUCCESS(f'Импорт завершён: создано {result.created}, ошибок {result.failed}'))
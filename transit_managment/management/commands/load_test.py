@@ -0,0 +1,152 @@
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from transit_managment.benchmarks import percentile
+
+# Сценарий: путь относительно /backend/api/ (синхронный) и /backend/api/async/ (асинхронный)
+SCENARIOS = {
+    'list': 'transactions/?page_size=50',
+    'retrieve': 'transactions/{id}/',
+    'tree': 'categories/tree/',
+    'stats': 'transactions/stats/',
+    # Долгий отчёт: разбивка по дням и категориям по всей истории
+    'report': 'transactions/stats/?period=day&group_by=category',
+}
+PREFIXES = {
+    'sync': '/backend/api/',
+    'async': '/backend/api/async/',
+}
+DEFAULT_MIX = 'list=4,retrieve=4,tree=2,stats=1,report=1'
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест синхронного и асинхронного API смешанным потоком запросов к запущенному серверу'
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_url', help='Адрес сервера, например http://127.0.0.1:8000')
+        parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='both')
+        parser.add_argument('--concurrency', type=int, default=32, help='Количество одновременных клиентов')
+        parser.add_argument('--duration', type=float, default=30.0, help='Длительность прогона в секундах')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help='Веса сценариев, например list=4,report=1')
+        parser.add_argument('--timeout', type=float, default=60.0, help='Таймаут одного запроса в секундах')
+        parser.add_argument('--output', help='Сохранить результат в JSON-файл')
+
+    def handle(self, *args, **options):
+        self.base_url = options['base_url'].rstrip('/')
+        self.timeout = options['timeout']
+        mix = self.parse_mix(options['mix'])
+        self.ids = self.fetch_ids()
+
+        modes = list(PREFIXES) if options['mode'] == 'both' else [options['mode']]
+        report = {}
+        for mode in modes:
+            self.stdout.write(f'Режим {mode}: {options["concurrency"]} клиентов, {options["duration"]} с')
+            report[mode] = self.run(PREFIXES[mode], mix, options['concurrency'], options['duration'])
+            self.print_report(report[mode])
+
+        if len(report) == 2:
+            self.print_comparison(report['sync'], report['async'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+    @staticmethod
+    def parse_mix(value):
+        mix = {}
+        for item in value.split(','):
+            name, _, weight = item.partition('=')
+            name = name.strip()
+            if name not in SCENARIOS:
+                raise CommandError(f"Неизвестный сценарий '{name}'. Допустимые значения: {', '.join(SCENARIOS)}")
+            try:
+                mix[name] = int(weight or 1)
+            except ValueError:
+                raise CommandError(f"Некорректный вес сценария '{item}'")
+        return mix
+
+    def fetch_ids(self):
+        status, body = self.request(f'{PREFIXES["sync"]}transactions/?page_size=500')
+        if status != 200:
+            raise CommandError(f'Сервер недоступен или вернул {status}')
+        ids = [item['id'] for item in json.loads(body)['results']]
+        if not ids:
+            raise CommandError('Нет транзакций: сгенерируйте данные командой generate_ledger')
+        return ids
+
+    def request(self, path):
+        try:
+            with urllib.request.urlopen(self.base_url + path, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, b''
+        except OSError:
+            return None, b''
+
+    def run(self, prefix, mix, concurrency, duration):
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        deadline = time.perf_counter() + duration
+        lock = threading.Lock()
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+
+        def client(seed):
+            generator = random.Random(seed)
+            while time.perf_counter() < deadline:
+                name = generator.choices(names, weights)[0]
+                path = prefix + SCENARIOS[name].format(id=generator.choice(self.ids))
+                started = time.perf_counter()
+                status, _ = self.request(path)
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    latencies[name].append(elapsed)
+                    if status != 200:
+                        errors[name] += 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(client, seed) for seed in range(concurrency)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        total = sum(len(values) for values in latencies.values())
+        return {
+            'requests': total,
+            'rps': round(total / elapsed, 1),
+            'scenarios': {
+                name: {
+                    'requests': len(values),
+                    'errors': errors[name],
+                    'p50': round(percentile(values, 50), 2),
+                    'p95': round(percentile(values, 95), 2),
+                    'p99': round(percentile(values, 99), 2),
+                    'max': round(max(values), 2),
+                }
+                for name, values in latencies.items()
+            },
+        }
+
+    def print_report(self, result):
+        self.stdout.write(f'Запросов: {result["requests"]}, RPS: {result["rps"]}')
+        self.stdout.write(f'{"сценарий":<12}{"запросы":>9}{"ошибки":>8}{"p50":>10}{"p95":>10}{"p99":>10}{"max":>10}')
+        for name, values in sorted(result['scenarios'].items()):
+            self.stdout.write(
+                f'{name:<12}{values["requests"]:>9}{values["errors"]:>8}{values["p50"]:>10.2f}'
+                f'{values["p95"]:>10.2f}{values["p99"]:>10.2f}{values["max"]:>10.2f}'
+            )
+
+    def print_comparison(self, sync, async_):
+        self.stdout.write(f'RPS: sync {sync["rps"]}, async {async_["rps"]}')
+        self.stdout.write(f'{"p95, мс":<12}{"sync":>10}{"async":>10}')
+        for name in sorted(set(sync['scenarios']) & set(async_['scenarios'])):
+            self.stdout.write(
+                f'{name:<12}{sync["scenarios"][name]["p95"]:>10.2f}{async_["scenarios"][name]["p95"]:>10.2f}'
+            )
@@ -0,0 +1,116 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from transit_managment import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        'Помесячное секционирование таблицы транзакций в PostgreSQL: перевод существующей таблицы, '
+        'создание секций на будущие месяцы и проверка отсечения секций'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Алиас подключения')
+        parser.add_argument(
+            '--convert',
+            action='store_true',
+            help='Перевести обычную таблицу на секции (копирование пачками без остановки записи)',
+        )
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=settings.TRANSACTION_PARTITION_MONTHS_AHEAD,
+            help='На сколько месяцев вперёд создавать секции',
+        )
+        parser.add_argument('--batch-size', type=int, default=50000, help='Размер пачки копирования при --convert')
+        parser.add_argument('--pause', type=float, default=0.0, help='Пауза между пачками в секундах')
+        parser.add_argument('--verify', action='store_true', help='Проверить отсечение секций фильтрами по датам')
+        parser.add_argument('--drop-old', action='store_true', help='Удалить старую таблицу после перевода')
+        parser.add_argument(
+            '--interval',
+            type=int,
+            help='Повторять создание секций каждые N секунд (периодическая задача под supervisor)',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.TRANSACTION_PARTITIONING:
+            self.stdout.write('Секционирование выключено (TRANSACTION_PARTITIONING=False)')
+            return
+
+        connection = connections[options['database']]
+        try:
+            if options['convert']:
+                partitions.require_postgresql(connection)
+                rows = partitions.convert(
+                    connection,
+                    months_ahead=options['months_ahead'],
+                    batch_size=max(1, options['batch_size']),
+                    pause=options['pause'],
+                    stdout=self.stdout,
+                )
+                self.stdout.write(self.style.SUCCESS(f'Таблица переведена на секции: {rows} строк'))
+
+            self.ensure_partitions(connection, options['months_ahead'])
+
+            if options['drop_old']:
+                partitions.drop_old_table(connection)
+                self.stdout.write(f'Удалена таблица {partitions.OLD_TABLE}')
+        except partitions.PartitioningError as e:
+            if not options['interval']:
+                raise CommandError(str(e))
+            # Под supervisor выход с ошибкой перезапускал бы задачу в цикле: она ждёт, пока таблицу переведут
+            self.stderr.write(self.style.WARNING(str(e)))
+
+        if options['verify']:
+            self.verify(connection)
+
+        while options['interval']:
+            # Соединение не держится открытым между запусками
+            connection.close()
+            time.sleep(options['interval'])
+            try:
+                self.ensure_partitions(connection, options['months_ahead'])
+            except partitions.PartitioningError as e:
+                # Задача продолжает работать: следующая попытка - через интервал
+                self.stderr.write(str(e))
+
+    def ensure_partitions(self, connection, months_ahead):
+        partitions.require_postgresql(connection)
+        if not partitions.is_partitioned(connection):
+            raise partitions.PartitioningError(
+                f'Таблица {partitions.TABLE} не секционирована - запустите команду с --convert'
+            )
+        today = timezone.localdate()
+        created = partitions.ensure_partitions(
+            connection,
+            partitions.month_start(today),
+            partitions.month_start(today + timedelta(days=31 * months_ahead)),
+        )
+        for name in created:
+            self.stdout.write(f'Создана секция {name}')
+
+    def verify(self, connection):
+        today = timezone.localdate()
+        month = partitions.month_start(today)
+        previous = partitions.month_start(month - timedelta(days=1))
+        ranges = [
+            (today, today),
+            (month, today),
+            (previous, month - timedelta(days=1)),
+            (partitions.month_start(previous - timedelta(days=60)), today),
+        ]
+        failed = False
+        for (date_from, date_to), scanned, expected, ok in partitions.verify_pruning(connection, ranges):
+            status = self.style.SUCCESS('OK') if ok else self.style.ERROR('ЛИШНИЕ СЕКЦИИ')
+            self.stdout.write(f'{date_from} - {date_to}: {", ".join(sorted(scanned)) or "-"} [{status}]')
+            if not ok:
+                failed = True
+                self.stdout.write(f'  ожидались: {", ".join(sorted(expected))}')
+        if failed:
+            raise CommandError('Фильтры по датам читают секции за пределами диапазона')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from transit_managment import balances
+from transit_managment.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает дневные агрегаты транзакций и контрольные точки остатка с нуля'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-days',
+            type=int,
+            default=31,
+            help='Количество дней, пересчитываемых в одной транзакции БД',
+        )
+
+    def handle(self, *args, **options):
+        created = rebuild(chunk_days=options['chunk_days'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Агрегаты пересчитаны: {created} строк'))
+        checkpoints = balances.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Контрольные точки остатка пересчитаны: {checkpoints} строк'))
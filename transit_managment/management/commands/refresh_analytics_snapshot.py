@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from transit_managment.analytics import SnapshotUnavailable, refresh
+
+
+class Command(BaseCommand):
+    help = 'Обновляет колоночный снимок транзакций для аналитических отчётов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Построить снимок заново, а не обновить')
+
+    def handle(self, *args, **options):
+        try:
+            meta = refresh(full=options['full'], stdout=self.stdout)
+        except SnapshotUnavailable as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Снимок {meta["generation"]}: {meta["rows"]} транзакций'))
@@ -0,0 +1,85 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from transit_managment import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время ответа и количество SQL-запросов основных сценариев'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='Сценарии (по умолчанию все)')
+        parser.add_argument('--iterations', type=int, default=50, help='Количество замеров на сценарий')
+        parser.add_argument('--warmup', type=int, default=5, help='Количество прогревочных запросов')
+        parser.add_argument('--output', help='Сохранить результат в JSON-файл')
+        parser.add_argument('--compare', help='JSON-файл предыдущего прогона для поиска регрессий')
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=10.0,
+            help='Допустимый рост p95 в процентах при сравнении',
+        )
+        parser.add_argument('--list', action='store_true', help='Показать доступные сценарии')
+        parser.add_argument(
+            '--metrics-overhead',
+            action='store_true',
+            help='Сравнить сценарий (по умолчанию list_api_first_page) с MetricsMiddleware и без него',
+        )
+        parser.add_argument(
+            '--max-overhead',
+            type=float,
+            default=2.0,
+            help='Допустимая добавка MetricsMiddleware к времени ответа в процентах',
+        )
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name in benchmarks.SCENARIOS:
+                self.stdout.write(name)
+            return
+
+        unknown = set(options['scenarios']) - set(benchmarks.SCENARIOS)
+        if unknown:
+            raise CommandError(f'Неизвестные сценарии: {", ".join(sorted(unknown))}')
+
+        if options['metrics_overhead']:
+            self.check_metrics_overhead(options)
+            return
+
+        report = benchmarks.run(options['scenarios'], options['iterations'], options['warmup'])
+        self.print_report(report)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результат сохранён в {options["output"]}')
+
+        if options['compare']:
+            regressions = benchmarks.compare(report, benchmarks.load(options['compare']), options['threshold'])
+            for regression in regressions:
+                self.stdout.write(self.style.WARNING(json.dumps(regression, ensure_ascii=False)))
+            if regressions:
+                raise CommandError(f'Обнаружены регрессии: {len(regressions)}')
+            self.stdout.write(self.style.SUCCESS('Регрессий не обнаружено'))
+
+    def print_report(self, report):
+        meta = report['meta']
+        self.stdout.write(f'БД: {meta["database"]}, транзакций: {meta["transactions"]}, замеров: {meta["iterations"]}')
+        self.stdout.write(f'{"сценарий":<32}{"p50":>9}{"p95":>9}{"p99":>9}{"max":>9}{"запросы":>9}')
+        for name, result in report['results'].items():
+            latency = result['latency_ms']
+            self.stdout.write(
+                f'{name:<32}{latency["p50"]:>9.2f}{latency["p95"]:>9.2f}{latency["p99"]:>9.2f}'
+                f'{latency["max"]:>9.2f}{result["queries"]["max"]:>9}'
+            )
+
+    def check_metrics_overhead(self, options):
+        scenario = options['scenarios'][0] if options['scenarios'] else 'list_api_first_page'
+        result = benchmarks.metrics_overhead(scenario, options['iterations'], options['warmup'])
+        self.stdout.write(json.dumps(result, ensure_ascii=False, indent=2))
+        if result['middleware_percent'] > options['max_overhead']:
+            raise CommandError(
+                f'MetricsMiddleware добавляет {result["middleware_percent"]}% при допустимых {options["max_overhead"]}%'
+            )
+        self.stdout.write(self.style.SUCCESS(f'Добавка MetricsMiddleware: {result["middleware_percent"]}%'))
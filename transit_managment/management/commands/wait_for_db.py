@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import OperationalError
+
+
+class Command(BaseCommand):
+    help = 'Ожидает доступности базы данных (проверка перед миграциями и запуском сервера)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Алиас подключения')
+        parser.add_argument('--timeout', type=float, default=60.0, help='Общее время ожидания в секундах')
+        parser.add_argument('--interval', type=float, default=1.0, help='Пауза между попытками в секундах')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        deadline = time.monotonic() + options['timeout']
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                # Каждая попытка ограничена connect_timeout из OPTIONS подключения
+                connection.ensure_connection()
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                break
+            except OperationalError as e:
+                if time.monotonic() + options['interval'] >= deadline:
+                    raise CommandError(f'База данных недоступна после {attempt} попыток: {e}')
+                self.stderr.write(f'База данных недоступна ({e}), повтор через {options["interval"]} с')
+                time.sleep(options['interval'])
+            finally:
+                connection.close()
+
+        self.stdout.write(self.style.SUCCESS(f'База данных доступна ({connection.vendor})'))
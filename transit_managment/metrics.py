@@ -0,0 +1,280 @@
+"""
+Метрики запросов в текстовом формате Prometheus: гистограммы времени ответа по представлениям,
+числа и времени SQL-запросов, размера ответа, а также попадания в кеш ответов.
+
+MetricsMiddleware копит значения в памяти процесса - без обращений к кешу и БД на каждом запросе -
+и не чаще раза в METRICS_PUBLISH_INTERVAL секунд публикует снимок своего процесса в общий кеш.
+Эндпоинт складывает снимки всех воркеров gunicorn: счётчики накопительные, поэтому сумма снимков -
+метрика всего сервиса, а перезапуск воркера выглядит для Prometheus как обычный сброс счётчика.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .response_cache import metrics as response_cache_metrics
+
+logger = logging.getLogger('default')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'transit_'
+PROCESS_KEY = 'transit_managment:metrics:{}:{}'
+INDEX_KEY = 'transit_managment:metrics:processes'
+# Снимок простаивающего воркера не должен пропадать между запросами, но и не хранится вечно после его остановки
+SNAPSHOT_TIMEOUT = 24 * 60 * 60
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Имя -> (тип, описание, метки, границы корзин гистограммы)
+METRICS = {
+    'http_requests_total': ('counter', 'Ответы по представлению, методу и коду', ('view', 'method', 'status'), None),
+    'http_request_duration_seconds': ('histogram', 'Время ответа', ('view', 'method'), LATENCY_BUCKETS),
+    'http_request_db_queries': ('histogram', 'SQL-запросов на ответ', ('view', 'method'), QUERY_BUCKETS),
+    'http_request_db_duration_seconds': ('histogram', 'Время SQL-запросов ответа', ('view', 'method'), LATENCY_BUCKETS),
+    'http_response_size_bytes': ('histogram', 'Размер тела ответа', ('view', 'method'), SIZE_BUCKETS),
+    'http_response_cache_total': ('counter', 'Ответы из кеша: X-Cache и 304 Not Modified', ('view', 'result'), None),
+}
+
+
+class QueryTimer:
+    """execute_wrapper: число и суммарное время SQL-запросов одного ответа"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class Registry:
+    """Метрики процесса: счётчики {(имя, метки): значение} и гистограммы {(имя, метки): [корзины, сумма]}"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.published_at = 0.0
+
+    def _observe(self, name, labels, value):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[name, labels] = [[0] * (len(METRICS[name][3]) + 1), 0]
+        # Корзины хранятся без накопления: индекс - первая граница не меньше значения, последняя - +Inf
+        histogram[0][bisect_left(METRICS[name][3], value)] += 1
+        histogram[1] += value
+
+    def _inc(self, name, labels):
+        self.counters[name, labels] = self.counters.get((name, labels), 0) + 1
+
+    def record(self, view, method, status, duration, queries=None, size=None, cache_result=None):
+        labels = (view, method)
+        with self.lock:
+            self._inc('http_requests_total', (view, method, str(status)))
+            self._observe('http_request_duration_seconds', labels, duration)
+            if queries is not None:
+                self._observe('http_request_db_queries', labels, queries.count)
+                self._observe('http_request_db_duration_seconds', labels, queries.duration)
+            if size is not None:
+                self._observe('http_response_size_bytes', labels, size)
+            if cache_result is not None:
+                self._inc('http_response_cache_total', (view, cache_result))
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {key: (list(buckets), total) for key, (buckets, total) in self.histograms.items()},
+            }
+
+    def publish(self):
+        """Снимок процесса в общий кеш; ключ процесса добавляется в список, если его там ещё нет"""
+        self.published_at = time.monotonic()
+        key = PROCESS_KEY.format(socket.gethostname(), os.getpid())
+        try:
+            cache.set(key, self.snapshot(), SNAPSHOT_TIMEOUT)
+            keys = cache.get(INDEX_KEY) or []
+            if key not in keys:
+                # Заодно забываем остановленные воркеры, чьи снимки уже истекли
+                alive = cache.get_many(keys)
+                cache.set(INDEX_KEY, [*(name for name in keys if name in alive), key], None)
+        except Exception as e:
+            logger.warning('Не удалось опубликовать метрики процесса: %s', e)
+
+    def maybe_publish(self):
+        if time.monotonic() - self.published_at >= settings.METRICS_PUBLISH_INTERVAL:
+            self.publish()
+
+
+registry = Registry()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unmatched'
+
+
+def response_size(response):
+    length = response.get('Content-Length')
+    if length is not None:
+        return int(length)
+    # Размер потокового ответа (экспорт) заранее неизвестен
+    return None if response.streaming else len(response.content)
+
+
+def cache_result(response):
+    if response.status_code == 304:
+        return 'not_modified'
+    header = response.get('X-Cache')
+    return header.lower() if header else None
+
+
+class MetricsMiddleware:
+    """
+    Время ответа, SQL-запросы (через connection.execute_wrapper), размер ответа и попадания в кеш.
+
+    Ставится первым в MIDDLEWARE, чтобы время включало остальные middleware. Под ASGI соединения БД
+    привязаны к потоку синхронной части запроса, поэтому execute_wrapper ставится и снимается в нём.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def wrap_connections(queries):
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(queries))
+        return stack
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        queries = QueryTimer()
+        started = time.perf_counter()
+        with self.wrap_connections(queries):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    async def __acall__(self, request):
+        queries = QueryTimer()
+        started = time.perf_counter()
+        # Соединения БД у синхронного кода запроса (sync_to_async, асинхронный ORM) свои и живут в его потоке,
+        # поэтому счётчик запросов ставится на них там же
+        stack = await sync_to_async(self.wrap_connections)(queries)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    def record(self, request, response, duration, queries=None):
+        registry.record(
+            view_name(request),
+            request.method,
+            response.status_code,
+            duration,
+            queries,
+            response_size(response),
+            cache_result(response),
+        )
+        registry.maybe_publish()
+
+
+def merge(snapshots):
+    """Сумма снимков нескольких процессов"""
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for key, value in snapshot['counters'].items():
+            counters[key] = counters.get(key, 0) + value
+        for key, (buckets, total) in snapshot['histograms'].items():
+            merged = histograms.setdefault(key, [[0] * len(buckets), 0])
+            merged[0] = [left + right for left, right in zip(merged[0], buckets, strict=True)]
+            merged[1] += total
+    return {'counters': counters, 'histograms': histograms}
+
+
+def collect():
+    """Метрики всех процессов, опубликовавших снимок в общий кеш (текущий процесс - свежим снимком)"""
+    registry.publish()
+    try:
+        snapshots = list(cache.get_many(cache.get(INDEX_KEY) or []).values())
+    except Exception as e:
+        logger.warning('Не удалось прочитать метрики процессов: %s', e)
+        snapshots = []
+    return merge(snapshots or [registry.snapshot()])
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values, strict=True), *extra]
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(merged):
+    """Текстовый формат Prometheus 0.0.4"""
+    lines = []
+    for name, (kind, description, label_names, buckets) in METRICS.items():
+        full_name = PREFIX + name
+        lines += [f'# HELP {full_name} {description}', f'# TYPE {full_name} {kind}']
+        if kind == 'counter':
+            for (metric, labels), value in sorted(merged['counters'].items()):
+                if metric == name:
+                    lines.append(f'{full_name}{_labels(label_names, labels)} {value}')
+            continue
+        for (metric, labels), (counts, total) in sorted(merged['histograms'].items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip([*buckets, '+Inf'], counts, strict=True):
+                cumulative += count
+                lines.append(f'{full_name}_bucket{_labels(label_names, labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{full_name}_sum{_labels(label_names, labels)} {_number(total)}')
+            lines.append(f'{full_name}_count{_labels(label_names, labels)} {cumulative}')
+
+    # Счётчики серверного кеша ответов уже общие для всех процессов (response_cache)
+    cache_metrics = response_cache_metrics()
+    for counter in ('hits', 'misses'):
+        full_name = f'{PREFIX}response_cache_{counter}_total'
+        lines += [f'# HELP {full_name} Серверный кеш ответов: {counter}', f'# TYPE {full_name} counter']
+        for kind, values in cache_metrics.items():
+            lines.append(f'{full_name}{_labels(("kind",), (kind,))} {values[counter]}')
+    return '\n'.join(lines) + '\n'
+
+
+def export():
+    return render(collect())
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_rollups(apps, schema_editor):
+    Transaction = apps.get_model('transit_managment', 'Transaction')
+    TransactionDailyRollup = apps.get_model('transit_managment', 'TransactionDailyRollup')
+
+    rows = (
+        Transaction.objects.order_by()
+        .annotate(day=TruncDate('date'))
+        .values('day', 'status_id', 'transaction_type_id', 'category_id')
+        .annotate(total=Sum('amount'), count=Count('pk'))
+    )
+    TransactionDailyRollup.objects.bulk_create(
+        (TransactionDailyRollup(**row) for row in rows.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transit_managment', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=18, verbose_name='Сумма (руб.)')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество операций')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transit_managment.category', verbose_name='Категория')),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transit_managment.status', verbose_name='Статус')),
+                ('transaction_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transit_managment.transactiontype', verbose_name='Тип операции')),
+            ],
+            options={
+                'verbose_name': 'Дневной агрегат',
+                'verbose_name_plural': 'Дневные агрегаты',
+                'ordering': ['-day'],
+                'unique_together': {('day', 'status', 'transaction_type', 'category')},
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
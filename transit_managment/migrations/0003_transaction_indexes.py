@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BRIN_INDEX_NAME = 'transaction_date_brin_idx'
+
+
+def create_brin_index(apps, schema_editor):
+    """
+    BRIN по date для PostgreSQL: компактный индекс для таблиц, куда данные в основном дописываются.
+
+    Создаётся всегда, когда база - PostgreSQL, чтобы схема зависела только от состояния миграций.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {BRIN_INDEX_NAME} ON transit_managment_transaction USING brin (date)'
+    )
+
+
+def drop_brin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {BRIN_INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transit_managment', '0002_transactiondailyrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['-date', '-created_at'], name='transaction_date_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['status', 'date'], include=('transaction_type', 'amount'), name='transaction_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['category', 'date'], include=('transaction_type', 'amount'), name='transaction_category_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_type', 'date'], include=('amount',), name='transaction_type_date_idx'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='category',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='transit_managment.category', verbose_name='Категория'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='status',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='transit_managment.status', verbose_name='Статус'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_type',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='transit_managment.transactiontype', verbose_name='Тип операции'),
+        ),
+        migrations.RunPython(create_brin_index, drop_brin_index),
+    ]
@@ -0,0 +1,74 @@
+from django.db import migrations
+
+TRANSACTION_TABLE = 'transit_managment_transaction'
+FTS_TABLE = 'transit_managment_transaction_fts'
+SEARCH_INDEX_NAME = 'transaction_comment_search_idx'
+TRIGRAM_INDEX_NAME = 'transaction_comment_trgm_idx'
+# Конфигурация зашита в миграцию, чтобы схема не зависела от настроек: TRANSACTION_SEARCH_CONFIG
+# должна с ней совпадать, а её смена - это новая миграция с пересозданием индекса
+SEARCH_CONFIG = 'russian'
+
+# Таблица FTS5 хранит только индекс (content=...), сами комментарии читаются из таблицы транзакций.
+# Триггеры поддерживают индекс при любой записи, включая bulk_create и queryset.update().
+# Пересоздание таблицы транзакций в SQLite (AlterField и т.п.) удаляет триггеры - такую миграцию
+# нужно дополнить повторным созданием SQLITE_FORWARD.
+SQLITE_FORWARD = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+    f"comment, content='{TRANSACTION_TABLE}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    f'CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {TRANSACTION_TABLE} BEGIN '
+    f'INSERT INTO {FTS_TABLE}(rowid, comment) VALUES (new.id, new.comment); END',
+    f'CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {TRANSACTION_TABLE} BEGIN '
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, comment) VALUES ('delete', old.id, old.comment); END",
+    f'CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF comment ON {TRANSACTION_TABLE} BEGIN '
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, comment) VALUES ('delete', old.id, old.comment); "
+    f'INSERT INTO {FTS_TABLE}(rowid, comment) VALUES (new.id, new.comment); END',
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def postgres_forward():
+    # Выражения индексов совпадают с SQL, который Django строит для SearchVector и comment__icontains
+    return [
+        f'CREATE INDEX IF NOT EXISTS {SEARCH_INDEX_NAME} ON {TRANSACTION_TABLE} USING gin '
+        f"(to_tsvector('{SEARCH_CONFIG}'::regconfig, COALESCE((comment)::text, '')))",
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        f'CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX_NAME} ON {TRANSACTION_TABLE} USING gin '
+        '(UPPER((comment)::text) gin_trgm_ops)',
+    ]
+
+
+POSTGRES_BACKWARD = [
+    f'DROP INDEX IF EXISTS {SEARCH_INDEX_NAME}',
+    f'DROP INDEX IF EXISTS {TRIGRAM_INDEX_NAME}',
+]
+
+
+def create_search_index(apps, schema_editor):
+    """Индекс полнотекстового поиска по комментарию: GIN + триграммы в PostgreSQL, FTS5 в SQLite"""
+    vendor = schema_editor.connection.vendor
+    statements = {'postgresql': postgres_forward, 'sqlite': lambda: SQLITE_FORWARD}.get(vendor, list)()
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for statement in {'postgresql': POSTGRES_BACKWARD, 'sqlite': SQLITE_BACKWARD}.get(vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transit_managment', '0003_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:42
+
+from datetime import timedelta
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+
+
+def fill_checkpoints(apps, schema_editor):
+    """Контрольные точки остатка по существующим дневным агрегатам (см. balances.rebuild)"""
+    TransactionType = apps.get_model('transit_managment', 'TransactionType')
+    TransactionDailyRollup = apps.get_model('transit_managment', 'TransactionDailyRollup')
+    BalanceCheckpoint = apps.get_model('transit_managment', 'BalanceCheckpoint')
+
+    type_ids = dict(TransactionType.objects.values_list('name', 'id'))
+    signed = Case(
+        When(transaction_type_id=type_ids.get('Пополнение'), then=F('total')),
+        When(transaction_type_id=type_ids.get('Списание'), then=-F('total')),
+        default=Value(Decimal('0')),
+        output_field=models.DecimalField(max_digits=18, decimal_places=2),
+    )
+    # Точки строятся только для прошедших дней
+    today = timezone.localdate()
+    nets = {}
+    for row in TransactionDailyRollup.objects.filter(day__lt=today).values('day', 'status_id').annotate(net=Sum(signed)).order_by('day'):
+        nets.setdefault(row['day'], {})[row['status_id']] = row['net']
+    if not nets:
+        return
+
+    balances, checkpoints = {}, []
+    day = min(nets)
+    while day < today:
+        for status_id, net in nets.get(day, {}).items():
+            balances[status_id] = balances.get(status_id, Decimal('0')) + net
+        checkpoints.extend(
+            BalanceCheckpoint(day=day, status_id=status_id, balance=balance) for status_id, balance in balances.items()
+        )
+        day += timedelta(days=1)
+    BalanceCheckpoint.objects.bulk_create(checkpoints, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transit_managment', '0004_transaction_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=18, verbose_name='Остаток (руб.)')),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transit_managment.status', verbose_name='Статус')),
+            ],
+            options={
+                'verbose_name': 'Контрольная точка остатка',
+                'verbose_name_plural': 'Контрольные точки остатка',
+                'ordering': ['-day'],
+                'unique_together': {('day', 'status')},
+            },
+        ),
+        migrations.RunPython(fill_checkpoints, migrations.RunPython.noop),
+    ]
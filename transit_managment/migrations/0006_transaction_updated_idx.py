@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transit_managment', '0005_balancecheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['updated_at'], name='transaction_updated_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db import transaction as db_transaction
 from django.utils import timezone
 from mptt.models import MPTTModel, TreeForeignKey
 
@@ -72,6 +73,12 @@ class Category(MPTTModel):
         return self.name
 
 
+class TransactionQuerySet(models.QuerySet):
+    def with_references(self):
+        """Справочники (статус, тип, категория) одним JOIN - для списков, сериализаторов и шаблонов"""
+        return self.select_related('status', 'transaction_type', 'category')
+
+
 class Transaction(models.Model):
     """Запись о движении денежных средств"""
 
@@ -80,18 +87,21 @@ class Transaction(models.Model):
         Status,
         on_delete=models.CASCADE,
         related_name='transactions',
+        db_index=False,
         verbose_name='Статус',
     )
     transaction_type = models.ForeignKey(
         TransactionType,
         on_delete=models.CASCADE,
         related_name='transactions',
+        db_index=False,
         verbose_name='Тип операции',
     )
     category = models.ForeignKey(
         Category,
         on_delete=models.CASCADE,
         related_name='transactions',
+        db_index=False,
         verbose_name='Категория',
     )
     amount = models.DecimalField(
@@ -104,10 +114,28 @@ class Transaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
 
+    objects = TransactionQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Транзакция'
         verbose_name_plural = 'Транзакции'
         ordering = ['-date', '-created_at']
+        # Отдельные индексы по внешним ключам не нужны: их покрывают составные индексы (fk, date).
+        # BRIN-индекс по date создаётся в PostgreSQL миграцией 0003 (в SQLite такого типа индексов нет).
+        indexes = [
+            models.Index(fields=['-date', '-created_at'], name='transaction_date_created_idx'),
+            models.Index(
+                fields=['status', 'date'], include=['transaction_type', 'amount'], name='transaction_status_date_idx'
+            ),
+            models.Index(
+                fields=['category', 'date'],
+                include=['transaction_type', 'amount'],
+                name='transaction_category_date_idx',
+            ),
+            models.Index(fields=['transaction_type', 'date'], include=['amount'], name='transaction_type_date_idx'),
+            # Инкрементальное обновление аналитического снимка (analytics.refresh)
+            models.Index(fields=['updated_at'], name='transaction_updated_idx'),
+        ]
 
     def __str__(self):
         return f'{self.date.strftime("%d.%m.%Y")} - {self.amount} руб. ({self.status.name})'
@@ -116,19 +144,86 @@ class Transaction(models.Model):
         """Валидация логических зависимостей"""
         from django.core.exceptions import ValidationError
 
-        # Проверяем, что категория относится к выбранному типу операции
-        if self.category and self.transaction_type:
-            if self.category.transaction_type != self.transaction_type:
-                raise ValidationError(
-                    f"Категория '{self.category.name}' не относится к типу операции '{self.transaction_type.name}'"
-                )
+        from .category_tree import category_errors
 
-        # Проверяем, что категория не является родительской (только листья дерева)
-        if self.category and self.category.get_children().exists():
-            raise ValidationError(
-                f"Нельзя выбрать родительскую категорию '{self.category.name}'. Выберите подкатегорию."
-            )
+        # Проверяем по id и закешированному дереву категорий, не загружая связанные объекты
+        category_id = self._meta.get_field('category').to_python(self.category_id)
+        if category_id is None:
+            return
+        transaction_type_id = self._meta.get_field('transaction_type').to_python(self.transaction_type_id)
+
+        errors = category_errors(category_id, transaction_type_id)
+        if errors:
+            raise ValidationError(errors[0])
 
     def save(self, *args, **kwargs):
         self.clean()
-        super().save(*args, **kwargs)
+        # Сохранение и обновление дневных агрегатов (post_save) выполняются в одной транзакции БД
+        with db_transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Запоминаем исходное состояние для инкрементального обновления агрегатов"""
+        from .rollups import take_snapshot
+
+        instance = super().from_db(db, field_names, values)
+        take_snapshot(instance)
+        return instance
+
+
+class TransactionDailyRollup(models.Model):
+    """Дневной агрегат транзакций: день × статус × тип операции × категория"""
+
+    day = models.DateField(verbose_name='День')
+    status = models.ForeignKey(
+        Status,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Статус',
+    )
+    transaction_type = models.ForeignKey(
+        TransactionType,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Тип операции',
+    )
+    category = models.ForeignKey(
+        Category,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Категория',
+    )
+    total = models.DecimalField(max_digits=18, decimal_places=2, default=0, verbose_name='Сумма (руб.)')
+    count = models.IntegerField(default=0, verbose_name='Количество операций')
+
+    class Meta:
+        verbose_name = 'Дневной агрегат'
+        verbose_name_plural = 'Дневные агрегаты'
+        ordering = ['-day']
+        unique_together = ['day', 'status', 'transaction_type', 'category']
+
+    def __str__(self):
+        return f'{self.day.strftime("%d.%m.%Y")} - {self.total} руб. ({self.count})'
+
+
+class BalanceCheckpoint(models.Model):
+    """Остаток на конец дня по статусу: пополнения минус списания за все дни до day включительно"""
+
+    day = models.DateField(verbose_name='День')
+    status = models.ForeignKey(
+        Status,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Статус',
+    )
+    balance = models.DecimalField(max_digits=18, decimal_places=2, default=0, verbose_name='Остаток (руб.)')
+
+    class Meta:
+        verbose_name = 'Контрольная точка остатка'
+        verbose_name_plural = 'Контрольные точки остатка'
+        ordering = ['-day']
+        unique_together = ['day', 'status']
+
+    def __str__(self):
+        return f'{self.day.strftime("%d.%m.%Y")} - {self.balance} руб.'
@@ -0,0 +1,55 @@
+"""
+Суммы в целых копейках для агрегирующих путей (статистика, агрегаты, остатки, экспорт).
+
+DecimalField читается в Python через Decimal, а в SQLite - ещё и через float с квантованием каждого значения,
+что заметно на больших агрегациях и выгрузках. С AMOUNT_MINOR_UNITS сумма переводится в копейки в SQL
+(ROUND(amount * 100) как BIGINT), складывается как целое число и превращается в Decimal только
+на границе ответа. Результат совпадает с расчётом в Decimal до копейки.
+"""
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import BigIntegerField, F, Sum
+from django.db.models.functions import Cast, Round
+
+MINOR_UNITS = 100
+
+
+def enabled():
+    return settings.AMOUNT_MINOR_UNITS
+
+
+def minor_units(field):
+    """Сумма поля в копейках: ROUND(field * 100) как BIGINT"""
+    return Cast(Round(F(field) * MINOR_UNITS), BigIntegerField())
+
+
+def to_decimal(minor):
+    """Копейки -> рубли с двумя знаками после запятой"""
+    # PostgreSQL возвращает SUM(bigint) как numeric, поэтому может прийти и целое Decimal
+    return Decimal(minor).scaleb(-2)
+
+
+def to_minor(amount):
+    """Рубли (Decimal) -> копейки"""
+    return int(amount.scaleb(2).to_integral_value())
+
+
+def amount_value(field='amount'):
+    """Выражение суммы для values(): копейки на быстром пути, иначе само поле"""
+    return minor_units(field) if enabled() else F(field)
+
+
+def amount_sum(field='amount', **extra):
+    """Sum по сумме; на быстром пути - в копейках, с приведением к BIGINT и в PostgreSQL"""
+    if enabled():
+        return Cast(Sum(minor_units(field), **extra), BigIntegerField())
+    return Sum(field, **extra)
+
+
+def from_db(value):
+    """Значение amount_value/amount_sum из БД -> Decimal; None остаётся None"""
+    if value is None or not enabled():
+        return value
+    return to_decimal(value)
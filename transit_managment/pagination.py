@@ -0,0 +1,248 @@
+import base64
+import binascii
+import json
+
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Порядок ключа пагинации: совпадает с сортировкой по умолчанию и индексом transaction_date_created_idx,
+# id добавлен для однозначности при совпадающих датах
+KEYSET_ORDERING = ('-date', '-created_at', '-id')
+COUNT_MODES = ('exact', 'approx')
+
+
+class InvalidCursor(ValueError):
+    """Некорректный курсор пагинации"""
+
+
+def encode_cursor(transaction, reverse=False):
+    payload = [transaction.date.isoformat(), transaction.created_at.isoformat(), transaction.pk]
+    if reverse:
+        payload.append(1)
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    """Позиция (date, created_at, id) и направление из строки курсора"""
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+        payload = json.loads(raw)
+        date, created_at, pk = parse_datetime(payload[0]), parse_datetime(payload[1]), int(payload[2])
+        reverse = len(payload) > 3 and bool(payload[3])
+    except (binascii.Error, ValueError, TypeError, IndexError, KeyError):
+        raise InvalidCursor(value)
+    if date is None or created_at is None:
+        raise InvalidCursor(value)
+    return (date, created_at, pk), reverse
+
+
+def _seek_condition(position, reverse):
+    """
+    Условие «строго после позиции» в порядке KEYSET_ORDERING (или строго до неё при reverse).
+
+    Внешнее ограничение по date позволяет использовать индекс диапазонным сканированием.
+    """
+    date, created_at, pk = position
+    op = 'gt' if reverse else 'lt'
+    bound = 'gte' if reverse else 'lte'
+    return Q(**{f'date__{bound}': date}) & (
+        Q(**{f'date__{op}': date})
+        | Q(date=date, **{f'created_at__{op}': created_at})
+        | Q(date=date, created_at=created_at, **{f'id__{op}': pk})
+    )
+
+
+class KeysetPage:
+    """Страница результатов, выбранная по позиции, а не по смещению"""
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def _page_queryset(queryset, page_size, cursor):
+    reverse = False
+    if cursor:
+        position, reverse = decode_cursor(cursor)
+        queryset = queryset.filter(_seek_condition(position, reverse))
+
+    ordering = [field.lstrip('-') for field in KEYSET_ORDERING] if reverse else KEYSET_ORDERING
+    return queryset.order_by(*ordering)[: page_size + 1], reverse
+
+
+def _build_page(items, page_size, cursor, reverse):
+    has_more = len(items) > page_size
+    items = items[:page_size]
+
+    if reverse:
+        items.reverse()
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, bool(cursor)
+
+    next_cursor = encode_cursor(items[-1]) if items and has_next else None
+    previous_cursor = encode_cursor(items[0], reverse=True) if items and has_previous else None
+    return KeysetPage(items, next_cursor, previous_cursor)
+
+
+def keyset_page(queryset, page_size, cursor=None):
+    """
+    Выборка страницы по курсору: стоимость не зависит от номера страницы.
+
+    Курсор указывает на первую строку после текущей страницы (вперёд)
+    или на строку перед ней (назад, reverse).
+    """
+    queryset, reverse = _page_queryset(queryset, page_size, cursor)
+    return _build_page(list(queryset), page_size, cursor, reverse)
+
+
+async def akeyset_page(queryset, page_size, cursor=None):
+    """keyset_page для асинхронных представлений"""
+    queryset, reverse = _page_queryset(queryset, page_size, cursor)
+    return _build_page([item async for item in queryset], page_size, cursor, reverse)
+
+
+def approximate_count(queryset):
+    """Оценка количества строк по плану запроса PostgreSQL без выполнения COUNT(*)"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_queryset(queryset, mode):
+    if mode == 'approx':
+        return approximate_count(queryset)
+    if mode == 'exact':
+        return queryset.count()
+    return None
+
+
+def parse_page_size(params, param, default, maximum):
+    try:
+        page_size = int(params.get(param, default))
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(page_size, maximum))
+
+
+class TransactionCursorPagination(BasePagination):
+    """
+    Курсорная пагинация транзакций по (date, created_at, id).
+
+    Параметры: cursor, page_size и count=exact|approx (количество строк выводится только по запросу).
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+    page_size = 50
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+
+        count_mode = request.query_params.get(self.count_query_param)
+        self.count = count_queryset(queryset, count_mode) if count_mode in COUNT_MODES else None
+
+        try:
+            self.page = keyset_page(
+                queryset, self.get_page_size(request), request.query_params.get(self.cursor_query_param)
+            )
+        except InvalidCursor:
+            raise ValidationError({self.cursor_query_param: ['Некорректный курсор']})
+        return self.page.items
+
+    def get_page_size(self, request):
+        return parse_page_size(request.query_params, self.page_size_query_param, self.page_size, self.max_page_size)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        payload = {
+            'next': self.get_link(self.page.next_cursor),
+            'previous': self.get_link(self.page.previous_cursor),
+        }
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['results'] = data
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer', 'description': 'Только при count=exact|approx'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Курсор страницы',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': f'Размер страницы (не более {self.max_page_size})',
+                'schema': {'type': 'integer'},
+            },
+            {
+                'name': self.count_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Подсчёт строк: exact или approx (оценка планировщика PostgreSQL)',
+                'schema': {'type': 'string', 'enum': list(COUNT_MODES)},
+            },
+        ]
+
+
+def page_querystring(query_dict, cursor_param='cursor'):
+    """Параметры текущего запроса без курсора - для ссылок на соседние страницы"""
+    params = query_dict.copy()
+    params.pop(cursor_param, None)
+    return params.urlencode()
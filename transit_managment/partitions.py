@@ -0,0 +1,332 @@
+"""
+Помесячное секционирование таблицы транзакций в PostgreSQL (включается вручную командой partition_transactions).
+
+Таблица секционируется по диапазону date: секция на календарный месяц в часовом поясе TIME_ZONE и секция
+DEFAULT для строк вне созданных диапазонов. Секции создаются заранее на несколько месяцев вперёд,
+чтобы DEFAULT оставалась пустой. Уникальные ограничения секционированной таблицы должны включать
+ключ секционирования, поэтому первичный ключ - (id, date). В SQLite таблица остаётся обычной.
+
+Перевод существующей таблицы выполняется без остановки записи: новая секционированная таблица заполняется
+пачками по id, изменения, сделанные во время копирования, переносит триггер на старой таблице, а в конце
+таблицы меняются местами под кратковременной блокировкой. Старая таблица остаётся как *_old до --drop-old.
+"""
+
+import re
+import time
+from datetime import timedelta
+
+from django.db import OperationalError
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from .filters import TransactionFilter
+from .models import Transaction
+from .response_cache import months_between
+from .rollups import day_start, rollup_day
+
+TABLE = Transaction._meta.db_table
+NEW_TABLE = f'{TABLE}_partitioned'
+OLD_TABLE = f'{TABLE}_old'
+DEFAULT_PARTITION = f'{TABLE}_default'
+SEQUENCE = f'{TABLE}_partitioned_id_seq'
+SYNC_FUNCTION = f'{TABLE}_partition_sync'
+# Временный суффикс индексов новой таблицы: имена индексов уникальны в схеме
+INDEX_SUFFIX = '_p'
+INDEX_PREFIX = re.compile(r'^CREATE (UNIQUE )?INDEX \S+ ON \S+ ')
+
+# Сколько ATTACH PARTITION ждёт блокировку, прежде чем отказаться (следующий запуск повторит)
+LOCK_TIMEOUT = '5s'
+
+PARTITION_PATTERN = re.compile(rf'\bon ({TABLE}_(?:y\d{{4}}m\d{{2}}|default))\b')
+
+
+class PartitioningError(Exception):
+    """Секционирование невозможно в текущем состоянии БД"""
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (month_start(day) + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(month):
+    return f'{TABLE}_y{month:%Y}m{month:%m}'
+
+
+def month_bounds(month):
+    """Границы секции месяца: [начало месяца, начало следующего) как aware datetime"""
+    return day_start(month_start(month)), day_start(next_month(month))
+
+
+def _bounds_sql(month):
+    start, end = month_bounds(month)
+    return f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+
+
+def require_postgresql(connection):
+    if connection.vendor != 'postgresql':
+        raise PartitioningError(f'Секционирование поддерживается только в PostgreSQL, текущая БД: {connection.vendor}')
+
+
+def is_partitioned(connection, table=TABLE):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [table])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def table_exists(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [table])
+        return cursor.fetchone()[0]
+
+
+def existing_partitions(connection, table=TABLE):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE parent.oid = to_regclass(%s)',
+            [table],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def default_has_rows(connection, month):
+    """Есть ли в секции DEFAULT строки месяца - тогда секцию месяца нельзя присоединить без переноса"""
+    start, end = month_bounds(month)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE date >= %s AND date < %s)',
+            [start, end],
+        )
+        return cursor.fetchone()[0]
+
+
+def create_partition(connection, month, table=TABLE):
+    """
+    Секция месяца: пустая таблица создаётся отдельно и присоединяется ATTACH PARTITION.
+
+    ATTACH берёт у родительской таблицы SHARE UPDATE EXCLUSIVE, которая не мешает чтению и записи, но у секции
+    DEFAULT - ACCESS EXCLUSIVE на время проверки, что в ней нет строк нового диапазона: запросы, которые читают
+    DEFAULT (без отсечения секций), ждут ATTACH, а он - их, поэтому блокировка ждётся не дольше LOCK_TIMEOUT.
+    Пока DEFAULT пуста, проверка мгновенна; поэтому секции создаются заранее (months_ahead), а строки,
+    которые всё же попали в DEFAULT, на живой таблице не переносятся - создание секции отказывает,
+    и перенос выполняется вручную в окно обслуживания.
+    """
+    require_postgresql(connection)
+    name = partition_name(month)
+    if table == TABLE and table_exists(connection, DEFAULT_PARTITION) and default_has_rows(connection, month):
+        raise PartitioningError(
+            f'В секции {DEFAULT_PARTITION} есть строки за {month:%m.%Y}: секцию {name} нужно создать '
+            'с переносом строк в окно обслуживания'
+        )
+    try:
+        with db_transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            # Не ждём блокировку за долгими транзакциями, выстраивая за собой очередь из запросов к таблице
+            cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+            cursor.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+            cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES {_bounds_sql(month)}')
+    except OperationalError as e:
+        raise PartitioningError(f'Не удалось присоединить секцию {name}: {e}')
+    return name
+
+
+def ensure_partitions(connection, first_month, last_month, table=TABLE):
+    """Секции для всех месяцев диапазона, которых ещё нет; возвращает имена созданных"""
+    require_postgresql(connection)
+    existing = existing_partitions(connection, table)
+    created = []
+    for month in months_between(first_month, last_month):
+        if partition_name(month) not in existing:
+            created.append(create_partition(connection, month, table))
+    return created
+
+
+def _index_definitions(connection):
+    """Индексы исходной таблицы кроме первичного ключа: [(имя, CREATE INDEX ...)]"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT index_class.relname, pg_get_indexdef(pg_index.indexrelid) FROM pg_index '
+            'JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid '
+            'WHERE pg_index.indrelid = to_regclass(%s) AND NOT pg_index.indisprimary',
+            [TABLE],
+        )
+        return cursor.fetchall()
+
+
+def _foreign_keys(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint '
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+            [TABLE],
+        )
+        return cursor.fetchall()
+
+
+def _create_partitioned_table(connection, first_month, last_month):
+    """Пустая секционированная копия таблицы транзакций с индексами, внешними ключами и секциями"""
+    with db_transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE {NEW_TABLE} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING STORAGE INCLUDING COMMENTS) '
+            'PARTITION BY RANGE (date)'
+        )
+        # Identity-колонки у секционированных таблиц есть только с PostgreSQL 17 - используем обычную последовательность
+        cursor.execute(f'CREATE SEQUENCE IF NOT EXISTS {SEQUENCE}')
+        cursor.execute(f"ALTER TABLE {NEW_TABLE} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')")
+        cursor.execute(f'ALTER SEQUENCE {SEQUENCE} OWNED BY {NEW_TABLE}.id')
+        cursor.execute(f'ALTER TABLE {NEW_TABLE} ADD PRIMARY KEY (id, date)')
+        for name, definition in _foreign_keys(connection):
+            cursor.execute(f'ALTER TABLE {NEW_TABLE} ADD CONSTRAINT {name} {definition}')
+        for name, definition in _index_definitions(connection):
+            prefix = INDEX_PREFIX.match(definition)
+            unique = prefix.group(1) or ''
+            cursor.execute(f'CREATE {unique}INDEX {name}{INDEX_SUFFIX} ON {NEW_TABLE} {definition[prefix.end() :]}')
+        cursor.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {NEW_TABLE} DEFAULT')
+    ensure_partitions(connection, first_month, last_month, table=NEW_TABLE)
+
+
+def _install_sync_trigger(connection):
+    """Изменения старой таблицы во время копирования повторяются в новой"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            CREATE OR REPLACE FUNCTION {SYNC_FUNCTION}() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    DELETE FROM {NEW_TABLE} WHERE id = OLD.id;
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO {NEW_TABLE} SELECT (NEW).* ON CONFLICT DO NOTHING;
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            """
+        )
+        cursor.execute(f'DROP TRIGGER IF EXISTS {SYNC_FUNCTION} ON {TABLE}')
+        cursor.execute(
+            f'CREATE TRIGGER {SYNC_FUNCTION} AFTER INSERT OR UPDATE OR DELETE ON {TABLE} '
+            f'FOR EACH ROW EXECUTE FUNCTION {SYNC_FUNCTION}()'
+        )
+
+
+def _copy_batches(connection, batch_size, pause, stdout):
+    """Копирование пачками по id; строки пачки блокируются, чтобы параллельное изменение дождалось копии"""
+    last_id, copied = 0, 0
+    while True:
+        with db_transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT max(id) FROM (SELECT id FROM {TABLE} WHERE id > %s ORDER BY id LIMIT %s) batch',
+                [last_id, batch_size],
+            )
+            upper = cursor.fetchone()[0]
+            if upper is None:
+                return copied
+            cursor.execute(
+                f'SELECT count(*) FROM (SELECT 1 FROM {TABLE} WHERE id > %s AND id <= %s FOR UPDATE) locked',
+                [last_id, upper],
+            )
+            cursor.execute(
+                f'INSERT INTO {NEW_TABLE} SELECT * FROM {TABLE} WHERE id > %s AND id <= %s ON CONFLICT DO NOTHING',
+                [last_id, upper],
+            )
+            copied += cursor.rowcount
+        last_id = upper
+        if stdout is not None:
+            stdout.write(f'Скопировано: {copied} (id <= {last_id})')
+        if pause:
+            time.sleep(pause)
+
+
+def _swap_tables(connection):
+    """Замена таблицы секционированной копией под блокировкой ACCESS EXCLUSIVE"""
+    indexes = [name for name, _ in _index_definitions(connection)]
+    with db_transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'SELECT (SELECT count(*) FROM {TABLE}), (SELECT count(*) FROM {NEW_TABLE})')
+        old_count, new_count = cursor.fetchone()
+        if old_count != new_count:
+            raise PartitioningError(f'Количество строк не совпадает: {old_count} в {TABLE}, {new_count} в {NEW_TABLE}')
+
+        cursor.execute(f'DROP TRIGGER {SYNC_FUNCTION} ON {TABLE}')
+        cursor.execute(f'DROP FUNCTION {SYNC_FUNCTION}()')
+        cursor.execute(f"SELECT setval('{SEQUENCE}', (SELECT COALESCE(max(id), 0) + 1 FROM {TABLE}), false)")
+
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {OLD_TABLE}')
+        cursor.execute(f'ALTER TABLE {OLD_TABLE} RENAME CONSTRAINT {TABLE}_pkey TO {OLD_TABLE}_pkey')
+        for name in indexes:
+            cursor.execute(f'ALTER INDEX {name} RENAME TO {name}_old')
+            cursor.execute(f'ALTER INDEX {name}{INDEX_SUFFIX} RENAME TO {name}')
+        cursor.execute(f'ALTER TABLE {NEW_TABLE} RENAME TO {TABLE}')
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME CONSTRAINT {NEW_TABLE}_pkey TO {TABLE}_pkey')
+    return new_count
+
+
+def convert(connection, months_ahead=3, batch_size=50000, pause=0.0, today=None, stdout=None):
+    """
+    Перевод существующей таблицы транзакций на помесячные секции.
+
+    Повторный запуск после сбоя продолжает с начала копирования: строки, которые уже есть в новой таблице,
+    пропускаются (ON CONFLICT DO NOTHING). Возвращает количество строк в секционированной таблице.
+    """
+    require_postgresql(connection)
+    if is_partitioned(connection):
+        raise PartitioningError(f'Таблица {TABLE} уже секционирована')
+    if table_exists(connection, OLD_TABLE):
+        raise PartitioningError(f'Осталась таблица {OLD_TABLE} от предыдущего перевода - удалите её (--drop-old)')
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT min(date) FROM {TABLE}')
+        first_date = cursor.fetchone()[0]
+    today = today or timezone.localdate()
+    first_month = month_start(rollup_day(first_date) if first_date else today)
+    last_month = month_start(today + timedelta(days=31 * months_ahead))
+
+    if not table_exists(connection, NEW_TABLE):
+        _create_partitioned_table(connection, first_month, last_month)
+    _install_sync_trigger(connection)
+    _copy_batches(connection, batch_size, pause, stdout)
+    return _swap_tables(connection)
+
+
+def drop_old_table(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {OLD_TABLE}')
+
+
+def scanned_partitions(plan):
+    """Секции, которые читает план запроса (вывод EXPLAIN)"""
+    return set(PARTITION_PATTERN.findall(plan))
+
+
+def expected_partitions(date_from, date_to, existing):
+    """Секции, которые должен читать запрос с date_from..date_to при отсечении секций"""
+    expected = set()
+    for month in months_between(date_from, date_to):
+        name = partition_name(month)
+        expected.add(name if name in existing else DEFAULT_PARTITION)
+    return expected
+
+
+def verify_pruning(connection, ranges):
+    """
+    Проверка отсечения секций для фильтров TransactionFilter по датам.
+
+    Для каждого диапазона (date_from, date_to) возвращается (диапазон, читаемые секции, ожидаемые, ok).
+    """
+    existing = existing_partitions(connection)
+    results = []
+    for date_from, date_to in ranges:
+        queryset = TransactionFilter(
+            {'date_from': date_from.isoformat(), 'date_to': date_to.isoformat()}, queryset=Transaction.objects.all()
+        ).qs
+        scanned = scanned_partitions(queryset.explain())
+        expected = expected_partitions(date_from, date_to, existing)
+        results.append(((date_from, date_to), scanned, expected, bool(scanned) and scanned <= expected))
+    return results
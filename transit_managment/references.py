@@ -0,0 +1,76 @@
+from django.core.cache import cache
+
+from .cache_versions import get_versions
+from .models import Category, Status, TransactionType
+
+# Справочники меняются редко: версии сбрасываются сигналами при сохранении и удалении
+REFERENCE_VERSIONS = ('status', 'transaction_type', 'category')
+CACHE_KEY = 'transit_managment:references:{}'
+CACHE_TIMEOUT = 24 * 60 * 60
+
+
+class ReferenceData:
+    """Снимок справочников: статусы, типы операций и категории с индексами по id и названию"""
+
+    def __init__(self, statuses, transaction_types, categories):
+        self.statuses = statuses
+        self.transaction_types = transaction_types
+        self.categories = categories
+
+        self.statuses_by_id = {status.pk: status for status in statuses}
+        self.transaction_types_by_id = {transaction_type.pk: transaction_type for transaction_type in transaction_types}
+        self.categories_by_id = {category.pk: category for category in categories}
+        self.status_ids = {status.name: status.pk for status in statuses}
+        self.transaction_type_ids = {
+            transaction_type.name: transaction_type.pk for transaction_type in transaction_types
+        }
+
+    @classmethod
+    def load(cls):
+        return cls(
+            list(Status.objects.all()),
+            list(TransactionType.objects.all()),
+            list(Category.objects.select_related('transaction_type', 'parent')),
+        )
+
+    def status_id(self, name):
+        return self.status_ids.get(name)
+
+    def transaction_type_id(self, name):
+        return self.transaction_type_ids.get(name)
+
+    def status_name(self, status_id):
+        status = self.statuses_by_id.get(status_id)
+        return status.name if status else None
+
+    def transaction_type_name(self, transaction_type_id):
+        transaction_type = self.transaction_types_by_id.get(transaction_type_id)
+        return transaction_type.name if transaction_type else None
+
+    def category_name(self, category_id):
+        category = self.categories_by_id.get(category_id)
+        return category.name if category else None
+
+    def categories_of_type(self, transaction_type_id):
+        return [category for category in self.categories if category.transaction_type_id == transaction_type_id]
+
+
+# Первый уровень - память процесса, второй - общий кеш-бэкенд, третий - БД
+_cached = (None, None)
+
+
+def get_references():
+    global _cached
+
+    versions = get_versions(*REFERENCE_VERSIONS)
+    cached_versions, data = _cached
+    if cached_versions == versions and data is not None:
+        return data
+
+    key = CACHE_KEY.format(':'.join(versions))
+    data = cache.get(key)
+    if data is None:
+        data = ReferenceData.load()
+        cache.set(key, data, CACHE_TIMEOUT)
+    _cached = (versions, data)
+    return data
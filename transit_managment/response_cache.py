@@ -0,0 +1,143 @@
+"""
+Серверный кеш ответов статистики и списков транзакций.
+
+Ключ - нормализованные параметры TransactionFilter и версии данных, от которых зависит ответ.
+Если фильтр ограничивает даты с обеих сторон, ответ зависит только от версий затронутых месяцев:
+запись транзакции сбрасывает версию своего месяца, и кеш других периодов остаётся действительным.
+Без ограничения дат используется общая версия transaction, которая сбрасывается при любой записи.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache_versions import get_versions
+from .filters import TransactionFilter
+from .models import Transaction
+
+TRANSACTION_VERSION = 'transaction'
+MONTH_VERSION = 'transaction:{:%Y-%m}'
+# Диапазон длиннее - зависимость от общей версии, чтобы не читать сотни версий месяцев
+MAX_RANGE_MONTHS = 36
+
+KEY = 'transit_managment:response:{}:{}'
+COUNTER_KEY = 'transit_managment:response:{}:counter:{}'
+
+
+def response_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def month_version(day):
+    return MONTH_VERSION.format(day)
+
+
+def months_between(start, end):
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield start.replace(year=year, month=month, day=1)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def normalize_filters(params):
+    """Очищенные значения TransactionFilter или None, если параметры некорректны"""
+    form = TransactionFilter(params, queryset=Transaction.objects.none()).form
+    if not form.is_valid():
+        return None
+    filters = {}
+    for name, value in form.cleaned_data.items():
+        if value in (None, '', []):
+            continue
+        # Порядок значений в status__in=1,2 на ответ не влияет
+        filters[name] = tuple(sorted(set(value))) if isinstance(value, list) else value
+    return filters
+
+
+def data_versions(filters):
+    """Версии транзакций, от которых зависит ответ с такими фильтрами"""
+    date_from, date_to = filters.get('date_from'), filters.get('date_to')
+    if date_from is None or date_to is None or date_from > date_to:
+        return (TRANSACTION_VERSION,)
+    months = [month_version(month) for month in months_between(date_from, date_to)]
+    if len(months) > MAX_RANGE_MONTHS:
+        return (TRANSACTION_VERSION,)
+    return tuple(months)
+
+
+class ResponseCache:
+    """
+    Кеш одного вида ответов (kind): stats, list, cashflow.
+
+    extra_params - параметры запроса помимо фильтров, влияющие на ответ (группировка, курсор);
+    versions - версии справочников, данные которых попадают в ответ;
+    history_params - параметры, с которыми ответ зависит от всех предыдущих транзакций (нарастающий остаток),
+    поэтому версий месяцев из фильтра недостаточно и используется общая версия.
+    """
+
+    def __init__(self, kind, extra_params=(), versions=(), history_params=()):
+        self.kind = kind
+        self.extra_params = extra_params
+        self.versions = versions
+        self.history_params = history_params
+
+    def key(self, request, filters):
+        extra = {name: request.GET.get(name) for name in self.extra_params if request.GET.get(name) not in (None, '')}
+        if any(name in extra for name in self.history_params):
+            versions = get_versions(*self.versions, TRANSACTION_VERSION)
+        else:
+            versions = get_versions(*self.versions, *data_versions(filters))
+        raw = repr((request.get_host(), request.path, sorted(filters.items()), sorted(extra.items()), versions))
+        return KEY.format(self.kind, hashlib.sha1(raw.encode()).hexdigest())
+
+    def get_or_compute(self, request, compute):
+        """Данные ответа и признак попадания в кеш; compute вызывается при промахе"""
+        filters = normalize_filters(request.GET)
+        if not settings.RESPONSE_CACHE_ENABLED or filters is None:
+            return compute(), False
+
+        cache = response_cache()
+        key = self.key(request, filters)
+        data = cache.get(key)
+        if data is not None:
+            self.count('hits')
+            return data, True
+
+        self.count('misses')
+        data = compute()
+        cache.set(key, data, settings.RESPONSE_CACHE_TIMEOUT)
+        return data, False
+
+    def count(self, counter):
+        cache = response_cache()
+        key = COUNTER_KEY.format(self.kind, counter)
+        # add + incr: счётчик общий для всех процессов, если кеш-бэкенд разделяемый
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+    def metrics(self):
+        cache = response_cache()
+        counters = cache.get_many([COUNTER_KEY.format(self.kind, name) for name in ('hits', 'misses')])
+        hits = counters.get(COUNTER_KEY.format(self.kind, 'hits'), 0)
+        misses = counters.get(COUNTER_KEY.format(self.kind, 'misses'), 0)
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_ratio': round(hits / total, 4) if total else None}
+
+
+# Дерево итогов (group_by=category_tree, category_subtree) зависит от названий и иерархии категорий
+STATS_CACHE = ResponseCache('stats', extra_params=('period', 'group_by'), versions=('transaction_type', 'category'))
+LIST_CACHE = ResponseCache(
+    'list',
+    extra_params=('cursor', 'page_size', 'count', 'balance'),
+    versions=('status', 'transaction_type', 'category'),
+    history_params=('balance',),
+)
+CASHFLOW_CACHE = ResponseCache('cashflow', versions=('transaction_type', 'category'))
+CACHES = (STATS_CACHE, LIST_CACHE, CASHFLOW_CACHE)
+
+
+def metrics():
+    return {cache.kind: cache.metrics() for cache in CACHES}
@@ -0,0 +1,283 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, connection
+from django.db import transaction as db_transaction
+from django.db.models import Count, F, Max, Min
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import money
+from .models import Transaction, TransactionDailyRollup
+
+ROLLUP_KEY_FIELDS = ('day', 'status_id', 'transaction_type_id', 'category_id')
+SNAPSHOT_FIELDS = ('date', 'status_id', 'transaction_type_id', 'category_id', 'amount')
+
+
+def rollup_day(value):
+    """День агрегата для даты операции (в текущем часовом поясе, как TruncDate в SQL)"""
+    value = Transaction._meta.get_field('date').to_python(value)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return timezone.localtime(value).date()
+
+
+def day_start(value):
+    """Начало дня как aware datetime для сравнения с полем date"""
+    return timezone.make_aware(datetime.combine(value, time.min))
+
+
+def snapshot(instance):
+    """Ключ агрегата и сумма транзакции либо None, если поля не загружены"""
+    if instance.get_deferred_fields() & set(SNAPSHOT_FIELDS):
+        return None
+    key = (
+        rollup_day(instance.date),
+        instance.status_id,
+        instance.transaction_type_id,
+        instance.category_id,
+    )
+    amount = Transaction._meta.get_field('amount').to_python(instance.amount)
+    return key, amount
+
+
+def take_snapshot(instance):
+    instance._rollup_snapshot = snapshot(instance)
+
+
+def load_snapshot(instance):
+    """Состояние транзакции в БД до сохранения, если оно не было запомнено при загрузке"""
+    snap = getattr(instance, '_rollup_snapshot', None)
+    if snap is not None or instance._state.adding or instance.pk is None:
+        return snap
+
+    row = Transaction.objects.filter(pk=instance.pk).values(*SNAPSHOT_FIELDS).first()
+    if row is None:
+        return None
+    key = (rollup_day(row['date']), row['status_id'], row['transaction_type_id'], row['category_id'])
+    return key, row['amount']
+
+
+def add_delta(deltas, key, amount, count):
+    total, rows = deltas[key]
+    deltas[key] = (total + amount, rows + count)
+
+
+def new_deltas():
+    return defaultdict(lambda: (Decimal('0'), 0))
+
+
+def merge_deltas(deltas, other):
+    for key, (amount, count) in other.items():
+        add_delta(deltas, key, amount, count)
+
+
+def changed_days(deltas):
+    """Дни, затронутые изменениями агрегатов"""
+    return {key[0] for key in deltas}
+
+
+def deltas_for_instances(instances, sign=1):
+    """Изменения агрегатов для набора транзакций (bulk_create и подобные пути)"""
+    deltas = new_deltas()
+    for instance in instances:
+        snap = snapshot(instance)
+        if snap is not None:
+            key, amount = snap
+            add_delta(deltas, key, sign * amount, sign)
+    return deltas
+
+
+def deltas_for_rows(rows, sign=1):
+    """Изменения агрегатов для уже загруженных строк values_list(*SNAPSHOT_FIELDS)"""
+    deltas = new_deltas()
+    for date, status_id, transaction_type_id, category_id, amount in rows:
+        add_delta(deltas, (rollup_day(date), status_id, transaction_type_id, category_id), sign * amount, sign)
+    return deltas
+
+
+def deltas_for_queryset(queryset, sign=1):
+    """Изменения агрегатов для набора транзакций, посчитанные одним группирующим запросом"""
+    deltas = new_deltas()
+    rows = (
+        queryset.order_by()
+        .annotate(day=TruncDate('date'))
+        .values(*ROLLUP_KEY_FIELDS)
+        .annotate(total=money.amount_sum('amount'), rows=Count('pk'))
+    )
+    for row in rows:
+        key = tuple(row[field] for field in ROLLUP_KEY_FIELDS)
+        add_delta(deltas, key, sign * money.from_db(row['total']), sign * row['rows'])
+    return deltas
+
+
+# Начиная с этого количества ключей изменения применяются пачками, а не запросом на ключ
+BULK_APPLY_THRESHOLD = 20
+BULK_BATCH_SIZE = 1000
+
+
+def _lookup(key):
+    return dict(zip(ROLLUP_KEY_FIELDS, key, strict=True))
+
+
+def _increment(key, amount, count):
+    """UPDATE ... SET total = total + amount; INSERT, если строки ещё нет"""
+    lookup = _lookup(key)
+    updated = TransactionDailyRollup.objects.filter(**lookup).update(
+        total=F('total') + amount,
+        count=F('count') + count,
+    )
+    if updated:
+        return
+    try:
+        with db_transaction.atomic():
+            TransactionDailyRollup.objects.create(total=amount, count=count, **lookup)
+    except IntegrityError:
+        # Строку успел создать параллельный запрос
+        TransactionDailyRollup.objects.filter(**lookup).update(
+            total=F('total') + amount,
+            count=F('count') + count,
+        )
+
+
+def _apply_bulk(deltas):
+    """Изменения для множества ключей: один UPDATE по существующим строкам и один bulk_create по новым"""
+    days = sorted({key[0] for key in deltas})
+    existing = {}
+    for start in range(0, len(days), BULK_BATCH_SIZE):
+        rows = TransactionDailyRollup.objects.filter(day__in=days[start : start + BULK_BATCH_SIZE]).values_list(
+            'id', *ROLLUP_KEY_FIELDS
+        )
+        for row_id, *key in rows:
+            key = tuple(key)
+            if key in deltas:
+                existing[key] = row_id
+
+    # Один параметризованный UPDATE на все строки: bulk_update с F-выражениями строит CASE на каждую
+    # строку пачки, и на тысячах ключей (массовые изменения) его стоимость растёт квадратично
+    table, total, count = map(connection.ops.quote_name, (TransactionDailyRollup._meta.db_table, 'total', 'count'))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {table} SET {total} = {total} + %s, {count} = {count} + %s WHERE id = %s',
+            [(deltas[key][0], deltas[key][1], row_id) for key, row_id in existing.items()],
+        )
+
+    missing = {key: value for key, value in deltas.items() if key not in existing}
+    try:
+        with db_transaction.atomic():
+            TransactionDailyRollup.objects.bulk_create(
+                [
+                    TransactionDailyRollup(total=amount, count=count, **_lookup(key))
+                    for key, (amount, count) in missing.items()
+                ],
+                batch_size=BULK_BATCH_SIZE,
+            )
+    except IntegrityError:
+        for key, (amount, count) in missing.items():
+            _increment(key, amount, count)
+
+
+def apply_deltas(deltas):
+    """Инкрементальное применение изменений к таблице агрегатов и контрольным точкам остатка"""
+    from . import balances
+
+    deltas = {key: (amount, count) for key, (amount, count) in deltas.items() if amount or count}
+    if len(deltas) >= BULK_APPLY_THRESHOLD:
+        _apply_bulk(deltas)
+    else:
+        for key, (amount, count) in deltas.items():
+            _increment(key, amount, count)
+
+    # Пустые строки агрегатов не несут информации
+    emptied_days = {key[0] for key, (_, count) in deltas.items() if count < 0}
+    if emptied_days:
+        TransactionDailyRollup.objects.filter(day__in=emptied_days, count__lte=0).delete()
+
+    # Точки сдвигаются в той же транзакции БД, что и агрегаты: упавший сдвиг откатывает и запись
+    balances.shift(deltas)
+
+
+def record_save(instance, old_snapshot):
+    """Обновление агрегатов после сохранения транзакции; возвращает изменения агрегатов"""
+    deltas = new_deltas()
+    if old_snapshot is not None:
+        key, amount = old_snapshot
+        add_delta(deltas, key, -amount, -1)
+    new_snapshot = snapshot(instance)
+    if new_snapshot is not None:
+        key, amount = new_snapshot
+        add_delta(deltas, key, amount, 1)
+    apply_deltas(deltas)
+    instance._rollup_snapshot = new_snapshot
+    return deltas
+
+
+def record_delete(instance):
+    """Обновление агрегатов после удаления транзакции"""
+    deltas = new_deltas()
+    snap = load_snapshot(instance) or snapshot(instance)
+    if snap is None:
+        return deltas
+    key, amount = snap
+    add_delta(deltas, key, -amount, -1)
+    apply_deltas(deltas)
+    return deltas
+
+
+def bulk_create(instances):
+    """bulk_create транзакций вместе с обновлением агрегатов; возвращает изменения агрегатов"""
+    with db_transaction.atomic():
+        Transaction.objects.bulk_create(instances)
+        deltas = deltas_for_instances(instances)
+        apply_deltas(deltas)
+    return deltas
+
+
+def rebuild(chunk_days=31, stdout=None):
+    """
+    Полный пересчёт агрегатов из таблицы транзакций.
+
+    Пересчёт идёт окнами по chunk_days дней: каждое окно заменяется в отдельной транзакции БД,
+    поэтому таблица агрегатов не блокируется целиком и память не зависит от объёма данных.
+    В конце отправляется transactions_changed по дням старых и новых агрегатов: ответы, закешированные
+    по прежним агрегатам, сбрасываются.
+    """
+    from .signals import transactions_changed
+
+    days = set(TransactionDailyRollup.objects.order_by().values_list('day', flat=True).distinct())
+    try:
+        return _rebuild(chunk_days, stdout, days)
+    finally:
+        # И после прерванного пересчёта: уже заменённые окна могли поменять агрегаты
+        if days:
+            transactions_changed.send(sender=Transaction, days=days)
+
+
+def _rebuild(chunk_days, stdout, days):
+    bounds = Transaction.objects.aggregate(first=Min('date'), last=Max('date'))
+    with db_transaction.atomic():
+        if bounds['first'] is None:
+            TransactionDailyRollup.objects.all().delete()
+            return 0
+        first_day, last_day = rollup_day(bounds['first']), rollup_day(bounds['last'])
+        TransactionDailyRollup.objects.exclude(day__range=(first_day, last_day)).delete()
+
+    created = 0
+    window_start = first_day
+    while window_start <= last_day:
+        window_end = window_start + timedelta(days=chunk_days)
+        with db_transaction.atomic():
+            queryset = Transaction.objects.filter(date__gte=day_start(window_start), date__lt=day_start(window_end))
+            rows = [
+                TransactionDailyRollup(total=total, count=count, **_lookup(key))
+                for key, (total, count) in deltas_for_queryset(queryset).items()
+            ]
+            TransactionDailyRollup.objects.filter(day__gte=window_start, day__lt=window_end).delete()
+            TransactionDailyRollup.objects.bulk_create(rows)
+        created += len(rows)
+        days.update(row.day for row in rows)
+        if stdout is not None:
+            stdout.write(f'{window_start:%d.%m.%Y} - {window_end - timedelta(days=1):%d.%m.%Y}: {len(rows)} строк')
+        window_start = window_end
+    return created
@@ -0,0 +1,134 @@
+"""
+Полнотекстовый поиск по транзакциям.
+
+Комментарий ищется по индексу: в PostgreSQL - GIN по to_tsvector(TRANSACTION_SEARCH_CONFIG, comment)
+и триграммный GIN для частичных совпадений (ILIKE '%x%'), в SQLite - таблица FTS5 с префиксными запросами.
+Индексы создаёт миграция 0004 и поддерживает сама БД (выражение индекса / триггеры FTS5).
+Названия статусов и категорий сопоставляются в памяти по кешу справочников и превращаются в
+status_id IN (...) / category_id IN (...), поэтому join на справочники не нужен.
+"""
+
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from .pagination import KEYSET_ORDERING
+from .references import get_references
+
+FTS_TABLE = 'transit_managment_transaction_fts'
+
+MAX_TERM_LENGTH = 200
+DEFAULT_SEARCH_RESULTS = 50
+MAX_SEARCH_RESULTS = 500
+
+
+def normalize_term(term):
+    return ' '.join((term or '').split())[:MAX_TERM_LENGTH]
+
+
+def reference_matches(term):
+    """Условие по справочникам: статусы и категории, в названии которых встречается term"""
+    needle = term.casefold()
+    references = get_references()
+    statuses = [status.pk for status in references.statuses if needle in status.name.casefold()]
+    categories = [category.pk for category in references.categories if needle in category.name.casefold()]
+    condition = Q()
+    if statuses:
+        condition |= Q(status_id__in=statuses)
+    if categories:
+        condition |= Q(category_id__in=categories)
+    return condition
+
+
+def fts5_query(term):
+    """Запрос FTS5: каждое слово как префикс, слова через AND"""
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', term))
+
+
+def _postgres_search(term):
+    from django.contrib.postgres.search import SearchQuery, SearchVector
+
+    config = settings.TRANSACTION_SEARCH_CONFIG
+    # Выражение совпадает с выражением GIN-индекса из миграции 0004
+    return SearchVector('comment', config=config), SearchQuery(term, config=config, search_type='websearch')
+
+
+def comment_condition(vendor, term):
+    """Условие по комментарию для текущей БД"""
+    if vendor == 'postgresql':
+        vector, query = _postgres_search(term)
+        # Слова целиком - по GIN(tsvector), части слов - ILIKE по триграммному индексу
+        return Q(search_document=query) | Q(comment__icontains=term), {'search_document': vector}
+    if vendor == 'sqlite':
+        match = fts5_query(term)
+        if not match:
+            return Q(pk__in=[]), {}
+        return Q(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))), {}
+    return Q(comment__icontains=term), {}
+
+
+def sqlite_ranked(connection, queryset, match, limit):
+    """
+    [(id, rank)] первых limit транзакций queryset по bm25, затем по дате - одним запросом.
+
+    bm25 считается подзапросом к FTS5, который присоединяется к отфильтрованным транзакциям:
+    коррелированный bm25 выполнял бы MATCH заново для каждой строки.
+    """
+    rows = queryset.order_by().values(row_id=F('pk'), row_date=F('date'), row_created_at=F('created_at'))
+    sql, params = rows.query.get_compiler(connection=connection).as_sql()
+    with connection.cursor() as cursor:
+        # bm25 отрицателен: чем меньше, тем релевантнее; совпадения только по справочникам получают 0
+        cursor.execute(
+            f'SELECT t.row_id, COALESCE(r.rank, 0.0) AS rank FROM ({sql}) t '
+            f'LEFT JOIN (SELECT rowid, -bm25({FTS_TABLE}) AS rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s) r '
+            'ON r.rowid = t.row_id ORDER BY rank DESC, t.row_date DESC, t.row_created_at DESC, t.row_id DESC LIMIT %s',
+            [*params, match, limit],
+        )
+        return cursor.fetchall()
+
+
+def search_transactions(queryset, term):
+    """Транзакции, у которых term встречается в комментарии, названии статуса или категории"""
+    term = normalize_term(term)
+    if not term:
+        return queryset
+    condition, aliases = comment_condition(connections[queryset.db].vendor, term)
+    return queryset.alias(**aliases).filter(condition | reference_matches(term))
+
+
+def ranked_search(queryset, term, limit):
+    """
+    Первые limit транзакций queryset (уже отфильтрованного search_transactions) по релевантности, затем по дате.
+
+    У каждой транзакции заполняется rank; совпадения только по справочникам получают 0.
+    """
+    term = normalize_term(term)
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchRank
+
+        rank = Coalesce(SearchRank(*_postgres_search(term)), Value(0.0), output_field=FloatField())
+        return list(queryset.annotate(rank=rank).order_by(F('rank').desc(), *KEYSET_ORDERING)[:limit])
+
+    match = fts5_query(term) if connection.vendor == 'sqlite' else ''
+    if not match:
+        # Ранжировать нечего: совпадения только по справочникам или БД без полнотекстового индекса
+        result = list(queryset.order_by(*KEYSET_ORDERING)[:limit])
+        for transaction in result:
+            transaction.rank = 0.0
+        return result
+
+    ranked = sqlite_ranked(connection, queryset, match, limit)
+    transactions = queryset.model._default_manager.using(queryset.db).in_bulk([pk for pk, _ in ranked])
+    result = []
+    for pk, rank in ranked:
+        # Транзакцию могли удалить между запросами
+        transaction = transactions.get(pk)
+        if transaction is not None:
+            transaction.rank = rank
+            result.append(transaction)
+    return result
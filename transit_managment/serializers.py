@@ -1,6 +1,51 @@
 from rest_framework import serializers
 
+from .bulk import DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE, MAX_IDS
+from .category_tree import category_errors, get_category_tree
+from .filters import TransactionFilter
+from .importers import DEFAULT_CHUNK_SIZE as IMPORT_DEFAULT_CHUNK_SIZE
+from .importers import MAX_CHUNK_SIZE as IMPORT_MAX_CHUNK_SIZE
 from .models import Category, Status, Transaction, TransactionType
+from .references import get_references
+
+
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Связанный объект по id из реестра справочников (get_references) вместо запроса к БД.
+
+    registry - имя словаря ReferenceData (statuses_by_id, transaction_types_by_id, categories_by_id);
+    id, которого нет в закешированном снимке, ищется обычным запросом по queryset.
+    """
+
+    def __init__(self, registry, **kwargs):
+        self.registry = registry
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        instance = getattr(get_references(), self.registry).get(pk)
+        if instance is not None:
+            return instance
+        return super().to_internal_value(pk)
+
+
+def validate_category(data, instance=None):
+    """Категория и тип операции из данных запроса, а при частичном обновлении - из записи"""
+    category = data.get('category')
+    transaction_type = data.get('transaction_type')
+    category_id = category.pk if category else getattr(instance, 'category_id', None)
+    transaction_type_id = transaction_type.pk if transaction_type else getattr(instance, 'transaction_type_id', None)
+    if category_id is None or (category is None and transaction_type is None):
+        return
+
+    errors = category_errors(category_id, transaction_type_id)
+    if errors:
+        raise serializers.ValidationError(errors[0])
 
 
 class StatusSerializer(serializers.ModelSerializer):
@@ -38,11 +83,9 @@ class CategorySerializer(serializers.ModelSerializer):
         ]
 
     def get_children(self, obj):
-        """Получение дочерних категорий"""
-        children = obj.get_children()
-        if children.exists():
-            return CategorySerializer(children, many=True, context=self.context).data
-        return []
+        """Дочерние категории из закешированного дерева, без запросов на каждый узел"""
+        tree = get_category_tree()
+        return tree.serialize(tree.children_of(obj.pk))
 
 
 class CategoryTreeSerializer(serializers.ModelSerializer):
@@ -55,19 +98,17 @@ class CategoryTreeSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'children']
 
     def get_children(self, obj):
-        """Получение дочерних категорий"""
-        children = obj.get_children()
-        if children.exists():
-            return CategoryTreeSerializer(children, many=True, context=self.context).data
-        return []
+        """Дочерние категории из закешированного дерева"""
+        tree = get_category_tree()
+        return tree.as_tree(tree.children_of(obj.pk))
 
 
 class TransactionSerializer(serializers.ModelSerializer):
     """Сериализатор для транзакций"""
 
-    status_name = serializers.CharField(source='status.name', read_only=True)
-    transaction_type_name = serializers.CharField(source='transaction_type.name', read_only=True)
-    category_name = serializers.CharField(source='category.name', read_only=True)
+    status_name = serializers.SerializerMethodField()
+    transaction_type_name = serializers.SerializerMethodField()
+    category_name = serializers.SerializerMethodField()
     date_display = serializers.SerializerMethodField()
 
     class Meta:
@@ -88,53 +129,47 @@ class TransactionSerializer(serializers.ModelSerializer):
             'updated_at',
         ]
 
+    @property
+    def references(self):
+        # Снимок справочников можно передать в context - тогда сериализация не обращается к кешу
+        return self.context.get('references') or get_references()
+
+    def get_status_name(self, obj):
+        return self.references.status_name(obj.status_id)
+
+    def get_transaction_type_name(self, obj):
+        return self.references.transaction_type_name(obj.transaction_type_id)
+
+    def get_category_name(self, obj):
+        return self.references.category_name(obj.category_id)
+
     def get_date_display(self, obj):
         return obj.date.strftime('%d.%m.%Y %H:%M')
 
     def validate(self, data):
-        """Валидация логических зависимостей"""
-        category = data.get('category')
-        transaction_type = data.get('transaction_type')
-
-        if category and transaction_type:
-            if category.transaction_type != transaction_type:
-                raise serializers.ValidationError(
-                    f"Категория '{category.name}' не относится к типу операции '{transaction_type.name}'"
-                )
-
-            # Проверяем, что категория не является родительской
-            if category.get_children().exists():
-                raise serializers.ValidationError(
-                    f"Нельзя выбрать родительскую категорию '{category.name}'. Выберите подкатегорию."
-                )
-
+        """Валидация логических зависимостей по закешированному дереву категорий"""
+        validate_category(data, self.instance)
         return data
 
 
 class TransactionCreateUpdateSerializer(serializers.ModelSerializer):
     """Сериализатор для создания и обновления транзакций"""
 
+    status = CachedPrimaryKeyRelatedField('statuses_by_id', queryset=Status.objects.all(), label='Статус')
+    transaction_type = CachedPrimaryKeyRelatedField(
+        'transaction_types_by_id',
+        queryset=TransactionType.objects.all(),
+        label='Тип операции',
+    )
+    category = CachedPrimaryKeyRelatedField('categories_by_id', queryset=Category.objects.all(), label='Категория')
+
     class Meta:
         model = Transaction
         fields = ['date', 'status', 'transaction_type', 'category', 'amount', 'comment']
 
     def validate(self, data):
-        """Валидация логических зависимостей"""
-        category = data.get('category')
-        transaction_type = data.get('transaction_type')
-
-        if category and transaction_type:
-            if category.transaction_type != transaction_type:
-                raise serializers.ValidationError(
-                    f"Категория '{category.name}' не относится к типу операции '{transaction_type.name}'"
-                )
-
-            # Проверяем, что категория не является родительской
-            if category.get_children().exists():
-                raise serializers.ValidationError(
-                    f"Нельзя выбрать родительскую категорию '{category.name}'. Выберите подкатегорию."
-                )
-
+        """Валидация логических зависимостей по закешированному дереву категорий"""
+        validate_category(data, self.instance)
         return data
 
 
@@ -146,3 +181,64 @@ class TransactionFilterSerializer(serializers.Serializer):
     status = serializers.PrimaryKeyRelatedField(queryset=Status.objects.all(), required=False)
     transaction_type = serializers.PrimaryKeyRelatedField(queryset=TransactionType.objects.all(), required=False)
     category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all(), required=False)
+
+
+class TransactionImportParamsSerializer(serializers.Serializer):
+    """Параметры массового импорта из строки запроса"""
+
+    chunk_size = serializers.IntegerField(
+        min_value=1, max_value=IMPORT_MAX_CHUNK_SIZE, required=False, default=IMPORT_DEFAULT_CHUNK_SIZE
+    )
+
+
+class TransactionSelectionSerializer(serializers.Serializer):
+    """Выбор транзакций для массовой операции: список id или параметры фильтрации списка"""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, allow_empty=False, max_length=MAX_IDS
+    )
+    filter = serializers.DictField(required=False)
+    chunk_size = serializers.IntegerField(
+        min_value=1, max_value=MAX_CHUNK_SIZE, required=False, default=DEFAULT_CHUNK_SIZE
+    )
+
+    def validate_filter(self, value):
+        # Значения - как в строке запроса списка: списки для status__in и подобных склеиваются через запятую
+        params = {
+            name: ','.join(str(item) for item in item_value) if isinstance(item_value, list) else str(item_value)
+            for name, item_value in value.items()
+        }
+        form = TransactionFilter(params, queryset=Transaction.objects.none()).form
+        if not form.is_valid():
+            raise serializers.ValidationError(form.errors)
+        if not any(cleaned not in (None, '', []) for cleaned in form.cleaned_data.values()):
+            # Пустой фильтр выбрал бы все транзакции
+            raise serializers.ValidationError('Фильтр не задан')
+        return params
+
+    def validate(self, data):
+        if ('ids' in data) == ('filter' in data):
+            raise serializers.ValidationError('Укажите ровно одно из полей ids или filter')
+        return data
+
+
+class TransactionChangesSerializer(serializers.Serializer):
+    """Новые значения полей при массовом изменении транзакций"""
+
+    status = CachedPrimaryKeyRelatedField('statuses_by_id', queryset=Status.objects.all(), required=False)
+    transaction_type = CachedPrimaryKeyRelatedField(
+        'transaction_types_by_id', queryset=TransactionType.objects.all(), required=False
+    )
+    category = CachedPrimaryKeyRelatedField('categories_by_id', queryset=Category.objects.all(), required=False)
+    comment = serializers.CharField(required=False, allow_blank=True)
+
+    def validate(self, data):
+        if not data:
+            raise serializers.ValidationError('Не заданы изменения')
+        return data
+
+
+class TransactionBulkUpdateSerializer(TransactionSelectionSerializer):
+    """Массовое изменение: выбор транзакций и новые значения полей"""
+
+    changes = TransactionChangesSerializer()
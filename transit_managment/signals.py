@@ -0,0 +1,59 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+from mptt.signals import node_moved
+
+from . import rollups
+from .cache_versions import bump_version
+from .models import Category, Status, Transaction, TransactionType
+from .response_cache import month_version
+
+# Отправляется после любого изменения транзакций (в том числе массового).
+# Аргументы: days - множество затронутых дней (datetime.date). Агрегаты и контрольные точки остатка
+# к этому моменту уже обновлены в транзакции БД записи (rollups.apply_deltas).
+transactions_changed = Signal()
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_transaction_state(sender, instance, raw=False, **kwargs):
+    """Исходное состояние транзакции для пересчёта агрегатов"""
+    if not raw:
+        instance._rollup_snapshot = rollups.load_snapshot(instance)
+
+
+@receiver(post_save, sender=Transaction)
+def update_rollups_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = rollups.record_save(instance, getattr(instance, '_rollup_snapshot', None))
+    transactions_changed.send(sender=sender, days=rollups.changed_days(deltas))
+
+
+@receiver(post_delete, sender=Transaction)
+def update_rollups_on_delete(sender, instance, **kwargs):
+    deltas = rollups.record_delete(instance)
+    transactions_changed.send(sender=sender, days=rollups.changed_days(deltas))
+
+
+@receiver(transactions_changed)
+def invalidate_transactions(sender, days=(), **kwargs):
+    # Общая версия - для ETag и ответов без ограничения дат, версии месяцев - для кеша ответов по периодам
+    bump_version('transaction', *{month_version(day) for day in days})
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+def invalidate_categories(sender, **kwargs):
+    bump_version('category')
+
+
+@receiver(post_save, sender=TransactionType)
+@receiver(post_delete, sender=TransactionType)
+def invalidate_transaction_types(sender, **kwargs):
+    bump_version('transaction_type')
+
+
+@receiver(post_save, sender=Status)
+@receiver(post_delete, sender=Status)
+def invalidate_statuses(sender, **kwargs):
+    bump_version('status')
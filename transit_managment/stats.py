@@ -0,0 +1,215 @@
+from decimal import Decimal
+
+from django.db.models import Count, DateField, Q, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+from . import money
+from .filters import TransactionRollupFilter, validated_qs
+from .models import TransactionDailyRollup
+from .references import get_references
+
+INCOME_TYPE_NAME = 'Пополнение'
+EXPENSE_TYPE_NAME = 'Списание'
+
+PERIODS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+DIMENSIONS = {
+    'status': 'status_id',
+    'category': 'category_id',
+    'transaction_type': 'transaction_type_id',
+    # Группировка по категориям с суммированием в родительские узлы (см. rollup_category_tree)
+    'category_tree': 'category_id',
+}
+CATEGORY_TREE = 'category_tree'
+
+# Параметры запроса, относящиеся к группировке, а не к фильтрации
+STATS_PARAMS = ('period', 'group_by')
+
+
+class StatsParamsError(ValueError):
+    """Некорректные параметры группировки статистики"""
+
+
+def resolve_type_ids():
+    """Идентификаторы типов операций 'Пополнение' и 'Списание' из кеша справочников"""
+    references = get_references()
+    return references.transaction_type_id(INCOME_TYPE_NAME), references.transaction_type_id(EXPENSE_TYPE_NAME)
+
+
+def parse_grouping(params):
+    """Разбор параметров period и group_by из query params"""
+    period = params.get('period') or None
+    group_by = params.get('group_by') or None
+
+    if period and period not in PERIODS:
+        raise StatsParamsError(f"Неизвестный период '{period}'. Допустимые значения: {', '.join(PERIODS)}")
+    if group_by and group_by not in DIMENSIONS:
+        raise StatsParamsError(f"Неизвестное измерение '{group_by}'. Допустимые значения: {', '.join(DIMENSIONS)}")
+    if period and group_by == CATEGORY_TREE:
+        raise StatsParamsError(f"Группировка '{CATEGORY_TREE}' не сочетается с period")
+    return period, group_by
+
+
+def stats_source(params, transactions, ignore=STATS_PARAMS):
+    """
+    Источник статистики: дневные агрегаты, если фильтр задаёт только дни и справочники,
+    иначе отфильтрованные транзакции. Возвращает queryset и поля для compute_stats.
+
+    ignore - параметры запроса, не относящиеся к фильтрации. Некорректные параметры - FilterParamsError.
+    """
+    if TransactionRollupFilter.supports(params, ignore=ignore):
+        queryset = validated_qs(TransactionRollupFilter(params, queryset=TransactionDailyRollup.objects.all()))
+        return queryset, {'date_field': 'day', 'amount_field': 'total', 'count_field': 'count'}
+    return transactions, {}
+
+
+def _totals_row(income, expense, count):
+    income = income or Decimal('0')
+    expense = expense or Decimal('0')
+    return {
+        'total_income': income,
+        'total_expense': expense,
+        'balance': income - expense,
+        'transaction_count': count or 0,
+    }
+
+
+def _stats_query(queryset, income_type_id, expense_type_id, period, group_by, date_field, amount_field, count_field):
+    """Запрос статистики: (queryset, aggregates) для итогов или (queryset строк разбивки, None)"""
+    aggregates = {
+        'income': money.amount_sum(amount_field, filter=Q(transaction_type_id=income_type_id)),
+        'expense': money.amount_sum(amount_field, filter=Q(transaction_type_id=expense_type_id)),
+        'count': Sum(count_field) if count_field else Count('pk'),
+    }
+
+    if not period and not group_by:
+        return queryset.order_by(), aggregates
+
+    group_fields = []
+    if period:
+        queryset = queryset.annotate(period=PERIODS[period](date_field, output_field=DateField()))
+        group_fields.append('period')
+    if group_by:
+        group_fields.append(DIMENSIONS[group_by])
+
+    return queryset.order_by().values(*group_fields).annotate(**aggregates).order_by(*group_fields), None
+
+
+def _db_totals_row(income, expense, count):
+    """Итоги из значений amount_sum (в копейках на быстром пути money)"""
+    return _totals_row(money.from_db(income), money.from_db(expense), count)
+
+
+def _breakdown_result(rows, period, group_by):
+    breakdown = []
+    # Общие итоги складываются в единицах запроса (целые копейки на быстром пути) и переводятся в конце
+    income_total = expense_total = 0
+    count_total = 0
+    for row in rows:
+        item = {}
+        if period:
+            item['period'] = row['period']
+        if group_by:
+            item[group_by] = row[DIMENSIONS[group_by]]
+        item.update(_db_totals_row(row['income'], row['expense'], row['count']))
+        breakdown.append(item)
+
+        income_total += row['income'] or 0
+        expense_total += row['expense'] or 0
+        count_total += item['transaction_count']
+
+    result = _db_totals_row(income_total, expense_total, count_total)
+    result['period'] = period
+    result['group_by'] = group_by
+    result['breakdown'] = breakdown
+    return result
+
+
+def compute_stats(
+    queryset,
+    income_type_id,
+    expense_type_id,
+    period=None,
+    group_by=None,
+    date_field='date',
+    amount_field='amount',
+    count_field=None,
+):
+    """
+    Доходы, расходы, баланс и количество операций за один проход по таблице.
+
+    Суммы считаются условной агрегацией по transaction_type_id, без join на справочник типов.
+    При заданных period/group_by возвращается разбивка, а общие итоги складываются
+    из строк разбивки в памяти, поэтому запрос к БД всегда один.
+    """
+    queryset, aggregates = _stats_query(
+        queryset, income_type_id, expense_type_id, period, group_by, date_field, amount_field, count_field
+    )
+    if aggregates is not None:
+        row = queryset.aggregate(**aggregates)
+        return _db_totals_row(row['income'], row['expense'], row['count'])
+    return _breakdown_result(queryset, period, group_by)
+
+
+async def acompute_stats(
+    queryset,
+    income_type_id,
+    expense_type_id,
+    period=None,
+    group_by=None,
+    date_field='date',
+    amount_field='amount',
+    count_field=None,
+):
+    """compute_stats через асинхронный ORM"""
+    queryset, aggregates = _stats_query(
+        queryset, income_type_id, expense_type_id, period, group_by, date_field, amount_field, count_field
+    )
+    if aggregates is not None:
+        row = await queryset.aaggregate(**aggregates)
+        return _db_totals_row(row['income'], row['expense'], row['count'])
+    return _breakdown_result([row async for row in queryset], period, group_by)
+
+
+def rollup_category_tree(stats, tree, root_id=None):
+    """
+    Разбивка group_by=category_tree: суммы по категориям складываются во все узлы-предки за один проход.
+
+    Узлы обходятся в обратном порядке (tree_id, lft), поэтому потомки обработаны раньше родителей.
+    Возвращается дерево {category, name, итоги, children}; ветки без операций не включаются,
+    root_id (category_subtree) делает корнем ответа выбранную категорию.
+    """
+    own = {item[CATEGORY_TREE]: item for item in stats['breakdown']}
+    items = {}
+    for node in reversed(tree.nodes.values()):
+        item = own.get(node.id)
+        income = item['total_income'] if item else Decimal('0')
+        expense = item['total_expense'] if item else Decimal('0')
+        count = item['transaction_count'] if item else 0
+
+        children = [items[child.id] for child in node.children if items[child.id]['transaction_count']]
+        for child in children:
+            income += child['total_income']
+            expense += child['total_expense']
+            count += child['transaction_count']
+        items[node.id] = {'category': node.id, 'name': node.name, **_totals_row(income, expense, count)}
+        items[node.id]['children'] = children
+
+    if root_id is not None:
+        roots = [items[root_id]] if root_id in items else []
+    else:
+        roots = [items[node.id] for node in tree.roots]
+    stats['breakdown'] = [item for item in roots if item['transaction_count']]
+    return stats
+
+
+def category_root_id(params):
+    """Корень дерева итогов - category_subtree из параметров запроса"""
+    try:
+        return int(params.get('category_subtree'))
+    except (TypeError, ValueError):
+        return None
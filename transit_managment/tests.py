@@ -1 +1,1730 @@
-# Create your tests here.
+import base64
+import json
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import environ
+from asgiref.sync import sync_to_async
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import formats, timezone
+
+from project.settings.caches import check_shared_caches, per_process_caches
+from project.settings.database import database_settings
+
+from . import analytics, balances, bulk, metrics, money, partitions, rollups, search
+from .cache_versions import get_versions
+from .category_tree import get_category_tree
+from .filters import TransactionFilter, TransactionRollupFilter
+from .models import BalanceCheckpoint, Category, Status, Transaction, TransactionDailyRollup, TransactionType
+from .pagination import KEYSET_ORDERING
+from .references import get_references
+from .response_cache import TRANSACTION_VERSION, month_version
+from .signals import transactions_changed
+from .stats import compute_stats, resolve_type_ids
+
+
+class LedgerTestCase(TestCase):
+    """Базовые справочники и несколько транзакций для тестов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.business = Status.objects.create(name='Бизнес')
+        cls.personal = Status.objects.create(name='Личное')
+        cls.income = TransactionType.objects.create(name='Пополнение')
+        cls.expense = TransactionType.objects.create(name='Списание')
+        cls.salary = Category.objects.create(name='Зарплата', transaction_type=cls.income)
+        cls.infrastructure = Category.objects.create(name='Инфраструктура', transaction_type=cls.expense)
+        cls.vps = Category.objects.create(name='VPS', transaction_type=cls.expense, parent=cls.infrastructure)
+
+        now = timezone.now()
+        for days in range(10):
+            Transaction.objects.create(
+                date=now - timedelta(days=days),
+                status=cls.business if days % 2 else cls.personal,
+                transaction_type=cls.income,
+                category=cls.salary,
+                amount=Decimal('1000.00') + days,
+            )
+            Transaction.objects.create(
+                date=now - timedelta(days=days),
+                status=cls.business,
+                transaction_type=cls.expense,
+                category=cls.vps,
+                amount=Decimal('250.50'),
+            )
+        # Пока точек нет, сдвигать нечего - они строятся как периодической задачей
+        balances.fill()
+
+    def setUp(self):
+        # Версии справочников сбрасываются on_commit, которого нет внутри TestCase
+        cache.clear()
+        caches['responses'].clear()
+
+    def checkpoints(self):
+        # Нулевая точка и отсутствующая точка - один и тот же остаток
+        return set(BalanceCheckpoint.objects.exclude(balance=0).values_list('day', 'status_id', 'balance'))
+
+    def assertCheckpointsMatchRebuild(self):
+        checkpoints = self.checkpoints()
+        balances.rebuild()
+        self.assertEqual(self.checkpoints(), checkpoints)
+
+
+class StatsTests(LedgerTestCase):
+    """Итоги и разбивки статистики одним запросом"""
+
+    def stats(self, **kwargs):
+        income_type_id, expense_type_id = resolve_type_ids()
+        with self.assertNumQueries(1):
+            return compute_stats(Transaction.objects.all(), income_type_id, expense_type_id, **kwargs)
+
+    def test_totals(self):
+        get_references()
+        stats = self.stats()
+        self.assertEqual(stats['total_income'], Decimal('10045.00'))
+        self.assertEqual(stats['total_expense'], Decimal('2505.00'))
+        self.assertEqual(stats['balance'], Decimal('7540.00'))
+        self.assertEqual(stats['transaction_count'], 20)
+
+    def test_breakdown_by_status(self):
+        get_references()
+        stats = self.stats(group_by='status')
+        rows = {item['status']: item for item in stats['breakdown']}
+        self.assertEqual(
+            rows[self.business.pk],
+            {
+                'status': self.business.pk,
+                'total_income': Decimal('5025.00'),
+                'total_expense': Decimal('2505.00'),
+                'balance': Decimal('2520.00'),
+                'transaction_count': 15,
+            },
+        )
+        self.assertEqual(rows[self.personal.pk]['total_income'], Decimal('5020.00'))
+        self.assertEqual(rows[self.personal.pk]['total_expense'], Decimal('0'))
+        self.assertEqual(stats['balance'], Decimal('7540.00'))
+
+    def test_breakdown_by_day(self):
+        get_references()
+        stats = self.stats(period='day')
+        self.assertEqual(len(stats['breakdown']), 10)
+        self.assertEqual(
+            [item['period'] for item in stats['breakdown']], sorted(item['period'] for item in stats['breakdown'])
+        )
+        for item in stats['breakdown']:
+            self.assertEqual(item['transaction_count'], 2)
+            self.assertEqual(item['total_expense'], Decimal('250.50'))
+            self.assertEqual(item['balance'], item['total_income'] - item['total_expense'])
+
+    def test_api(self):
+        response = self.client.get(
+            f'/backend/api/transactions/stats/?group_by=transaction_type&status={self.business.pk}'
+        )
+        self.assertEqual(response.status_code, 200)
+        rows = {item['transaction_type']: item for item in response.json()['breakdown']}
+        self.assertEqual(rows[self.income.pk]['transaction_count'], 5)
+        self.assertEqual(rows[self.expense.pk]['transaction_count'], 10)
+        self.assertEqual(self.client.get('/backend/api/transactions/stats/?period=year').status_code, 400)
+        self.assertEqual(self.client.get('/backend/api/transactions/stats/?group_by=comment').status_code, 400)
+
+
+class RollupTests(LedgerTestCase):
+    """Дневные агрегаты обновляются при записи и совпадают с пересчётом с нуля"""
+
+    def rollup_rows(self):
+        return {
+            (row.day, row.status_id, row.transaction_type_id, row.category_id): (row.total, row.count)
+            for row in TransactionDailyRollup.objects.all()
+        }
+
+    def expected_rows(self):
+        return {key: value for key, value in rollups.deltas_for_queryset(Transaction.objects.all()).items()}
+
+    def test_create_update_delete(self):
+        day = timezone.localdate() - timedelta(days=20)
+        transaction = Transaction.objects.create(
+            date=rollups.day_start(day) + timedelta(hours=12),
+            status=self.business,
+            transaction_type=self.expense,
+            category=self.vps,
+            amount=Decimal('99.90'),
+        )
+        key = (day, self.business.pk, self.expense.pk, self.vps.pk)
+        self.assertEqual(self.rollup_rows()[key], (Decimal('99.90'), 1))
+
+        transaction.status = self.personal
+        transaction.amount = Decimal('10.00')
+        transaction.save()
+        rows = self.rollup_rows()
+        self.assertNotIn(key, rows)
+        self.assertEqual(rows[day, self.personal.pk, self.expense.pk, self.vps.pk], (Decimal('10.00'), 1))
+
+        transaction.delete()
+        self.assertEqual(self.rollup_rows(), self.expected_rows())
+
+    def test_rebuild_command(self):
+        TransactionDailyRollup.objects.update(total=0, count=1)
+        TransactionDailyRollup.objects.create(
+            day=date(2000, 1, 1),
+            status=self.business,
+            transaction_type=self.expense,
+            category=self.vps,
+            total=Decimal('1.00'),
+            count=1,
+        )
+        stale_month = month_version(date(2000, 1, 1))
+        versions = get_versions(TRANSACTION_VERSION, stale_month)
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_rollups', '--chunk-days', '3', stdout=out)
+        self.assertIn('Агрегаты пересчитаны', out.getvalue())
+        self.assertEqual(self.rollup_rows(), self.expected_rows())
+        # Ответы по прежним агрегатам (в том числе за удалённые дни) больше не действительны
+        new_versions = get_versions(TRANSACTION_VERSION, stale_month)
+        self.assertTrue(all(old != new for old, new in zip(versions, new_versions, strict=True)))
+
+    def test_invalid_filters_are_rejected(self):
+        self.assertTrue(TransactionRollupFilter.supports({'status': 'abc'}))
+        for params in ({'status': 'abc'}, {'date_from': '2024-13-01'}, {'category__in': '1,x'}):
+            response = self.client.get('/backend/api/transactions/stats/', params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn(next(iter(params)), response.json())
+        self.assertEqual(self.client.get('/backend/api/async/transactions/stats/', {'status': 'abc'}).status_code, 400)
+
+
+class TransactionIndexTests(LedgerTestCase):
+    """Составные индексы под фильтры TransactionFilter и сортировку по умолчанию"""
+
+    def index_columns(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Transaction._meta.db_table)
+        return {name: constraint['columns'] for name, constraint in constraints.items() if constraint['index']}
+
+    def test_composite_indexes(self):
+        indexes = self.index_columns()
+        expected = {
+            'transaction_date_created_idx': ['date', 'created_at'],
+            'transaction_status_date_idx': ['status_id', 'date'],
+            'transaction_category_date_idx': ['category_id', 'date'],
+            'transaction_type_date_idx': ['transaction_type_id', 'date'],
+        }
+        for name, columns in expected.items():
+            with self.subTest(index=name):
+                # INCLUDE-колонки PostgreSQL идут после ключевых, SQLite их не создаёт
+                self.assertEqual(indexes[name][: len(columns)], columns)
+        # Одиночные индексы внешних ключей перекрыты составными и не создаются
+        self.assertFalse(
+            {('status_id',), ('category_id',), ('transaction_type_id',)} & set(map(tuple, indexes.values()))
+        )
+
+    def test_default_ordering_matches_index(self):
+        ordering = str(Transaction.objects.all().query).split(' ORDER BY ')[1]
+        self.assertEqual(
+            ordering,
+            '"transit_managment_transaction"."date" DESC, "transit_managment_transaction"."created_at" DESC',
+        )
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class CursorPaginationTests(LedgerTestCase):
+    """Курсорная пагинация списка транзакций"""
+
+    url = '/backend/api/transactions/?page_size=7'
+
+    def ids(self, response):
+        return [item['id'] for item in response.json()['results']]
+
+    def test_next_and_previous_links(self):
+        first = self.client.get(self.url).json()
+        self.assertEqual(len(first['results']), 7)
+        self.assertIsNone(first['previous'])
+        self.assertNotIn('count', first)
+
+        second = self.client.get(first['next'])
+        third = self.client.get(second.json()['next']).json()
+        self.assertEqual(len(third['results']), 6)
+        self.assertIsNone(third['next'])
+
+        pages = [item['id'] for page in (first, second.json(), third) for item in page['results']]
+        expected = list(Transaction.objects.order_by(*KEYSET_ORDERING).values_list('id', flat=True))
+        self.assertEqual(pages, expected)
+
+        # Назад с третьей страницы - снова вторая, и у неё есть ссылка на первую
+        back = self.client.get(third['previous'])
+        self.assertEqual(self.ids(back), self.ids(second))
+        self.assertEqual(self.ids(self.client.get(back.json()['previous'])), [item['id'] for item in first['results']])
+
+    def test_count(self):
+        self.assertEqual(self.client.get(f'{self.url}&count=exact').json()['count'], 20)
+
+    def test_invalid_cursor(self):
+        cursor = parse_qs(urlsplit(self.client.get(self.url).json()['next']).query)['cursor'][0]
+        tampered = base64.urlsafe_b64encode(b'["2026-01-01T00:00:00+00:00",null,"x"]').decode()
+        for value in ('not-a-cursor', cursor[:-3], tampered):
+            with self.subTest(cursor=value):
+                response = self.client.get(f'{self.url}&cursor={value}')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('cursor', response.json())
+        response = self.client.get('/backend/api/async/transactions/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class TransactionQueryCountTests(LedgerTestCase):
+    """Количество запросов на списках транзакций не зависит от числа строк"""
+
+    def add_transactions(self, count):
+        Transaction.objects.bulk_create(
+            Transaction(
+                status=self.business,
+                transaction_type=self.expense,
+                category=self.vps,
+                amount=Decimal('10.00'),
+            )
+            for _ in range(count)
+        )
+
+    def assertConstantQueries(self, url):
+        # Первый запрос прогревает кеш справочников
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.add_transactions(30)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(len(small), len(large), msg=[query['sql'] for query in large.captured_queries])
+
+    def test_list_api(self):
+        self.assertConstantQueries('/backend/api/transactions/?page_size=100')
+
+    def test_home_page(self):
+        self.assertConstantQueries('/')
+
+    def test_retrieve_api(self):
+        transaction = Transaction.objects.first()
+        get_references()
+        with self.assertNumQueries(1):
+            self.client.get(f'/backend/api/transactions/{transaction.pk}/')
+
+
+class CategoryTreeCacheTests(LedgerTestCase):
+    """Дерево категорий строится одним запросом и перестраивается после изменений"""
+
+    def tree_shape(self):
+        return self.client.get('/backend/api/categories/tree/').json()
+
+    def test_served_from_memory(self):
+        with self.assertNumQueries(1):
+            get_category_tree()
+        with self.assertNumQueries(0):
+            tree = get_category_tree()
+        self.assertEqual([child.id for child in tree.get(self.infrastructure.pk).children], [self.vps.pk])
+        self.assertTrue(tree.get(self.vps.pk).is_leaf)
+
+    def test_rebuilt_after_move(self):
+        get_category_tree()
+        with self.captureOnCommitCallbacks(execute=True):
+            hosting = Category.objects.create(name='Хостинг', transaction_type=self.expense)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.get(pk=self.vps.pk).move_to(hosting, 'last-child')
+
+        tree = get_category_tree()
+        self.assertEqual(tree.get(self.vps.pk).parent_id, hosting.pk)
+        self.assertEqual(tree.get(self.infrastructure.pk).children, [])
+        self.assertTrue(tree.get(self.infrastructure.pk).is_leaf)
+        nodes = {node['id']: node for node in self.tree_shape()}
+        self.assertEqual([child['id'] for child in nodes[hosting.pk]['children']], [self.vps.pk])
+
+    def test_rebuilt_after_rename_and_delete(self):
+        get_category_tree()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.filter(pk=self.salary.pk).update(name='Оклад')
+            Category.objects.get(pk=self.salary.pk).save()
+        self.assertEqual(get_category_tree().get(self.salary.pk).name, 'Оклад')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.get(pk=self.salary.pk).delete()
+        self.assertIsNone(get_category_tree().get(self.salary.pk))
+        self.assertNotIn(self.salary.pk, [node['id'] for node in self.tree_shape()])
+
+
+class ReferenceDataTests(LedgerTestCase):
+    def test_lookups_are_served_from_memory(self):
+        get_references()
+        with self.assertNumQueries(0):
+            references = get_references()
+            self.assertEqual(references.transaction_type_id('Пополнение'), self.income.pk)
+            self.assertEqual(references.status_name(self.business.pk), 'Бизнес')
+            self.assertEqual(references.category_name(self.vps.pk), 'VPS')
+
+    def test_invalidated_on_change(self):
+        get_references()
+        with self.captureOnCommitCallbacks(execute=True):
+            Status.objects.create(name='Налог')
+        self.assertIsNotNone(get_references().status_id('Налог'))
+
+
+class SharedCacheSettingsTests(TestCase):
+    """Несколько воркеров не запускаются с кешем внутри процесса"""
+
+    def test_per_process_cache_with_workers(self):
+        env = environ.Env()
+        caches_config = {
+            'default': env.cache_url_config('locmemcache://'),
+            'responses': env.cache_url_config('redis://redis:6379/1'),
+        }
+        self.assertEqual(per_process_caches(caches_config), ['default'])
+        check_shared_caches(caches_config, workers=1)
+        with self.assertRaisesMessage(ImproperlyConfigured, 'default'):
+            check_shared_caches(caches_config, workers=4)
+
+        caches_config['default'] = env.cache_url_config('redis://redis:6379/0')
+        check_shared_caches(caches_config, workers=4)
+
+
+class TransactionImportTests(LedgerTestCase):
+    """Потоковый импорт CSV и JSON Lines"""
+
+    def setUp(self):
+        super().setUp()
+        self.signals = []
+
+        def receiver(sender, days, **kwargs):
+            self.signals.append(set(days))
+
+        transactions_changed.connect(receiver, weak=False, dispatch_uid='test-import')
+        self.addCleanup(transactions_changed.disconnect, dispatch_uid='test-import')
+
+    def import_file(self, content, suffix, *args):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8', delete=False) as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        out, err = StringIO(), StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_transactions', file.name, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def assertRollupsMatch(self):
+        expected = rollups.deltas_for_queryset(Transaction.objects.all())
+        actual = {
+            tuple(getattr(row, field) for field in rollups.ROLLUP_KEY_FIELDS): (row.total, row.count)
+            for row in TransactionDailyRollup.objects.all()
+        }
+        self.assertEqual(actual, dict(expected))
+
+    def test_csv_chunks(self):
+        rows = ['date,status,transaction_type,category,amount,comment']
+        rows += [f'2024-03-0{day},Бизнес,Пополнение,{self.salary.pk},10{day}.50,строка {day}' for day in range(1, 6)]
+        out, err = self.import_file('\n'.join(rows) + '\n', '.csv', '--chunk-size', '2')
+
+        self.assertEqual(err, '')
+        # Пачки по 2 строки: 2, 4 и остаток 5
+        self.assertEqual(
+            out.splitlines()[:3],
+            ['Загружено: 2, ошибок: 0', 'Загружено: 4, ошибок: 0', 'Загружено: 5, ошибок: 0'],
+        )
+        self.assertIn('создано 5, ошибок 0', out)
+        imported = Transaction.objects.filter(comment__startswith='строка')
+        self.assertEqual(imported.count(), 5)
+        self.assertEqual(imported.aggregate(total=Sum('amount'))['total'], Decimal('517.50'))
+        self.assertRollupsMatch()
+        # Один сигнал на весь импорт со всеми затронутыми днями
+        self.assertEqual(len(self.signals), 1)
+        self.assertEqual(len(self.signals[0]), 5)
+
+    def test_csv_invalid_rows(self):
+        content = (
+            'date,status,transaction_type,category,amount,comment\n'
+            f'2024-03-01,{self.personal.pk},{self.income.pk},{self.salary.pk},100,ok\n'
+            f'2024-03-02,Неизвестный,Пополнение,{self.salary.pk},100,\n'
+            f'2024-03-03,Бизнес,Списание,{self.infrastructure.pk},100,\n'
+            f'2024-03-04,Бизнес,Списание,{self.vps.pk},1.001,\n'
+            f'вчера,Бизнес,Пополнение,{self.salary.pk},100,\n'
+        )
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as report:
+            pass
+        self.addCleanup(os.remove, report.name)
+        self.import_file(content, '.csv', '--errors-file', report.name)
+
+        with open(report.name, encoding='utf-8') as file:
+            result = json.load(file)
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(result['failed'], 4)
+        self.assertFalse(result['errors_truncated'])
+        # Номера строк файла с учётом заголовка
+        self.assertEqual([error['row'] for error in result['errors']], [3, 4, 5, 6])
+        self.assertIn("Неизвестный статус 'Неизвестный'", result['errors'][0]['errors'])
+        self.assertIn('Сумма должна содержать не более двух знаков после запятой', result['errors'][2]['errors'])
+        self.assertIn("Некорректная дата 'вчера'", result['errors'][3]['errors'])
+        self.assertEqual(Transaction.objects.count(), 21)
+        self.assertRollupsMatch()
+
+    def test_jsonl_api(self):
+        lines = [
+            {
+                'date': '2024-03-01T10:00:00',
+                'status': 'Личное',
+                'transaction_type': 'Списание',
+                'category': self.vps.pk,
+                'amount': '99.99',
+            },
+            {
+                'date': '2024-03-01T12:00:00',
+                'status': 'Личное',
+                'transaction_type': 'Списание',
+                'category': self.vps.pk,
+                'amount': 0.01,
+            },
+            ['не', 'объект'],
+        ]
+        body = '\n'.join(json.dumps(line, ensure_ascii=False) for line in lines) + '\n{broken\n\n'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/backend/api/transactions/bulk/?chunk_size=1', body, content_type='application/x-ndjson'
+            )
+
+        self.assertEqual(response.status_code, 200, response.content)
+        result = response.json()
+        self.assertEqual((result['created'], result['failed']), (2, 2))
+        self.assertEqual([error['row'] for error in result['errors']], [3, 4])
+        self.assertTrue(result['errors'][1]['errors'][0].startswith('Некорректный JSON'))
+        self.assertEqual(
+            Transaction.objects.filter(status=self.personal, category=self.vps).aggregate(total=Sum('amount'))['total'],
+            Decimal('100.00'),
+        )
+        self.assertRollupsMatch()
+        self.assertEqual(len(self.signals), 1)
+
+    def test_api_chunk_size_validated(self):
+        for chunk_size in ('0', '10001', 'abc'):
+            with self.subTest(chunk_size=chunk_size):
+                response = self.client.post(
+                    f'/backend/api/transactions/bulk/?file_format=csv&chunk_size={chunk_size}',
+                    'a\n',
+                    content_type='text/csv',
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('chunk_size', response.json())
+
+    def test_failed_chunk_reported(self):
+        content = 'date,status,transaction_type,category,amount,comment\n' + ''.join(
+            f'2024-03-0{day},Бизнес,Пополнение,{self.salary.pk},100,строка {day}\n' for day in range(1, 6)
+        )
+        bulk_create = rollups.bulk_create
+
+        def failing_second_chunk(batch):
+            if batch[0].comment == 'строка 3':
+                raise IntegrityError('duplicate key')
+            return bulk_create(batch)
+
+        with (
+            mock.patch.object(rollups, 'bulk_create', failing_second_chunk),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            response = self.client.post(
+                '/backend/api/transactions/bulk/?chunk_size=2', content, content_type='text/csv'
+            )
+
+        self.assertEqual(response.status_code, 200, response.content)
+        result = response.json()
+        self.assertEqual((result['created'], result['failed']), (3, 2))
+        self.assertEqual([error['row'] for error in result['errors']], [4, 5])
+        self.assertEqual(result['errors'][0]['errors'], ['Пачка не записана: duplicate key'])
+        self.assertEqual(Transaction.objects.filter(comment__startswith='строка').count(), 3)
+        self.assertRollupsMatch()
+
+    def test_nothing_imported(self):
+        self.import_file('date,status,transaction_type,category,amount,comment\n', '.csv')
+        self.assertEqual(self.signals, [])
+        self.assertEqual(Transaction.objects.count(), 20)
+
+
+class TransactionExportTests(LedgerTestCase):
+    """Выгрузка отфильтрованных транзакций"""
+
+    def test_csv_stream(self):
+        response = self.client.get(
+            '/backend/api/transactions/export/', {'file_format': 'csv', 'transaction_type': self.expense.pk}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="transactions_', response['Content-Disposition'])
+
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(lines[0], '\ufeffid,date,status,transaction_type,category,amount,comment')
+        rows = [line.split(',') for line in lines[1:]]
+        self.assertEqual(len(rows), 10)
+        # Порядок - как у списка: от новых к старым
+        expected_ids = list(
+            Transaction.objects.filter(transaction_type=self.expense)
+            .order_by(*KEYSET_ORDERING)
+            .values_list('pk', flat=True)
+        )
+        self.assertEqual([int(row[0]) for row in rows], expected_ids)
+        self.assertEqual({tuple(row[2:6]) for row in rows}, {('Бизнес', 'Списание', 'VPS', '250.50')})
+
+    def test_xlsx(self):
+        response = self.client.get('/backend/api/transactions/export/', {'file_format': 'xlsx'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        self.assertIn('.xlsx', response['Content-Disposition'])
+        # XLSX - zip-архив
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'PK'))
+
+    def test_unknown_format(self):
+        response = self.client.get('/backend/api/transactions/export/', {'file_format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TransactionValidationTests(LedgerTestCase):
+    """Проверка категории по закешированному дереву, без запросов к связанным объектам"""
+
+    def payload(self, **overrides):
+        data = {
+            'status': self.business.pk,
+            'transaction_type': self.expense.pk,
+            'category': self.vps.pk,
+            'amount': '100.00',
+        }
+        data.update(overrides)
+        return data
+
+    def test_clean_without_queries(self):
+        transaction = Transaction(
+            status_id=self.business.pk, transaction_type_id=self.expense.pk, category_id=self.vps.pk
+        )
+        transaction.clean()
+        with self.assertNumQueries(0):
+            transaction.clean()
+
+    def test_clean_rejects_parent_and_foreign_category(self):
+        cases = {
+            'родительскую': {'transaction_type_id': self.expense.pk, 'category_id': self.infrastructure.pk},
+            'не относится': {'transaction_type_id': self.income.pk, 'category_id': self.vps.pk},
+        }
+        for message, ids in cases.items():
+            with self.subTest(message=message), self.assertRaisesMessage(ValidationError, message):
+                Transaction(status_id=self.business.pk, **ids).clean()
+
+    def test_api_create_queries(self):
+        self.client.post('/backend/api/transactions/', self.payload(), content_type='application/json')
+        # Транзакция БД, INSERT, обновление дневного агрегата
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/backend/api/transactions/', self.payload(), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        statements = [query['sql'] for query in queries.captured_queries]
+        self.assertFalse([sql for sql in statements if sql.startswith('SELECT')], msg=statements)
+        self.assertEqual(len([sql for sql in statements if sql.startswith('INSERT')]), 1, msg=statements)
+
+    def test_api_rejects_invalid_category(self):
+        response = self.client.post(
+            '/backend/api/transactions/',
+            self.payload(category=self.infrastructure.pk),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+        transaction = Transaction.objects.filter(category=self.vps).first()
+        response = self.client.patch(
+            f'/backend/api/transactions/{transaction.pk}/',
+            {'transaction_type': self.income.pk},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_category_missing_from_cached_tree(self):
+        get_category_tree()
+        get_references()
+        # Категория создана после построения дерева: версия сбрасывается только on_commit
+        hosting = Category.objects.create(name='Хостинг', transaction_type=self.expense)
+        transaction = Transaction(
+            status_id=self.business.pk,
+            transaction_type_id=self.expense.pk,
+            category_id=hosting.pk,
+        )
+        with self.assertNumQueries(1):
+            transaction.clean()
+
+
+class AsyncReadApiTests(LedgerTestCase):
+    """Асинхронные эндпоинты отдают то же, что синхронные"""
+
+    async def assertSameAsSync(self, path, query=''):
+        sync_response = await sync_to_async(self.client.get)(f'/backend/api/{path}{query}')
+        async_response = await self.async_client.get(f'/backend/api/async/{path}{query}')
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        # Ссылки на страницы отличаются только префиксом пути
+        async_content = async_response.content.decode().replace('/backend/api/async/', '/backend/api/')
+        self.assertEqual(json.loads(async_content), sync_response.json())
+
+    async def test_list(self):
+        await self.assertSameAsSync('transactions/', f'?page_size=5&count=exact&status={self.business.pk}')
+
+    async def test_next_page(self):
+        first = await self.async_client.get('/backend/api/async/transactions/?page_size=5')
+        cursor = first.json()['next'].split('cursor=')[1]
+        await self.assertSameAsSync('transactions/', f'?page_size=5&cursor={cursor}')
+
+    async def test_retrieve(self):
+        transaction = await Transaction.objects.afirst()
+        await self.assertSameAsSync(f'transactions/{transaction.pk}/')
+        response = await self.async_client.get('/backend/api/async/transactions/0/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_stats(self):
+        for query in (
+            '',
+            '?period=month&group_by=category',
+            f'?category={self.vps.pk}&group_by=status',
+            f'?group_by=category_tree&category_subtree={self.infrastructure.pk}',
+        ):
+            with self.subTest(query=query):
+                await self.assertSameAsSync('transactions/stats/', query)
+
+    async def test_category_tree(self):
+        await self.assertSameAsSync('categories/tree/')
+
+    async def test_search_reloads_references(self):
+        def reloaded():
+            # Версию справочников сбросили после того, как представление их получило: снимок читается из БД
+            cache.clear()
+            with mock.patch('transit_managment.references._cached', (None, None)):
+                return get_references()
+
+        with mock.patch('transit_managment.search.get_references', reloaded):
+            await self.assertSameAsSync('transactions/', '?search=VPS')
+            await self.assertSameAsSync('transactions/stats/', '?search=VPS')
+
+
+class DatabaseSettingsTests(TestCase):
+    """DATABASES из переменных окружения и ожидание доступности базы"""
+
+    POSTGRES = {'ENGINE': 'django.db.backends.postgresql', 'POSTGRES_HOST': 'db', 'POSTGRES_PORT': '6432'}
+
+    def database_settings(self, variables, available=True):
+        probes = []
+
+        def probe(params, timeout):
+            probes.append((params, timeout))
+            return available
+
+        with mock.patch.dict(os.environ, variables, clear=True):
+            return database_settings(environ.Env(), 'db.sqlite3', probe=probe)['default'], probes
+
+    def test_sqlite_by_default(self):
+        config, probes = self.database_settings({})
+        self.assertEqual(config, {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'db.sqlite3'})
+        self.assertEqual(probes, [])
+
+    def test_postgres_persistent_connections(self):
+        config, probes = self.database_settings({**self.POSTGRES, 'CONN_MAX_AGE': '30'}, available=False)
+        self.assertEqual(config['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((config['HOST'], config['PORT']), ('db', 6432))
+        self.assertEqual(config['OPTIONS'], {'connect_timeout': 5})
+        self.assertEqual((config['CONN_MAX_AGE'], config['CONN_HEALTH_CHECKS']), (30, True))
+        # Без POSTGRES_PROBE импорт настроек к базе не подключается
+        self.assertEqual(probes, [])
+
+    def test_postgres_pool(self):
+        config, _ = self.database_settings({**self.POSTGRES, 'DB_POOL': 'True', 'DB_POOL_MAX_SIZE': '20'})
+        self.assertEqual(config['OPTIONS']['pool'], {'min_size': 2, 'max_size': 20, 'timeout': 10})
+        self.assertNotIn('CONN_MAX_AGE', config)
+
+    def test_sqlite_fallback(self):
+        config, probes = self.database_settings({**self.POSTGRES, 'POSTGRES_PROBE': 'True'}, available=False)
+        self.assertEqual(config['ENGINE'], 'django.db.backends.sqlite3')
+        # Пробное подключение - с коротким таймаутом
+        self.assertEqual(
+            probes,
+            [({'dbname': 'postgres', 'user': 'postgres', 'password': 'postgres', 'host': 'db', 'port': 6432}, 1)],
+        )
+
+        config, _ = self.database_settings({**self.POSTGRES, 'POSTGRES_PROBE': 'True'}, available=True)
+        self.assertEqual(config['ENGINE'], 'django.db.backends.postgresql')
+
+    def test_wait_for_db(self):
+        out, err = StringIO(), StringIO()
+        failures = [OperationalError('connection refused'), OperationalError('connection refused')]
+        real_ensure_connection = connection.ensure_connection
+
+        def ensure_connection():
+            if failures:
+                raise failures.pop()
+            real_ensure_connection()
+
+        with (
+            mock.patch.object(connection, 'ensure_connection', side_effect=ensure_connection),
+            mock.patch('transit_managment.management.commands.wait_for_db.time.sleep') as sleep,
+        ):
+            call_command('wait_for_db', '--interval', '0.5', stdout=out, stderr=err)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(err.getvalue().count('повтор через 0.5 с'), 2)
+        self.assertIn('База данных доступна (sqlite)', out.getvalue())
+
+    def test_wait_for_db_timeout(self):
+        with (
+            mock.patch.object(connection, 'ensure_connection', side_effect=OperationalError('connection refused')),
+            mock.patch('transit_managment.management.commands.wait_for_db.time.sleep'),
+            self.assertRaisesMessage(CommandError, 'База данных недоступна после 1 попыток'),
+        ):
+            call_command('wait_for_db', '--timeout', '0.5', '--interval', '1', stderr=StringIO())
+
+
+class ConditionalGetTests(LedgerTestCase):
+    """ETag и 304 Not Modified без обращения к БД"""
+
+    def test_not_modified_without_queries(self):
+        for url in (
+            '/backend/api/statuses/',
+            '/backend/api/categories/tree/',
+            f'/backend/api/transactions/?status={self.business.pk}&page_size=5',
+            '/backend/api/transactions/stats/',
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('ETag', response)
+                with self.assertNumQueries(0):
+                    cached = self.client.get(url, headers={'If-None-Match': response['ETag']})
+                self.assertEqual(cached.status_code, 304)
+                self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_etag_ignores_param_order(self):
+        first = self.client.get(f'/backend/api/transactions/?status={self.business.pk}&page_size=5')
+        second = self.client.get(f'/backend/api/transactions/?page_size=5&status={self.business.pk}')
+        other = self.client.get(f'/backend/api/transactions/?page_size=5&status={self.personal.pk}')
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertNotEqual(first['ETag'], other['ETag'])
+
+    def test_etag_changes_on_write(self):
+        list_etag = self.client.get('/backend/api/transactions/')['ETag']
+        status_etag = self.client.get('/backend/api/statuses/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Transaction.objects.create(
+                status=self.business,
+                transaction_type=self.expense,
+                category=self.vps,
+                amount=Decimal('1.00'),
+            )
+        self.assertNotEqual(self.client.get('/backend/api/transactions/')['ETag'], list_etag)
+        self.assertEqual(self.client.get('/backend/api/statuses/')['ETag'], status_etag)
+
+    def test_cache_control(self):
+        self.assertIn('max-age=', self.client.get('/backend/api/statuses/')['Cache-Control'])
+        self.assertIn('no-cache', self.client.get('/backend/api/transactions/')['Cache-Control'])
+
+
+class ResponseCacheTests(LedgerTestCase):
+    """Кеш ответов сбрасывается только записями в закешированном периоде"""
+
+    def setUp(self):
+        super().setUp()
+        today = timezone.localdate()
+        self.month_start = today.replace(day=1)
+        self.url = f'/backend/api/transactions/stats/?date_from={self.month_start}&date_to={today}&group_by=status'
+
+    def create_transaction(self, date):
+        with self.captureOnCommitCallbacks(execute=True):
+            Transaction.objects.create(
+                date=date,
+                status=self.business,
+                transaction_type=self.expense,
+                category=self.vps,
+                amount=Decimal('1.00'),
+            )
+
+    def test_hit_without_queries(self):
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_params_are_normalized(self):
+        self.client.get(self.url)
+        reordered = f'/backend/api/transactions/stats/?group_by=status&date_to={timezone.localdate()}'
+        response = self.client.get(f'{reordered}&date_from={self.month_start}&unknown=1')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_write_outside_range_keeps_cache(self):
+        self.client.get(self.url)
+        self.create_transaction(timezone.now() - timedelta(days=70))
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+        # Без ограничения дат ответ зависит от любой записи
+        self.assertEqual(self.client.get('/backend/api/transactions/stats/')['X-Cache'], 'MISS')
+
+    def test_write_inside_range_invalidates(self):
+        before = self.client.get(self.url).json()
+        self.create_transaction(timezone.now())
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['transaction_count'], before['transaction_count'] + 1)
+
+    def test_category_change_invalidates(self):
+        url = '/backend/api/transactions/stats/?group_by=category_tree'
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.infrastructure.name = 'Серверы'
+            self.infrastructure.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        names = {item['name'] for item in response.json()['breakdown']}
+        self.assertIn('Серверы', names)
+        self.assertNotIn('Инфраструктура', names)
+
+    def test_list_cache_and_metrics(self):
+        url = f'/backend/api/transactions/?status={self.business.pk}&page_size=5'
+        first = self.client.get(url)
+        second = self.client.get(url)
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.json(), first.json())
+
+        metrics = self.client.get('/backend/api/transactions/cache-stats/').json()
+        self.assertEqual(metrics['list'], {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+
+class CategorySubtreeTests(LedgerTestCase):
+    """Фильтр по поддереву категорий и итоги по дереву"""
+
+    def test_subtree_filter(self):
+        response = self.client.get(f'/backend/api/transactions/?category_subtree={self.infrastructure.pk}&page_size=50')
+        results = response.json()['results']
+        self.assertEqual(len(results), 10)
+        self.assertEqual({item['category'] for item in results}, {self.vps.pk})
+
+        queryset = TransactionFilter(
+            {'category_subtree': self.infrastructure.pk}, queryset=Transaction.objects.all()
+        ).qs
+        sql = str(queryset.query)
+        self.assertIn('"lft" >=', sql)
+        self.assertNotIn(' IN (', sql)
+
+    def test_subtree_stats_use_rollups(self):
+        self.assertTrue(TransactionRollupFilter.supports({'category_subtree': str(self.infrastructure.pk)}))
+        stats = self.client.get(f'/backend/api/transactions/stats/?category_subtree={self.infrastructure.pk}').json()
+        self.assertEqual(stats['transaction_count'], 10)
+        self.assertEqual(Decimal(str(stats['total_expense'])), Decimal('2505.00'))
+
+    def test_category_tree_totals(self):
+        stats = self.client.get('/backend/api/transactions/stats/?group_by=category_tree').json()
+        nodes = {item['category']: item for item in stats['breakdown']}
+        self.assertEqual(set(nodes), {self.salary.pk, self.infrastructure.pk})
+
+        infrastructure = nodes[self.infrastructure.pk]
+        self.assertEqual(infrastructure['transaction_count'], 10)
+        self.assertEqual([child['category'] for child in infrastructure['children']], [self.vps.pk])
+        self.assertEqual(infrastructure['total_expense'], infrastructure['children'][0]['total_expense'])
+        self.assertEqual(sum(item['transaction_count'] for item in stats['breakdown']), stats['transaction_count'])
+
+        subtree = self.client.get(
+            f'/backend/api/transactions/stats/?group_by=category_tree&category_subtree={self.infrastructure.pk}'
+        ).json()
+        self.assertEqual([item['category'] for item in subtree['breakdown']], [self.infrastructure.pk])
+
+    def test_category_tree_rejects_period(self):
+        response = self.client.get('/backend/api/transactions/stats/?group_by=category_tree&period=month')
+        self.assertEqual(response.status_code, 400)
+
+
+class SargableFilterTests(LedgerTestCase):
+    """Условия фильтра сравнивают колонки напрямую и используют индексы"""
+
+    def filtered(self, **params):
+        return TransactionFilter(params, queryset=Transaction.objects.all()).qs
+
+    def test_conditions_compare_columns(self):
+        queryset = self.filtered(
+            date_from='2026-01-01',
+            date_to='2026-01-31',
+            datetime_to='2026-01-15T12:00:00',
+            status__in=f'{self.business.pk},{self.personal.pk}',
+            amount_min='10',
+            amount_max='500.50',
+        )
+        where = str(queryset.query).split(' WHERE ')[1].split(' ORDER BY ')[0]
+        conditions = where[1:-1].split(' AND ')
+        self.assertEqual(len(conditions), 6, msg=conditions)
+        # Каждое условие - колонка без функций над ней, оператор сравнения и значение
+        for condition in conditions:
+            with self.subTest(condition=condition):
+                self.assertRegex(
+                    condition, r'^"transit_managment_transaction"\."(date|status_id|amount)" (>=|<=|<|IN) '
+                )
+
+    def test_half_open_date_range(self):
+        today = timezone.localdate()
+        queryset = self.filtered(date_from=str(today), date_to=str(today))
+        self.assertEqual(queryset.count(), 2)
+        where = queryset.query.sql_with_params()[0].split(' WHERE ')[1].split(' ORDER BY ')[0]
+        self.assertEqual(
+            where,
+            '("transit_managment_transaction"."date" >= %s AND "transit_managment_transaction"."date" < %s)',
+        )
+
+    def test_multi_value_filters_match_fk_index(self):
+        # Условие по ведущей колонке индекса transaction_status_date_idx без функций над ней
+        queryset = self.filtered(status__in=f'{self.business.pk},{self.personal.pk}')
+        where = queryset.query.sql_with_params()[0].split(' WHERE ')[1].split(' ORDER BY ')[0]
+        self.assertEqual(where, '"transit_managment_transaction"."status_id" IN (%s, %s)')
+        self.assertEqual(queryset.count(), 20)
+
+    def test_values(self):
+        cases = {
+            'status__in': (f'{self.business.pk},{self.personal.pk}', 20),
+            'category__in': (f'{self.vps.pk}', 10),
+            'amount_min': ('1005', 5),
+            'amount_max': ('250.50', 10),
+        }
+        for name, (value, expected) in cases.items():
+            with self.subTest(filter=name):
+                self.assertEqual(self.filtered(**{name: value}).count(), expected)
+
+    def test_rollup_eligibility(self):
+        self.assertTrue(TransactionRollupFilter.supports({'status__in': '1,2', 'category__in': '3'}))
+        self.assertFalse(TransactionRollupFilter.supports({'amount_min': '10'}))
+        self.assertFalse(TransactionRollupFilter.supports({'datetime_from': '2026-01-01T00:00:00'}))
+
+        url = f'/backend/api/transactions/stats/?amount_min=1005&status__in={self.business.pk},{self.personal.pk}'
+        self.assertEqual(self.client.get(url).json()['transaction_count'], 5)
+
+
+class TransactionSearchTests(LedgerTestCase):
+    """Полнотекстовый поиск по комментариям и названиям справочников"""
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.hosting = Transaction.objects.create(
+            date=now,
+            status=self.business,
+            transaction_type=self.expense,
+            category=self.vps,
+            amount=Decimal('300.00'),
+            comment='Оплата хостинга за октябрь',
+        )
+        self.hosting_twice = Transaction.objects.create(
+            date=now - timedelta(days=20),
+            status=self.business,
+            transaction_type=self.expense,
+            category=self.vps,
+            amount=Decimal('600.00'),
+            comment='Хостинг: продление хостинга на год',
+        )
+
+    def search(self, term, **params):
+        return TransactionFilter({'search': term, **params}, queryset=Transaction.objects.all()).qs
+
+    def test_comment_words_and_prefixes(self):
+        self.assertEqual(set(self.search('хостинга')), {self.hosting, self.hosting_twice})
+        self.assertEqual(set(self.search('хост')), {self.hosting, self.hosting_twice})
+        self.assertEqual(list(self.search('оплата октябрь')), [self.hosting])
+        self.assertEqual(self.search('аренда').count(), 0)
+
+    def test_reference_names(self):
+        # Название категории совпадает у всех её операций, комментарии пустые
+        self.assertEqual(self.search('зарпл').count(), 10)
+        self.assertEqual(self.search('зарпл', status=self.personal.pk).count(), 5)
+
+    def test_index_follows_writes(self):
+        self.hosting.comment = 'Аренда офиса'
+        self.hosting.save()
+        self.assertEqual(list(self.search('аренда')), [self.hosting])
+        self.assertEqual(list(self.search('хостинга')), [self.hosting_twice])
+
+        Transaction.objects.filter(pk=self.hosting_twice.pk).update(comment='Реклама')
+        self.assertEqual(self.search('хостинга').count(), 0)
+
+        self.hosting.delete()
+        self.assertEqual(self.search('аренда').count(), 0)
+
+    def test_ranked_endpoint(self):
+        response = self.client.get('/backend/api/transactions/search/', {'search': 'хостинг'})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        # Два вхождения слова релевантнее одного, несмотря на более раннюю дату
+        self.assertEqual([item['id'] for item in results], [self.hosting_twice.pk, self.hosting.pk])
+        self.assertGreater(results[0]['rank'], results[1]['rank'])
+
+        self.assertEqual(self.client.get('/backend/api/transactions/search/').status_code, 400)
+        limited = self.client.get('/backend/api/transactions/search/', {'search': 'хостинг', 'limit': 1}).json()
+        self.assertEqual(limited['count'], 1)
+
+    def test_ranked_search_limit_in_sql(self):
+        queryset = self.search('хостинг')
+        # Сортировка по bm25 и LIMIT - в SQL: запрос id с рангами и запрос самих транзакций
+        with self.assertNumQueries(2):
+            self.assertEqual(search.ranked_search(queryset, 'хостинг', 1), [self.hosting_twice])
+
+        # Транзакцию удалили между запросами - она просто пропускается
+        ranked = search.sqlite_ranked(connection, queryset, search.fts5_query('хостинг'), 2)
+        self.hosting_twice.delete()
+        with mock.patch.object(search, 'sqlite_ranked', return_value=ranked):
+            self.assertEqual(search.ranked_search(queryset, 'хостинг', 2), [self.hosting])
+
+    def test_list_and_stats(self):
+        results = self.client.get('/backend/api/transactions/', {'search': 'хостинг'}).json()['results']
+        self.assertEqual([item['id'] for item in results], [self.hosting.pk, self.hosting_twice.pk])
+
+        # Комментариев в агрегатах нет - статистика с поиском считается по транзакциям
+        self.assertFalse(TransactionRollupFilter.supports({'search': 'хостинг'}))
+        stats = self.client.get('/backend/api/transactions/stats/', {'search': 'хостинг'}).json()
+        self.assertEqual(stats['transaction_count'], 2)
+        self.assertEqual(Decimal(str(stats['total_expense'])), Decimal('900.00'))
+
+
+class RunningBalanceTests(LedgerTestCase):
+    """Нарастающий остаток по контрольным точкам"""
+
+    def expected_balances(self, status_ids=None):
+        transactions = Transaction.objects.order_by('date', 'created_at', 'id')
+        if status_ids:
+            transactions = transactions.filter(status_id__in=status_ids)
+        balance, result = Decimal('0'), {}
+        for transaction in transactions:
+            balance += transaction.amount if transaction.transaction_type_id == self.income.pk else -transaction.amount
+            result[transaction.pk] = balance
+        return result
+
+    def api_balances(self, **params):
+        balances = {}
+        response = self.client.get('/backend/api/transactions/', {'balance': 'true', 'page_size': 3, **params})
+        while True:
+            data = response.json()
+            balances.update({item['id']: Decimal(str(item['balance'])) for item in data['results']})
+            if not data['next']:
+                return balances
+            response = self.client.get(data['next'])
+
+    def test_api_balances(self):
+        self.assertEqual(self.api_balances(), self.expected_balances())
+        self.assertEqual(self.api_balances(status=self.personal.pk), self.expected_balances([self.personal.pk]))
+
+        item = self.client.get('/backend/api/transactions/').json()['results'][0]
+        self.assertNotIn('balance', item)
+
+    def yesterday_total(self):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        return BalanceCheckpoint.objects.filter(day=yesterday).aggregate(total=Sum('balance'))['total']
+
+    def test_back_dated_writes_shift_checkpoints(self):
+        before = self.yesterday_total()
+        # Точки сдвигаются в транзакции записи, а не on_commit
+        with CaptureQueriesContext(connection) as queries:
+            transaction = Transaction.objects.create(
+                date=timezone.now() - timedelta(days=5),
+                status=self.personal,
+                transaction_type=self.income,
+                category=self.salary,
+                amount=Decimal('100.00'),
+            )
+        # Один UPDATE на статус, независимо от числа дней после записи
+        self.assertEqual(
+            [query['sql'].split()[0] for query in queries if 'balancecheckpoint' in query['sql']], ['SELECT', 'UPDATE']
+        )
+        self.assertEqual(self.yesterday_total() - before, Decimal('100.00'))
+        self.assertEqual(self.api_balances(), self.expected_balances())
+
+        transaction.transaction_type = self.expense
+        transaction.category = self.vps
+        with self.captureOnCommitCallbacks(execute=True):
+            transaction.save()
+        self.assertEqual(self.api_balances(), self.expected_balances())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            transaction.delete()
+        self.assertEqual(self.yesterday_total(), before)
+        self.assertCheckpointsMatchRebuild()
+
+    def test_failed_shift_rolls_back_write(self):
+        checkpoints = self.checkpoints()
+        rollup_rows = set(TransactionDailyRollup.objects.values_list('day', 'status_id', 'total', 'count'))
+        with (
+            mock.patch.object(balances, '_shift_status', side_effect=OperationalError('lock timeout')),
+            self.assertRaises(OperationalError),
+        ):
+            Transaction.objects.create(
+                date=timezone.now() - timedelta(days=5),
+                status=self.personal,
+                transaction_type=self.income,
+                category=self.salary,
+                amount=Decimal('100.00'),
+            )
+        self.assertEqual(Transaction.objects.filter(amount=Decimal('100.00')).count(), 0)
+        self.assertEqual(
+            set(TransactionDailyRollup.objects.values_list('day', 'status_id', 'total', 'count')), rollup_rows
+        )
+        self.assertEqual(self.checkpoints(), checkpoints)
+
+    def test_write_before_first_checkpoint(self):
+        # Новый статус и день раньше всех точек: недостающие точки создаются
+        archive = Status.objects.create(name='Архив')
+        with self.captureOnCommitCallbacks(execute=True):
+            Transaction.objects.create(
+                date=timezone.now() - timedelta(days=20),
+                status=archive,
+                transaction_type=self.expense,
+                category=self.vps,
+                amount=Decimal('10.00'),
+            )
+        self.assertEqual(BalanceCheckpoint.objects.filter(status=archive).count(), 20)
+        self.assertCheckpointsMatchRebuild()
+        self.assertEqual(self.api_balances(), self.expected_balances())
+
+    def test_checkpoints_match_rebuild(self):
+        self.assertTrue(BalanceCheckpoint.objects.exists())
+        self.assertCheckpointsMatchRebuild()
+
+    def test_missing_days_are_not_written_on_read(self):
+        # Смена суток: точек за последние дни ещё нет, остаток досчитывается по агрегатам
+        checkpoints = self.checkpoints()
+        BalanceCheckpoint.objects.filter(day__gte=timezone.localdate() - timedelta(days=3)).delete()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.api_balances(), self.expected_balances())
+            self.client.get('/')
+        self.assertEqual([query['sql'] for query in queries if not query['sql'].startswith('SELECT')], [])
+        self.assertFalse(BalanceCheckpoint.objects.filter(day=timezone.localdate() - timedelta(days=1)).exists())
+
+        out = StringIO()
+        call_command('fill_balance_checkpoints', stdout=out)
+        self.assertIn('достроены: 6 строк', out.getvalue())
+        self.assertEqual(self.checkpoints(), checkpoints)
+        # Повторный запуск ничего не добавляет
+        self.assertEqual(balances.fill(), 0)
+
+    def test_home_page(self):
+        response = self.client.get('/')
+        balance = self.expected_balances()[Transaction.objects.order_by('-date', '-created_at', '-id').first().pk]
+        self.assertContains(response, f'{formats.localize(balance)} ₽')
+
+
+class BulkWriteTests(LedgerTestCase):
+    """Массовое изменение и удаление транзакций"""
+
+    def post(self, path, payload):
+        # Кеши сбрасываются on_commit после отправки transactions_changed
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/backend/api/transactions/{path}/', payload, content_type='application/json')
+
+    def assertRollupsConsistent(self):
+        current = set(TransactionDailyRollup.objects.values_list('day', 'status_id', 'category_id', 'total', 'count'))
+        rollups.rebuild()
+        self.assertEqual(
+            set(TransactionDailyRollup.objects.values_list('day', 'status_id', 'category_id', 'total', 'count')),
+            current,
+        )
+
+    def test_update_by_filter(self):
+        hosting = Category.objects.create(name='Хостинг', transaction_type=self.expense, parent=self.infrastructure)
+        self.client.get('/backend/api/transactions/')
+
+        response = self.post(
+            'bulk-update',
+            {
+                'filter': {'category': self.vps.pk},
+                'changes': {'category': hosting.pk, 'comment': 'перенос'},
+                'chunk_size': 3,
+            },
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json(), {'updated': 10})
+        self.assertEqual(Transaction.objects.filter(category=hosting, comment='перенос').count(), 10)
+        self.assertFalse(Transaction.objects.filter(category=self.vps).exists())
+        self.assertRollupsConsistent()
+
+        response = self.client.get('/backend/api/transactions/', {'category': hosting.pk})
+        self.assertEqual(len(response.json()['results']), 10)
+
+    def test_update_by_ids_changes_status_and_balances(self):
+        ids = list(Transaction.objects.filter(status=self.personal).values_list('pk', flat=True))
+        response = self.post('bulk-update', {'ids': ids, 'changes': {'status': self.business.pk}})
+        self.assertEqual(response.json(), {'updated': len(ids)})
+        self.assertFalse(Transaction.objects.filter(status=self.personal).exists())
+        self.assertRollupsConsistent()
+
+        self.assertCheckpointsMatchRebuild()
+
+    def test_category_checked_against_selection(self):
+        # Расходная категория для выборки, в которой есть пополнения
+        response = self.post(
+            'bulk-update', {'filter': {'status': self.business.pk}, 'changes': {'category': self.vps.pk}}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('changes', response.json())
+        self.assertEqual(Transaction.objects.filter(category=self.salary).count(), 10)
+
+        response = self.post(
+            'bulk-update', {'filter': {'category': self.vps.pk}, 'changes': {'category': self.infrastructure.pk}}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_delete_by_filter(self):
+        response = self.post('bulk-delete', {'filter': {'transaction_type': self.expense.pk}, 'chunk_size': 4})
+        self.assertEqual(response.json(), {'deleted': 10})
+        self.assertFalse(Transaction.objects.filter(transaction_type=self.expense).exists())
+        self.assertEqual(Transaction.objects.count(), 10)
+        self.assertRollupsConsistent()
+
+    def test_rows_changed_after_selection(self):
+        # Пачка выбрана, но до записи одну строку поменяли, а другую удалили: изменения агрегатов
+        # считаются по заблокированным строкам, а не по выборке
+        selection = bulk.Selection(ids=list(Transaction.objects.filter(category=self.vps).values_list('pk', flat=True)))
+        rows = next(selection.chunks(100))
+        changed = Transaction.objects.get(pk=rows[0][1])
+        changed.amount = Decimal('999.99')
+        changed.save()
+        Transaction.objects.get(pk=rows[1][1]).delete()
+
+        with (
+            mock.patch.object(bulk.Selection, 'chunks', return_value=iter([rows])),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            self.assertEqual(bulk.delete_transactions(selection), 9)
+        self.assertFalse(Transaction.objects.filter(category=self.vps).exists())
+        self.assertRollupsConsistent()
+        self.assertCheckpointsMatchRebuild()
+
+    def test_invalid_selection(self):
+        cases = [
+            {},
+            {'filter': {}},
+            {'filter': {'status': 'abc'}},
+            {'ids': [1], 'filter': {'status': self.business.pk}},
+            {'ids': []},
+        ]
+        for payload in cases:
+            with self.subTest(payload=payload):
+                self.assertEqual(self.post('bulk-delete', payload).status_code, 400)
+        self.assertEqual(self.post('bulk-update', {'ids': [1], 'changes': {}}).status_code, 400)
+        self.assertEqual(Transaction.objects.count(), 20)
+
+
+class MinorUnitsTests(LedgerTestCase):
+    """Расчёт в целых копейках (AMOUNT_MINOR_UNITS) совпадает с расчётом в Decimal"""
+
+    # Суммы, которые не представимы точно в float
+    AMOUNTS = ('0.01', '0.07', '0.10', '0.29', '1.15', '33.33', '1000.07', '9999999999.99')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        for days, amount in enumerate(cls.AMOUNTS):
+            for transaction_type, category in ((cls.income, cls.salary), (cls.expense, cls.vps)):
+                Transaction.objects.create(
+                    date=now - timedelta(days=days, hours=1),
+                    status=cls.personal,
+                    transaction_type=transaction_type,
+                    category=category,
+                    amount=Decimal(amount),
+                )
+
+    def both_ways(self, compute):
+        """Результат compute() в Decimal и в копейках"""
+        results = []
+        for enabled in (False, True):
+            caches['responses'].clear()
+            with self.settings(AMOUNT_MINOR_UNITS=enabled):
+                results.append(compute())
+        return results
+
+    def test_conversion(self):
+        self.assertEqual(str(money.to_decimal(0)), '0.00')
+        self.assertEqual(str(money.to_decimal(-7)), '-0.07')
+        self.assertEqual(str(money.to_decimal(Decimal(999999999999))), '9999999999.99')
+        for amount in self.AMOUNTS:
+            self.assertEqual(money.to_decimal(money.to_minor(Decimal(amount))), Decimal(amount))
+
+    def test_stats(self):
+        for params in (
+            {},
+            {'group_by': 'category'},
+            {'period': 'day', 'group_by': 'status'},
+            {'group_by': 'category_tree'},
+            # Фильтр по сумме - статистика по транзакциям, а не по дневным агрегатам
+            {'amount_min': '0.05', 'period': 'month'},
+        ):
+            with self.subTest(params=params):
+                decimal_stats, minor_stats = self.both_ways(
+                    lambda params=params: self.client.get('/backend/api/transactions/stats/', params).content
+                )
+                self.assertEqual(json.loads(minor_stats), json.loads(decimal_stats))
+
+    def test_rollups(self):
+        decimal_deltas, minor_deltas = self.both_ways(
+            lambda: dict(rollups.deltas_for_queryset(Transaction.objects.all()))
+        )
+        self.assertEqual(minor_deltas, decimal_deltas)
+
+        with self.settings(AMOUNT_MINOR_UNITS=True):
+            rollups.rebuild()
+            balances.rebuild()
+        totals = set(TransactionDailyRollup.objects.values_list(*rollups.ROLLUP_KEY_FIELDS, 'total', 'count'))
+        checkpoints = set(BalanceCheckpoint.objects.values_list('day', 'status_id', 'balance'))
+        rollups.rebuild()
+        balances.rebuild()
+        self.assertEqual(
+            set(TransactionDailyRollup.objects.values_list(*rollups.ROLLUP_KEY_FIELDS, 'total', 'count')), totals
+        )
+        self.assertEqual(set(BalanceCheckpoint.objects.values_list('day', 'status_id', 'balance')), checkpoints)
+
+    def test_running_balances(self):
+        transactions = list(Transaction.objects.all())
+        decimal_balances, minor_balances = self.both_ways(lambda: balances.running_balances(transactions))
+        self.assertEqual(minor_balances, decimal_balances)
+        self.assertEqual({balance.as_tuple().exponent for balance in minor_balances.values()}, {-2})
+
+    def test_export(self):
+        for file_format in ('csv', 'jsonl'):
+            with self.subTest(file_format=file_format):
+                decimal_export, minor_export = self.both_ways(
+                    lambda file_format=file_format: b''.join(
+                        self.client.get('/backend/api/transactions/export/', {'file_format': file_format})
+                    )
+                )
+                self.assertEqual(minor_export, decimal_export)
+                self.assertIn(b'9999999999.99', minor_export)
+
+
+class AnalyticsSnapshotTests(LedgerTestCase):
+    """Колоночный снимок и сводные отчёты по нему"""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = self.settings(ANALYTICS_SNAPSHOT_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def snapshot_rows(self):
+        snapshot = analytics.get_snapshot()
+        return sorted(zip(*(snapshot.columns[name].tolist() for name in analytics.COLUMNS), strict=True))
+
+    def expected_rows(self):
+        return sorted(
+            (
+                transaction.pk,
+                (rollups.rollup_day(transaction.date) - analytics.EPOCH).days,
+                transaction.status_id,
+                transaction.transaction_type_id,
+                transaction.category_id,
+                money.to_minor(transaction.amount),
+            )
+            for transaction in Transaction.objects.all()
+        )
+
+    def test_refresh_follows_writes(self):
+        analytics.refresh()
+        self.assertEqual(self.snapshot_rows(), self.expected_rows())
+
+        created = Transaction.objects.create(
+            date=timezone.now() - timedelta(days=40),
+            status=self.business,
+            transaction_type=self.expense,
+            category=self.vps,
+            amount=Decimal('0.07'),
+        )
+        updated = Transaction.objects.filter(category=self.salary).first()
+        updated.status = self.business
+        updated.save()
+        # Удаление не меняет updated_at оставшихся строк - его находит сверка с дневными агрегатами
+        Transaction.objects.filter(pk=Transaction.objects.exclude(pk__in=[created.pk, updated.pk]).first().pk).delete()
+
+        analytics.refresh()
+        self.assertEqual(self.snapshot_rows(), self.expected_rows())
+        self.assertEqual(analytics.get_snapshot().meta['rows'], Transaction.objects.count())
+
+    def test_pivot_matches_database(self):
+        analytics.refresh()
+        snapshot = analytics.get_snapshot()
+
+        report = analytics.pivot(snapshot, 'category', measure='expense')
+        expected = dict(
+            Transaction.objects.filter(transaction_type=self.expense)
+            .values('category_id')
+            .annotate(total=Sum('amount'))
+            .values_list('category_id', 'total')
+        )
+        self.assertEqual({item['key']: item['total'] for item in report['results'] if item['total']}, expected)
+
+        report = analytics.pivot(snapshot, 'status', 'day', measure='count', filters={'category': self.salary.pk})
+        self.assertEqual(report['total'], 10)
+        self.assertEqual(sum(report['column_totals']), 10)
+        self.assertEqual([item['name'] for item in report['results']], ['Бизнес', 'Личное'])
+
+        report = analytics.pivot(snapshot, 'transaction_type', top=1)
+        self.assertEqual(len(report['results']), 1)
+        self.assertEqual(report['results'][0]['key'], self.income.pk)
+
+    def test_api(self):
+        url = '/backend/api/reports/pivot/'
+        self.assertEqual(self.client.get(url).status_code, 503)
+        # Построение заново - только командой, API обновляет снимок инкрементально
+        self.assertEqual(self.client.post('/backend/api/reports/snapshot/').status_code, 503)
+        call_command('refresh_analytics_snapshot', stdout=StringIO())
+        self.assertEqual(self.client.post('/backend/api/reports/snapshot/', QUERY_STRING='full=true').status_code, 400)
+        self.assertEqual(self.client.post('/backend/api/reports/snapshot/').status_code, 200)
+
+        data = self.client.get(
+            url, {'rows': 'category', 'columns': 'month', 'category_subtree': self.infrastructure.pk}
+        ).json()
+        self.assertEqual([item['key'] for item in data['results']], [self.vps.pk])
+        self.assertEqual(Decimal(str(data['total'])), Decimal('-2505.00'))
+        self.assertEqual(data['snapshot']['rows'], 20)
+
+        for params in ({'rows': 'comment'}, {'measure': 'median'}, {'amount_min': 5}, {'top': 'x'}, {'top': -1}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+    def test_without_numpy(self):
+        analytics.refresh()
+        unavailable = analytics.SnapshotUnavailable('Для аналитических отчётов установите пакет numpy')
+        with mock.patch.object(analytics, '_numpy', side_effect=unavailable):
+            for method, url in (
+                ('get', '/backend/api/reports/pivot/'),
+                ('get', '/backend/api/reports/snapshot/'),
+                ('post', '/backend/api/reports/snapshot/'),
+            ):
+                with self.subTest(method=method, url=url):
+                    response = getattr(self.client, method)(url)
+                    self.assertEqual(response.status_code, 503)
+                    self.assertEqual(response.json(), {'detail': str(unavailable)})
+            with self.assertRaisesMessage(CommandError, 'numpy'):
+                call_command('refresh_analytics_snapshot', stdout=StringIO())
+
+
+class CashflowReportTests(LedgerTestCase):
+    """Отчёт ДДС: подытоги по дереву категорий, чистый поток, CSV и кеш"""
+
+    url = '/backend/api/reports/cashflow/'
+
+    def section(self, report, transaction_type):
+        return next(section for section in report['sections'] if section['transaction_type'] == transaction_type.pk)
+
+    def test_tree_subtotals(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum('GROUP BY' in query['sql'] for query in queries.captured_queries), 1)
+        report = response.json()
+
+        (infrastructure,) = self.section(report, self.expense)['rows']
+        (vps,) = infrastructure['children']
+        self.assertEqual(infrastructure['name'], 'Инфраструктура')
+        self.assertEqual(infrastructure['values'], vps['values'])
+        self.assertEqual(Decimal(str(infrastructure['total'])), Decimal('2505.00'))
+        self.assertEqual(infrastructure['transaction_count'], 10)
+
+        income = self.section(report, self.income)
+        self.assertEqual(Decimal(str(income['total'])), Decimal('10045.00'))
+        self.assertEqual(Decimal(str(report['net']['total'])), Decimal('7540.00'))
+        self.assertEqual(len(report['net']['values']), len(report['months']))
+
+    def test_filters_and_empty_months(self):
+        today = timezone.localdate()
+        date_from = today - timedelta(days=70)
+        response = self.client.get(self.url, {'date_from': date_from.isoformat(), 'status': self.business.pk})
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual(report['months'][0], f'{date_from:%Y-%m}')
+        self.assertEqual(report['months'][-1], f'{today:%Y-%m}')
+        self.assertEqual(report['net']['values'][0], 0)
+
+        expected = Transaction.objects.filter(status=self.business, transaction_type=self.income).aggregate(
+            total=Sum('amount')
+        )['total']
+        self.assertEqual(Decimal(str(self.section(report, self.income)['total'])), expected)
+
+    def test_csv_and_cache(self):
+        response = self.client.get(self.url, {'file_format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        content = response.content.decode('utf-8-sig')
+        self.assertIn('  VPS', content)
+        self.assertIn('Чистый денежный поток', content)
+        self.assertIn('7540.00', content)
+
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+
+    def test_invalid_params(self):
+        self.assertEqual(self.client.get(self.url, {'file_format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'date_from': 'вчера'}).status_code, 400)
+        self.assertEqual(
+            self.client.get(self.url, {'date_from': '2000-01-01', 'date_to': '2026-01-01'}).status_code, 400
+        )
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTests(LedgerTestCase):
+    """Метрики запросов в формате Prometheus"""
+
+    url = '/backend/metrics/'
+    auth = {'Authorization': 'Bearer secret'}
+
+    def sample(self, line):
+        """Значение метрики по строке до значения; 0, если метрики ещё нет"""
+        for row in self.client.get(self.url, headers=self.auth).content.decode().splitlines():
+            if row.startswith(line + ' '):
+                return float(row.rsplit(' ', 1)[1])
+        return 0
+
+    def test_request_metrics(self):
+        labels = 'view="transit_managment:transaction-list",method="GET"'
+        requests_before = self.sample(f'transit_http_requests_total{{{labels},status="200"}}')
+        queries_before = self.sample(f'transit_http_request_db_queries_count{{{labels}}}')
+        hits_before = self.sample(
+            'transit_http_response_cache_total{view="transit_managment:transaction-list",result="hit"}'
+        )
+
+        self.client.get('/backend/api/transactions/')
+        self.client.get('/backend/api/transactions/')
+
+        self.assertEqual(self.sample(f'transit_http_requests_total{{{labels},status="200"}}'), requests_before + 2)
+        self.assertEqual(self.sample(f'transit_http_request_db_queries_count{{{labels}}}'), queries_before + 2)
+        self.assertGreater(self.sample(f'transit_http_request_db_queries_sum{{{labels}}}'), 0)
+        self.assertGreater(self.sample(f'transit_http_response_size_bytes_sum{{{labels}}}'), 0)
+        self.assertEqual(
+            self.sample('transit_http_response_cache_total{view="transit_managment:transaction-list",result="hit"}'),
+            hits_before + 1,
+        )
+        self.assertGreaterEqual(self.sample('transit_response_cache_hits_total{kind="list"}'), 1)
+
+    def test_merge_and_render(self):
+        first, second = metrics.Registry(), metrics.Registry()
+        first.record('list', 'GET', 200, 0.02, size=100)
+        second.record('list', 'GET', 200, 3, size=100, cache_result='hit')
+        text = metrics.render(metrics.merge([first.snapshot(), second.snapshot()]))
+
+        self.assertIn('transit_http_requests_total{view="list",method="GET",status="200"} 2', text)
+        self.assertIn('transit_http_request_duration_seconds_bucket{view="list",method="GET",le="0.025"} 1', text)
+        self.assertIn('transit_http_request_duration_seconds_bucket{view="list",method="GET",le="+Inf"} 2', text)
+        self.assertIn('transit_http_request_duration_seconds_count{view="list",method="GET"} 2', text)
+        self.assertIn('transit_http_response_cache_total{view="list",result="hit"} 1', text)
+
+    async def test_async_view_queries(self):
+        labels = 'view="transit_managment:async_transaction_list",method="GET"'
+        count, total = (f'transit_http_request_db_queries_{suffix}{{{labels}}}' for suffix in ('count', 'sum'))
+        count_before, total_before = await sync_to_async(self.sample)(count), await sync_to_async(self.sample)(total)
+
+        response = await self.async_client.get('/backend/api/async/transactions/?page_size=5')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(await sync_to_async(self.sample)(count), count_before + 1)
+        self.assertGreater(await sync_to_async(self.sample)(total), total_before)
+
+    def test_token(self):
+        response = self.client.get(self.url, headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+        for headers in ({}, {'Authorization': 'Bearer wrong'}, {'Authorization': 'Basic secret'}):
+            response = self.client.get(self.url, headers=headers)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+        # Без токена в настройках эндпоинт выключен
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get(self.url, headers=self.auth).status_code, 404)
+
+
+class PartitioningTests(TestCase):
+    """Помесячные секции: имена, границы и разбор плана; сама схема проверяется только в PostgreSQL"""
+
+    def test_month_partitions(self):
+        month = date(2026, 2, 14)
+        self.assertEqual(partitions.partition_name(month), 'transit_managment_transaction_y2026m02')
+        start, end = partitions.month_bounds(month)
+        self.assertEqual(
+            (timezone.localtime(start).date(), timezone.localtime(end).date()), (date(2026, 2, 1), date(2026, 3, 1))
+        )
+        self.assertEqual(partitions.next_month(date(2026, 12, 31)), date(2027, 1, 1))
+
+    def test_month_bounds(self):
+        start, end = partitions.month_bounds(date(2026, 12, 31))
+        self.assertTrue(timezone.is_aware(start) and timezone.is_aware(end))
+        self.assertEqual(
+            (timezone.localtime(start), timezone.localtime(end)),
+            (
+                timezone.make_aware(datetime(2026, 12, 1)),
+                timezone.make_aware(datetime(2027, 1, 1)),
+            ),
+        )
+        # Соседние месяцы стыкуются без зазора: граница - полуинтервал [начало, начало следующего)
+        self.assertEqual(partitions.month_bounds(date(2027, 1, 15))[0], end)
+        self.assertEqual(partitions.month_bounds(date(2026, 12, 1)), (start, end))
+
+    def test_expected_partitions(self):
+        existing = {'transit_managment_transaction_y2026m01', 'transit_managment_transaction_y2026m02'}
+        self.assertEqual(
+            partitions.expected_partitions(date(2026, 1, 20), date(2026, 2, 3), existing),
+            existing,
+        )
+        self.assertEqual(
+            partitions.expected_partitions(date(2025, 12, 1), date(2026, 1, 1), existing),
+            {'transit_managment_transaction_default', 'transit_managment_transaction_y2026m01'},
+        )
+        # Месяцы без секции читаются только из DEFAULT
+        self.assertEqual(
+            partitions.expected_partitions(date(2025, 10, 1), date(2025, 11, 30), existing),
+            {'transit_managment_transaction_default'},
+        )
+
+    def test_scanned_partitions(self):
+        plan = (
+            'Append  (cost=0.15..16.36 rows=4 width=94)\n'
+            '  ->  Index Scan using transit_managment_transaction_y2026m01_date_created_at_idx '
+            'on transit_managment_transaction_y2026m01 transit_managment_transaction_1\n'
+            '  ->  Seq Scan on transit_managment_transaction_default transit_managment_transaction_2'
+        )
+        self.assertEqual(
+            partitions.scanned_partitions(plan),
+            {'transit_managment_transaction_y2026m01', 'transit_managment_transaction_default'},
+        )
+        # Индексы секций и таблица *_old не считаются секциями
+        self.assertEqual(
+            partitions.scanned_partitions(
+                'Index Scan using transit_managment_transaction_y2026m01_date_idx on transit_managment_transaction_old'
+            ),
+            set(),
+        )
+
+    def test_command(self):
+        out = StringIO()
+        call_command('partition_transactions', stdout=out)
+        self.assertIn('выключено', out.getvalue())
+
+        with override_settings(TRANSACTION_PARTITIONING=True):
+            for args in (['--convert'], [], ['--verify']):
+                with self.subTest(args=args), self.assertRaisesMessage(CommandError, 'PostgreSQL'):
+                    call_command('partition_transactions', *args, stdout=StringIO())
+
+            # Периодическая задача не завершается с ошибкой (supervisor перезапускал бы её в цикле), а ждёт
+            err = StringIO()
+            with (
+                mock.patch(
+                    'transit_managment.management.commands.partition_transactions.time.sleep',
+                    side_effect=[None, KeyboardInterrupt],
+                ),
+                self.assertRaises(KeyboardInterrupt),
+            ):
+                call_command('partition_transactions', '--interval', '60', stdout=StringIO(), stderr=err)
+            self.assertEqual(err.getvalue().count('PostgreSQL'), 2)
+
+    def test_partitions_require_postgresql(self):
+        month = date(2026, 1, 1)
+        with self.assertRaisesMessage(partitions.PartitioningError, 'sqlite'):
+            partitions.ensure_partitions(connection, month, month)
+        with self.assertRaisesMessage(partitions.PartitioningError, 'sqlite'):
+            partitions.create_partition(connection, month)
@@ -1,7 +1,7 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from . import views
+from . import async_views, views
 
 app_name = 'transit_managment'
 
@@ -10,9 +10,20 @@ router.register('statuses', views.StatusViewSet)
 router.register('transaction-types', views.TransactionTypeViewSet)
 router.register('categories', views.CategoryViewSet)
 router.register('transactions', views.TransactionViewSet)
+router.register('reports', views.ReportViewSet, basename='report')
+
+# Асинхронные варианты эндпоинтов чтения - для запуска под ASGI
+async_urlpatterns = [
+    path('transactions/', async_views.transaction_list, name='async_transaction_list'),
+    path('transactions/stats/', async_views.transaction_stats, name='async_transaction_stats'),
+    path('transactions/<int:pk>/', async_views.transaction_detail, name='async_transaction_detail'),
+    path('categories/tree/', async_views.category_tree, name='async_category_tree'),
+]
 
 urlpatterns = [
+    path('backend/api/async/', include(async_urlpatterns)),
     path('backend/api/', include(router.urls)),
+    path('backend/metrics/', views.prometheus_metrics, name='metrics'),
     path('', views.home, name='home'),
     path('transaction/create/', views.transaction_create, name='transaction_create'),
     path('transaction/<int:pk>/edit/', views.transaction_edit, name='transaction_edit'),
@@ -1,59 +1,103 @@
+import hmac
 import logging
 
+from django.conf import settings
 from django.contrib import messages
-from django.core.paginator import Paginator
-from django.db.models import Sum
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from rest_framework import viewsets
+from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
-from transit_managment.filters import TransactionFilter
-
+from transit_managment.filters import FilterParamsError, TransactionFilter, validated_qs
+
+from . import analytics, metrics
+from .balances import balance_scope, running_balances
+from .bulk import Selection, change_errors, delete_transactions, update_transactions
+from .cashflow import FORMATS as CASHFLOW_FORMATS
+from .cashflow import CashflowParamsError, compute_cashflow, csv_response
+from .category_tree import get_category_tree
+from .exports import FORMATS as EXPORT_FORMATS
+from .exports import ExportUnavailable, export_response
+from .http_cache import ConditionalGetMixin, revalidate_cache_control
+from .importers import FORMATS as IMPORT_FORMATS
+from .importers import TransactionImporter, detect_format
 from .models import Category, Status, Transaction, TransactionType
+from .pagination import (
+    KEYSET_ORDERING,
+    InvalidCursor,
+    TransactionCursorPagination,
+    count_queryset,
+    keyset_page,
+    page_querystring,
+    parse_page_size,
+)
+from .references import get_references
+from .response_cache import CASHFLOW_CACHE, LIST_CACHE, STATS_CACHE, normalize_filters
+from .response_cache import metrics as response_cache_metrics
+from .search import DEFAULT_SEARCH_RESULTS, MAX_SEARCH_RESULTS, ranked_search
 from .serializers import (
     CategorySerializer,
-    CategoryTreeSerializer,
     StatusSerializer,
+    TransactionBulkUpdateSerializer,
     TransactionCreateUpdateSerializer,
+    TransactionImportParamsSerializer,
+    TransactionSelectionSerializer,
     TransactionSerializer,
     TransactionTypeSerializer,
 )
+from .stats import (
+    CATEGORY_TREE,
+    StatsParamsError,
+    category_root_id,
+    compute_stats,
+    parse_grouping,
+    resolve_type_ids,
+    rollup_category_tree,
+    stats_source,
+)
 
 logger = logging.getLogger('default')
 
+HOME_PAGE_SIZE = 20
+TRUE_VALUES = ('1', 'true', 'yes')
 
-class StatusViewSet(viewsets.ModelViewSet):
+
+class StatusViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet для управления статусами"""
 
+    etag_versions = ('status',)
     queryset = Status.objects.all()
     serializer_class = StatusSerializer
     permission_classes = [AllowAny]
 
 
-class TransactionTypeViewSet(viewsets.ModelViewSet):
+class TransactionTypeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet для управления типами операций"""
 
+    etag_versions = ('transaction_type',)
     queryset = TransactionType.objects.all()
     serializer_class = TransactionTypeSerializer
     permission_classes = [AllowAny]
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet для управления категориями"""
 
-    queryset = Category.objects.all()
+    # В ответе есть название типа операции
+    etag_versions = ('category', 'transaction_type')
+    conditional_actions = ('list', 'retrieve', 'tree', 'by_type')
+    queryset = Category.objects.select_related('transaction_type', 'parent')
     serializer_class = CategorySerializer
     permission_classes = [AllowAny]
 
     @action(detail=False, methods=['get'])
     def tree(self, request):
-        """Получение дерева категорий"""
-        root_categories = Category.objects.filter(parent=None)
-        serializer = CategoryTreeSerializer(root_categories, many=True, context={'request': request})
-        return Response(serializer.data)
+        """Получение дерева категорий (из кеша, построенного одним запросом)"""
+        return Response(get_category_tree().as_tree())
 
     @action(detail=False, methods=['get'])
     def by_type(self, request):
@@ -66,62 +110,268 @@ class CategoryViewSet(viewsets.ModelViewSet):
         return Response([])
 
 
-class TransactionViewSet(viewsets.ModelViewSet):
+class TransactionViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """ViewSet для управления транзакциями"""
 
+    # Версия transaction сбрасывается при любом изменении транзакций, справочники - ради названий в ответе
+    etag_versions = ('transaction', 'status', 'transaction_type', 'category')
+    conditional_actions = ('list', 'retrieve', 'stats')
+    cache_control = staticmethod(revalidate_cache_control)
     queryset = Transaction.objects.all()
     permission_classes = [AllowAny]
+    pagination_class = TransactionCursorPagination
 
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
             return TransactionCreateUpdateSerializer
         return TransactionSerializer
 
+    def list(self, request, *args, **kwargs):
+        """Список транзакций; страницы с частыми фильтрами отдаются из кеша ответов
+
+        С balance=true у каждой транзакции есть поле balance - остаток после операции
+        (по статусам из фильтра status / status__in, иначе по всем).
+        """
+
+        def compute():
+            data = super(TransactionViewSet, self).list(request).data
+            if request.query_params.get('balance') in TRUE_VALUES:
+                balances = running_balances(self.paginator.page.items, balance_scope(request.query_params))
+                for item in data['results']:
+                    item['balance'] = balances.get(item['id'])
+            return data
+
+        data, hit = LIST_CACHE.get_or_compute(request, compute)
+        return Response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+
     def get_queryset(self):
         """Фильтрация транзакций"""
+        # Названия справочников сериализатор берёт из get_references(), JOIN не нужен
         queryset = Transaction.objects.all()
-        transaction_filter = TransactionFilter(self.request.query_params, queryset=queryset)
-        queryset = transaction_filter.qs
+        try:
+            queryset = validated_qs(TransactionFilter(self.request.query_params, queryset=queryset))
+        except FilterParamsError as e:
+            raise ValidationError(e.errors)
+
+        return queryset.order_by(*KEYSET_ORDERING)
+
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[MultiPartParser])
+    def bulk(self, request):
+        """Массовый импорт транзакций из CSV или JSON Lines
+
+        Файл передаётся в поле file (multipart) либо телом запроса с Content-Type text/csv
+        или application/x-ndjson. Параметры: file_format=csv|jsonl, chunk_size.
+        """
+        if request.content_type.startswith('multipart/'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                return Response({'detail': 'Не передан файл (поле file)'}, status=status.HTTP_400_BAD_REQUEST)
+            stream, filename = upload.file, upload.name
+        else:
+            stream, filename = request.stream, ''
+
+        fmt = request.query_params.get('file_format') or detect_format(filename, request.content_type)
+        if fmt not in IMPORT_FORMATS:
+            return Response(
+                {'detail': f'Неизвестный формат. Допустимые значения: {", ".join(IMPORT_FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        params = TransactionImportParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+
+        if stream is None:
+            return Response({'detail': 'Пустое тело запроса'}, status=status.HTTP_400_BAD_REQUEST)
+        # Пачки, записанные до ошибки БД, уже зафиксированы, поэтому в ответе - отчёт и при сбое пачки
+        result = TransactionImporter(chunk_size=params.validated_data['chunk_size']).run(stream, fmt)
+        return Response(result.as_dict())
+
+    @action(detail=False, methods=['post'], url_path='bulk-update')
+    def bulk_update(self, request):
+        """Массовое изменение транзакций
+
+        Тело: ids - список id или filter - параметры фильтрации как у списка, changes - новые значения
+        status, transaction_type, category, comment; chunk_size - размер пачки. Ответ: updated - число строк.
+        """
+        serializer = TransactionBulkUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        selection = Selection(ids=data.get('ids'), filters=data.get('filter'))
+        errors = change_errors(selection, data['changes'])
+        if errors:
+            return Response({'changes': errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'updated': update_transactions(selection, data['changes'], data['chunk_size'])})
+
+    @action(detail=False, methods=['post'], url_path='bulk-delete')
+    def bulk_delete(self, request):
+        """Массовое удаление транзакций
+
+        Тело: ids - список id или filter - параметры фильтрации как у списка; chunk_size - размер пачки.
+        Ответ: deleted - число удалённых строк.
+        """
+        serializer = TransactionSelectionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        selection = Selection(ids=data.get('ids'), filters=data.get('filter'))
+        return Response({'deleted': delete_transactions(selection, data['chunk_size'])})
 
-        return queryset.order_by('-date', '-created_at')
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Потоковая выгрузка отфильтрованных транзакций
+
+        Параметры фильтрации - как у списка, file_format=csv|jsonl|xlsx
+        """
+        fmt = request.query_params.get('file_format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return Response(
+                {'detail': f'Неизвестный формат. Допустимые значения: {", ".join(EXPORT_FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            return export_response(self.get_queryset(), fmt)
+        except ExportUnavailable as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=False, methods=['get'])
     def stats(self, request):
-        """Получение статистики по транзакциям"""
-        queryset = self.get_queryset()
+        """Получение статистики по транзакциям
+
+        Параметры: period=day|week|month и group_by=status|category|transaction_type|category_tree
+        (category_tree - дерево категорий с итогами по каждому узлу, включая потомков)
+        """
+        try:
+            period, group_by = parse_grouping(request.query_params)
+        except StatsParamsError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        def compute():
+            income_type_id, expense_type_id = resolve_type_ids()
+            queryset, fields = stats_source(request.query_params, self.get_queryset())
+            stats = compute_stats(queryset, income_type_id, expense_type_id, period=period, group_by=group_by, **fields)
+            if group_by == CATEGORY_TREE:
+                stats = rollup_category_tree(stats, get_category_tree(), category_root_id(request.query_params))
+            return stats
+
+        try:
+            stats, hit = STATS_CACHE.get_or_compute(request, compute)
+        except FilterParamsError as e:
+            return Response(e.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(stats, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Поиск транзакций с сортировкой по релевантности
 
-        total_income = queryset.filter(transaction_type__name='Пополнение').aggregate(total=Sum('amount'))['total'] or 0
+        Параметры: search - строка поиска (обязательна), limit - число результатов (до 500),
+        остальные фильтры - как у списка. В ответе у каждой транзакции есть поле rank.
+        """
+        term = request.query_params.get('search', '').strip()
+        if not term:
+            return Response({'detail': 'Не задана строка поиска (search)'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = parse_page_size(request.query_params, 'limit', DEFAULT_SEARCH_RESULTS, MAX_SEARCH_RESULTS)
 
-        total_expense = queryset.filter(transaction_type__name='Списание').aggregate(total=Sum('amount'))['total'] or 0
+        transactions = ranked_search(self.get_queryset(), term, limit)
+        context = {**self.get_serializer_context(), 'references': get_references()}
+        data = self.get_serializer(transactions, many=True, context=context).data
+        for item, transaction in zip(data, transactions, strict=True):
+            item['rank'] = transaction.rank
+        return Response({'count': len(data), 'results': data})
 
-        balance = total_income - total_expense
+    @action(detail=False, methods=['get'], url_path='cache-stats')
+    def cache_stats(self, request):
+        """Попадания и промахи серверного кеша ответов статистики и списков"""
+        return Response(response_cache_metrics())
 
-        return Response(
-            {
-                'total_income': total_income,
-                'total_expense': total_expense,
-                'balance': balance,
-                'transaction_count': queryset.count(),
-            }
-        )
+
+class ReportViewSet(viewsets.ViewSet):
+    """Аналитические отчёты по колоночному снимку транзакций (см. analytics.py)"""
+
+    permission_classes = [AllowAny]
+
+    @action(detail=False, methods=['get'])
+    def pivot(self, request):
+        """Сводная таблица по снимку
+
+        Параметры: rows и columns - измерения (status, transaction_type, category, year, month, month_of_year, day),
+        measure=balance|income|expense|count, top - первые N строк по модулю итога;
+        фильтры - дни и справочники, как у статистики по дневным агрегатам.
+        """
+        try:
+            rows, columns, measure, top, filters = analytics.parse_report(request.query_params)
+            report = analytics.pivot(analytics.get_snapshot(), rows, columns, measure, top, filters)
+        except analytics.ReportParamsError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except analytics.SnapshotUnavailable as e:
+            return Response({'detail': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(report)
+
+    @action(detail=False, methods=['get'])
+    def cashflow(self, request):
+        """Отчёт о движении денежных средств: дерево категорий по месяцам с подытогами
+
+        Параметры - фильтры как у списка транзакций, file_format=json|csv.
+        """
+        fmt = request.query_params.get('file_format', 'json')
+        if fmt not in CASHFLOW_FORMATS:
+            return Response(
+                {'detail': f'Неизвестный формат. Допустимые значения: {", ".join(CASHFLOW_FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        filters = normalize_filters(request.query_params)
+        if filters is None:
+            return Response({'detail': 'Некорректные параметры фильтрации'}, status=status.HTTP_400_BAD_REQUEST)
+
+        def compute():
+            transactions = TransactionFilter(request.query_params, queryset=Transaction.objects.all()).qs
+            return compute_cashflow(request.query_params, transactions, get_category_tree(), get_references(), filters)
+
+        try:
+            report, hit = CASHFLOW_CACHE.get_or_compute(request, compute)
+        except CashflowParamsError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        response = csv_response(report) if fmt == 'csv' else Response(report)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+
+    @action(detail=False, methods=['get', 'post'])
+    def snapshot(self, request):
+        """Состояние снимка; POST обновляет его инкрементально (построение заново - только командой)"""
+        if request.method == 'POST' and request.query_params.get('full') in TRUE_VALUES:
+            return Response(
+                {'detail': 'Снимок строится заново только командой refresh_analytics_snapshot --full'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            if request.method == 'POST':
+                return Response(analytics.refresh(incremental_only=True))
+            return Response(analytics.get_snapshot().describe())
+        except analytics.SnapshotUnavailable as e:
+            return Response({'detail': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
 
 # Django Views для фронтенда
 def home(request):
     """Главная страница с таблицей транзакций"""
-    transactions = Transaction.objects.all().order_by('-date', '-created_at')
+    transactions = Transaction.objects.with_references()
     transaction_filter = TransactionFilter(request.GET, queryset=transactions)
     transactions = transaction_filter.qs
 
-    paginator = Paginator(transactions, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    try:
+        page_obj = keyset_page(transactions, HOME_PAGE_SIZE, request.GET.get('cursor'))
+    except InvalidCursor:
+        page_obj = keyset_page(transactions, HOME_PAGE_SIZE)
 
+    balances = running_balances(page_obj.items, balance_scope(request.GET))
+    for transaction in page_obj:
+        transaction.balance = balances.get(transaction.pk)
+
+    references = get_references()
     context = {
         'page_obj': page_obj,
-        'statuses': Status.objects.all(),
-        'transaction_types': TransactionType.objects.all(),
-        'categories': Category.objects.all(),
+        'querystring': page_querystring(request.GET),
+        'total_count': count_queryset(transactions, settings.TRANSACTION_COUNT_MODE),
+        'statuses': references.statuses,
+        'transaction_types': references.transaction_types,
+        'categories': references.categories,
         'filters': {
             'date_from': request.GET.get('date_from'),
             'date_to': request.GET.get('date_to'),
@@ -153,17 +403,18 @@ def transaction_create(request):
             messages.error(request, f'Ошибка при создании транзакции: {str(e)}')
             logger.exception(e)
 
+    references = get_references()
     context = {
-        'statuses': Status.objects.all(),
-        'transaction_types': TransactionType.objects.all(),
-        'categories': Category.objects.all(),
+        'statuses': references.statuses,
+        'transaction_types': references.transaction_types,
+        'categories': references.categories,
     }
     return render(request, 'transit_managment/transaction_form.html', context)
 
 
 def transaction_edit(request, pk):
     """Редактирование транзакции"""
-    transaction = get_object_or_404(Transaction, pk=pk)
+    transaction = get_object_or_404(Transaction.objects.with_references(), pk=pk)
 
     if request.method == 'POST':
         form_data = request.POST
@@ -181,18 +432,19 @@ def transaction_edit(request, pk):
             messages.error(request, f'Ошибка при обновлении транзакции: {str(e)}')
             logger.exception(e)
 
+    references = get_references()
     context = {
         'transaction': transaction,
-        'statuses': Status.objects.all(),
-        'transaction_types': TransactionType.objects.all(),
-        'categories': Category.objects.all(),
+        'statuses': references.statuses,
+        'transaction_types': references.transaction_types,
+        'categories': references.categories,
     }
     return render(request, 'transit_managment/transaction_form.html', context)
 
 
 def transaction_delete(request, pk):
     """Удаление транзакции"""
-    transaction = get_object_or_404(Transaction, pk=pk)
+    transaction = get_object_or_404(Transaction.objects.with_references(), pk=pk)
 
     if request.method == 'POST':
         transaction.delete()
@@ -205,10 +457,11 @@ def transaction_delete(request, pk):
 
 def reference_management(request):
     """Управление справочниками"""
+    references = get_references()
     context = {
-        'statuses': Status.objects.all(),
-        'transaction_types': TransactionType.objects.all(),
-        'categories': Category.objects.all(),
+        'statuses': references.statuses,
+        'transaction_types': references.transaction_types,
+        'categories': references.categories,
     }
     return render(request, 'transit_managment/reference_management.html', context)
 
@@ -218,7 +471,23 @@ def get_categories_by_type(request):
     """Получение категорий по типу операции для AJAX"""
     transaction_type_id = request.GET.get('transaction_type')
     if transaction_type_id:
-        categories = Category.objects.filter(transaction_type_id=transaction_type_id)
+        try:
+            categories = get_references().categories_of_type(int(transaction_type_id))
+        except ValueError:
+            categories = []
         data = [{'id': cat.id, 'name': cat.name} for cat in categories]
         return JsonResponse(data, safe=False)
     return JsonResponse([], safe=False)
+
+
+def prometheus_metrics(request):
+    """Метрики запросов в текстовом формате Prometheus по токену METRICS_TOKEN; без токена эндпоинта нет"""
+    if not settings.METRICS_TOKEN:
+        raise Http404
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    # За nginx и NAT docker-compose адрес клиента ничего не говорит, поэтому доступ проверяется по токену
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), settings.METRICS_TOKEN.encode()):
+        response = HttpResponse('Нужен заголовок Authorization: Bearer <METRICS_TOKEN>', status=401)
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    return HttpResponse(metrics.export(), content_type=metrics.CONTENT_TYPE)